@@ -6,6 +6,29 @@ import calendar
 from utils import control_user_choice
 from utils import retry_func
 from utils import validate_text
+from utils import intern_text
+from utils import browse_pages
+from Stats import LibraryStats
+from Clock import SystemClock
+from CommandLog import CommandLog
+from Snapshot import SnapshotManager
+from Recommendations import BorrowedTogether
+from Popularity import PopularityTracker
+from ChangeFeed import ChangeFeed
+from ChangeFeed import book_data
+from ChangeFeed import plain_value
+from Transactions import TransactionManager
+from Indexes import ReleaseDateIndex
+from Indexes import FacetIndex
+from Indexes import SortedIndex
+from Filters import ScalableBloomFilter
+from Tracing import Tracer
+from Tracing import traced
+from Indexes import bitmap_to_ids
+from Indexes import intersect_facets
+
+# Book IDs are chosen from 0 to MAX_BOOK_IDS - 1, so this is also the most books one branch can hold
+MAX_BOOK_IDS = 300
 
 
 class Books:
@@ -61,13 +84,13 @@ class Books:
             author = input("Enter here: ")
             validate_author = validate_text(author, "Author")
             print("Author accepted.")
-            return validate_author
+            return intern_text(validate_author)
         elif edit:
             print("Please enter the new author for this Book")
             new_author = input("Enter here: ")
             validate_new_author = validate_text(new_author, "New Author")
             print("New author accepted")
-            return validate_new_author
+            return intern_text(validate_new_author)
 
     def set_publisher(self, edit):
         """Takes user input to set the Publisher of the Book."""
@@ -76,13 +99,13 @@ class Books:
             publisher = input("Enter here: ")
             validate_publisher = validate_text(publisher, "Publisher")
             print("Publisher accepted.")
-            return validate_publisher
+            return intern_text(validate_publisher)
         elif edit:
             print("Please enter the new publisher for this Book")
             new_publisher = input("Enter here: ")
             validate_new_publisher = validate_text(new_publisher, "New Publisher")
             print("New publisher accepted")
-            return validate_new_publisher
+            return intern_text(validate_new_publisher)
 
     def set_stock(self, edit):
         """Takes user input to set stock of the Book."""
@@ -104,10 +127,10 @@ class Books:
             except ValueError:
                 print("Amount cannot be empty and must be a number. Please try again.")
 
-    def set_year(self):
-        """Takes user to set the year the book was published."""
+    def set_year(self, clock):
+        """Takes user to set the year the book was published. Uses clock to get the current year."""
         print("Please input the year the book was released. E.g. 2010")
-        current_year = datetime.now().year
+        current_year = clock.now().year
         while True:
             try:
                 year = int(input("Enter here: "))
@@ -161,15 +184,15 @@ class Books:
             except ValueError:
                 print("Please input a number.")
 
-    def set_release_date(self, edit):
-        """Takes user input to set the release date of the Book."""
+    def set_release_date(self, edit, clock):
+        """Takes user input to set the release date of the Book. Passes clock on to set_year."""
         if not edit:
             print("Please set the release date information for this new book")
 
         elif edit:
             print("Please set the updated release date information for this book.")
 
-        book_year = self.set_year()
+        book_year = self.set_year(clock)
         book_month = self.set_month()
         book_day = self.set_day()
 
@@ -217,30 +240,198 @@ class BookList:
     - Save books in a dictionary for easy lookup
 
     - books_dict (dict) stores our books objects, using the book title as its key.
+    - stats (LibraryStats) keeps running totals of the collection, shared with the UserList and Loans classes.
+    - release_index (ReleaseDateIndex) keeps the books sorted by release date for searching by date.
+    - author_index, publisher_index (FacetIndex) group book IDs by author and publisher for browsing.
+    - book_titles (dict) maps each book ID to its current title, used to turn book IDs back into books.
+    - id_order, title_order (SortedIndex) keep the books sorted by book ID and by title, for browsing the
+      whole collection a page at a time.
+    - title_filter (ScalableBloomFilter) rules out titles that are not in the collection without looking in
+      books_dict, which may be stored on disk.
+    - clock (SystemClock) provides the current date, and can be replaced with a SimulatedClock.
+    - command_log (CommandLog) records each change to a book so it can be undone, shared with the UserList class.
+    - snapshots (SnapshotManager) gives long running reports a consistent view while books continue to change.
+      Must be told before any book attribute is changed, including stock changes made by the Loans class.
+    - federation (BranchFederation) is told about every stock change when this branch is part of a federation
+      of library branches, using branch_name to identify this branch. None when there is only one branch.
+    - loans (Loans) is told when a book is renamed, so its active loans move to the new title. Set by the Loans
+      class, None until then.
+    - recommendations (BorrowedTogether) tracks which books are borrowed by the same users. Updated by the
+      Loans class and shown when searching for a book.
+    - popularity (PopularityTracker) scores each book by its recent checkouts and keeps the trending titles.
+      Updated by the Loans class.
+    - feed (ChangeFeed) publishes every change to a book for other systems to follow, shared with the UserList
+      and Loans classes.
+    - transactions (TransactionManager) groups changes so they are kept or undone together, shared with the
+      UserList and Loans classes.
+    - tracer (Tracer) times the core book operations and profiles any that are slow, shared with the UserList
+      and Loans classes.
 
     - Leverages retry_func from utils.py, which provides the user the choice to retry whatever
       process they were performing. i.e. title was not found, retry.
     """
 
-    def __init__(self):
+    def __init__(self, stats=None, clock=None, command_log=None, feed=None, transactions=None, tracer=None):
         self.books_dict = {}
-
+        self.stats = stats if stats is not None else LibraryStats()
+        self.clock = clock if clock is not None else SystemClock()
+        self.command_log = command_log if command_log is not None else CommandLog()
+        self.snapshots = SnapshotManager()
+        self.release_index = ReleaseDateIndex()
+        self.author_index = FacetIndex("author")
+        self.publisher_index = FacetIndex("publisher")
+        self.book_titles = {}
+        self.id_order = SortedIndex()
+        self.title_order = SortedIndex()
+        self.title_filter = ScalableBloomFilter()
+        self.federation = None
+        self.branch_name = None
+        self.loans = None
+        self.recommendations = BorrowedTogether()
+        self.popularity = PopularityTracker(self.clock)
+        self.feed = feed if feed is not None else ChangeFeed()
+        self.transactions = transactions if transactions is not None else TransactionManager(self.feed)
+        self.tracer = tracer if tracer is not None else Tracer()
+
+    @traced
     def save_book(self, title, new_book):
-        """Saves a book to the book's dictionary using the books title as the key."""
-        self.books_dict[title] = new_book
+        """
+        Saves a book to the book's dictionary using the books title as the key. Raises a ValueError if another
+        book already has the title, as saving over it would leave the old book in the statistics and indexes.
+        """
+        self.transactions.check_writable()
+        self.check_title_free(title)
+        with self.snapshots.change():
+            self.snapshots.before_title_added(title)
+            self.books_dict[title] = new_book
+        self.index_book(new_book)
+        self.transactions.record_undo(self.delete_book, new_book)
+        self.feed.publish("book", "add", book_data(new_book))
+
+    def index_book(self, book):
+        """Adds a book that is already in the book's dictionary to the statistics and indexes."""
+        self.stats.book_added(book)
+        self.release_index.add(book)
+        self.author_index.add(book)
+        self.publisher_index.add(book)
+        self.book_titles[book.book_id] = book.title
+        self.id_order.add((book.book_id, book.title))
+        self.title_order.add((book.title, book.book_id))
+        self.title_filter.add(book.title)
+        if self.federation:
+            self.federation.stock_changed(self.branch_name, book.title, book.stock)
+
+    @traced
+    def delete_book(self, book):
+        """Deletes a book from the book's dictionary."""
+        self.transactions.check_writable()
+        with self.snapshots.change():
+            self.snapshots.before_book_change(book)
+            del self.books_dict[book.title]
+        self.stats.book_removed(book)
+        self.release_index.remove(book)
+        self.author_index.remove(book)
+        self.publisher_index.remove(book)
+        del self.book_titles[book.book_id]
+        self.id_order.remove((book.book_id, book.title))
+        self.title_order.remove((book.title, book.book_id))
+        if self.federation:
+            self.federation.book_removed(self.branch_name, book.title)
+        self.transactions.record_undo(self.save_book, book.title, book)
+        self.feed.publish("book", "remove", {"book_id": book.book_id, "title": book.title})
+
+    @traced
+    def update_book(self, book, attribute, new_value):
+        """
+        Changes a single attribute of an existing book. When the title changes, the book and its active loans
+        are moved to the new title so they can still be found by title. Raises a ValueError if another book
+        already has the new title.
+        """
+        self.transactions.check_writable()
+        old_value = getattr(book, attribute)
+        old_title = book.title
+        reindex = attribute in ("title", "release_date")
+
+        if attribute == "title" and new_value != old_value:
+            self.check_title_free(new_value)
+
+        if reindex:
+            self.release_index.remove(book)
+        elif attribute == "author":
+            self.author_index.remove(book)
+        elif attribute == "publisher":
+            self.publisher_index.remove(book)
+
+        # The book, its dictionary key and its loans change together, so a snapshot never sees only some of them
+        with self.snapshots.change():
+            self.snapshots.before_book_change(book)
+            if attribute == "title":
+                self.snapshots.before_title_added(new_value)
+                del self.books_dict[old_value]
+                self.books_dict[new_value] = book
+                if self.loans:
+                    self.loans.rename_loans(old_value, new_value)
+            setattr(book, attribute, new_value)
+
+        if attribute == "title":
+            self.book_titles[book.book_id] = new_value
+            self.id_order.remove((book.book_id, old_value))
+            self.id_order.add((book.book_id, new_value))
+            self.title_order.remove((old_value, book.book_id))
+            self.title_order.add((new_value, book.book_id))
+            self.title_filter.add(new_value)
+            self.recommendations.rename_title(old_value, new_value)
+
+        if reindex:
+            self.release_index.add(book)
+        elif attribute == "author":
+            self.author_index.add(book)
+        elif attribute == "publisher":
+            self.publisher_index.add(book)
+
+        self.stats.book_updated(attribute, old_value, new_value)
+
+        if self.federation and attribute in ("title", "stock"):
+            if attribute == "title":
+                self.federation.book_removed(self.branch_name, old_value)
+            self.federation.stock_changed(self.branch_name, book.title, book.stock)
+
+        self.transactions.record_undo(self.update_book, book, attribute, old_value)
+        self.feed.publish("book", "update", {"book_id": book.book_id, "title": old_title, "attribute": attribute,
+                                             "value": plain_value(new_value)})
+
+    @traced
+    def change_loan_stock(self, book, amount):
+        """
+        Changes the stock of a book when a copy is borrowed (amount=-1) or returned (amount=1). Used by the
+        Loans class instead of update_book, as a borrowed copy is still owned by the library and is counted
+        separately in the statistics.
+        """
+        self.transactions.check_writable()
+        with self.snapshots.change():
+            self.snapshots.before_book_change(book)
+            book.stock += amount
+        if self.federation:
+            self.federation.stock_changed(self.branch_name, book.title, book.stock)
+        self.transactions.record_undo(self.change_loan_stock, book, -amount)
+
+    def edit_book(self, book, attribute, new_value):
+        """Edits a book attribute from the editor menu, recording the change so it can be undone."""
+        self.command_log.record("book", "update", book, attribute, getattr(book, attribute), new_value)
+        self.update_book(book, attribute, new_value)
 
     def gen_book_id(self):
-        """Generates a random book ID when we create new book objects."""
-
-        # Get existing book IDs to ensure no duplicates
-        get_existing_book_ids = set()
-        for book in self.books_dict.values():
-            get_existing_book_ids.add(book.book_id)
+        """
+        Generates a random book ID when we create new book objects. Raises a ValueError if every book ID is
+        already in use.
+        """
+        if len(self.book_titles) >= MAX_BOOK_IDS:
+            raise ValueError(f"All {MAX_BOOK_IDS} book IDs are in use.")
 
-        # Generate the random ID
+        # Generate the random ID, checking existing book IDs to ensure no duplicates
         while True:
-            book_id = random.randint(0, 299)
-            if book_id not in get_existing_book_ids:
+            book_id = random.randint(0, MAX_BOOK_IDS - 1)
+            if book_id not in self.book_titles:
                 return book_id  # Returns the book id to be passed on add_new_book
 
     def add_new_book(self):
@@ -250,7 +441,11 @@ class BookList:
         If 'edit' is True, the setter method allows the user to change an existing book attribute.
         """
 
-        book_id = self.gen_book_id()
+        try:
+            book_id = self.gen_book_id()
+        except ValueError as error:
+            print(f"{error} Remove a book before adding a new one.")
+            return
         print(f"New book was created with ID: {book_id}")
 
         # Calls our Books class with default values in which we will later set when we call the setter methods.
@@ -258,14 +453,33 @@ class BookList:
 
         # Call the setter methods to set each book attribute.
         new_book.title = new_book.set_title(edit=False)
+        try:
+            self.check_title_free(new_book.title)
+        except ValueError as error:
+            print(error)
+            print("Returning to Books Menu")
+            return
         new_book.author = new_book.set_author(edit=False)
         new_book.publisher = new_book.set_publisher(edit=False)
         new_book.stock = new_book.set_stock(edit=False)
-        new_book.release_date = new_book.set_release_date(edit=False)
+        new_book.release_date = new_book.set_release_date(edit=False, clock=self.clock)
 
         # Call the save book method to add the book to our dictionary.
         print(f"A new book titled: '{new_book.title}' was successfully added to the collection.")
         self.save_book(new_book.title, new_book)
+        self.command_log.record("book", "add", new_book)
+
+    def check_title_free(self, title):
+        """Raises a ValueError if a book with the given title is already in the collection."""
+        if title in self.title_filter and title in self.books_dict:
+            raise ValueError(f"A book titled '{title}' is already in the collection.")
+
+    @traced
+    def find_book(self, title):
+        """Returns the book with the given title, or None. Titles ruled out by title_filter are not looked up."""
+        if title not in self.title_filter:
+            return None
+        return self.books_dict.get(title)
 
     def lookup_book(self):
         """
@@ -281,10 +495,11 @@ class BookList:
             title_to_find = input("Enter here: ")
             validate_title = validate_text(title_to_find, "Title")
 
-            if validate_title in self.books_dict:
-                return self.books_dict[validate_title]  # Returns the book object with the book title as its key.
+            book = self.find_book(validate_title)
+            if book:
+                return book  # Returns the book object with the book title as its key.
 
-            elif validate_title not in self.books_dict:
+            else:
                 print(f"No book was found with title: {validate_title}. Try again?")
                 if not retry_func("Retry search"):
                     return False
@@ -310,6 +525,13 @@ class BookList:
         print(f"Publisher: {book.publisher}")
         print(f"Number in stock: {book.stock}")
         print(f"Release date: {book.release_date}")
+
+        # Books removed since they were borrowed are left out until the recommendations are next rebuilt
+        related_titles = [title for title in self.recommendations.find_related(book.title) if title in self.books_dict]
+        if related_titles:
+            print("Patrons who borrowed this also borrowed:")
+            for title in related_titles:
+                print(f"- {title}")
         return
 
     def remove_book(self):
@@ -327,7 +549,8 @@ class BookList:
         print(f"'{book}' was found.")
         print("Are you sure you want to remove this Book?")
         if retry_func("Remove Book"):  # Calls retry_func from utils.py to allow the user to try again.
-            del self.books_dict[book.title]
+            self.delete_book(book)
+            self.command_log.record("book", "remove", book)
             print(f"{book} was removed from the Library Collection.")
             print("Returning to Books Menu")
             return
@@ -349,6 +572,135 @@ class BookList:
         else:
             print(f"There are {len(self.books_dict)} Books in the Collection.")
 
+        print(f"{self.stats.total_copies()} copies in total, {self.stats.copies_on_loan} currently on loan.")
+
+    def set_year_range(self):
+        """Takes user input for a first and last year, used to search for books by their release date."""
+        while True:
+            try:
+                print("Please input the first year to search from. E.g. 1990")
+                first_year = int(input("Enter here: "))
+                print("Please input the last year to search to. E.g. 2010")
+                last_year = int(input("Enter here: "))
+
+                if not (1 <= first_year <= last_year <= 9998):
+                    print("Years must be 4 numbers and the first year must not be after the last year.")
+                else:
+                    return first_year, last_year
+
+            except ValueError:
+                print("Year cannot be empty and must be numbers only.")
+
+    def browse_by_release_date(self):
+        """
+        Displays the books released between two years, how many books were released in each of those years,
+        and the newest books in the collection. Uses release_index so only matching books are looked at.
+        """
+        if not self.release_index.entries:
+            print("There are no Books with a release date in the Library System.")
+            return
+
+        first_year, last_year = self.set_year_range()
+
+        print(f"--- Books released between {first_year} and {last_year} ---")
+        found = False
+        for title in self.release_index.find_between(date(first_year, 1, 1), date(last_year, 12, 31)):
+            found = True
+            print(f"'{title}' released on {self.books_dict[title].release_date}")
+
+        if not found:
+            print("No books were released between these years.")
+            return
+
+        print("\nNumber of books released each year:")
+        for year, count in self.release_index.count_by_year(first_year, last_year).items():
+            if count:
+                print(f"{year}: {count}")
+
+        print("\nThe newest books in the collection are:")
+        for title in self.release_index.find_newest(5):
+            print(f"'{title}' released on {self.books_dict[title].release_date}")
+
+    def browse_by_facet(self):
+        """
+        Displays every book by a specific author, a specific publisher, or both. Uses author_index and
+        publisher_index so only matching books are looked at, and combines the two with intersect_facets.
+        """
+        if not self.books_dict:
+            print("There are no Books in the Library System.")
+            return
+
+        print("Would you like to browse books by author, publisher, or both?")
+        print("1 - Author")
+        print("2 - Publisher")
+        print("3 - Author and Publisher")
+        user_choice = control_user_choice("Enter here: ", range(1, 4))
+
+        bitmaps = []
+        if user_choice in (1, 3):
+            print("Please input the Author to browse.")
+            author = validate_text(input("Enter here: "), "Author")
+            print(f"There are {self.author_index.count(author)} Book(s) by {author}.")
+            bitmaps.append(self.author_index.lookup(author))
+
+        if user_choice in (2, 3):
+            print("Please input the Publisher to browse.")
+            publisher = validate_text(input("Enter here: "), "Publisher")
+            print(f"There are {self.publisher_index.count(publisher)} Book(s) published by {publisher}.")
+            bitmaps.append(self.publisher_index.lookup(publisher))
+
+        matches = intersect_facets(*bitmaps)
+        if not matches:
+            print("No books were found.")
+            return
+
+        print("--- Displaying matching Books ---")
+        for book_id in bitmap_to_ids(matches):
+            book = self.books_dict[self.book_titles[book_id]]
+            print(f"'{book.title}' by {book.author}, published by {book.publisher}")
+
+    def browse_all_books(self):
+        """
+        Displays every book in the collection a page at a time, sorted by title or by book ID.
+        Uses title_order or id_order, so each page only looks at the books on that page.
+        """
+        if not self.books_dict:
+            print("There are no Books in the Library System.")
+            return
+
+        print("Would you like to browse books by title or by book ID?")
+        print("1 - Title")
+        print("2 - Book ID")
+        user_choice = control_user_choice("Enter here: ", range(1, 3))
+
+        if user_choice == 1:
+            order = self.title_order
+            title_position = 0
+        else:
+            order = self.id_order
+            title_position = 1
+
+        def display_entry(entry):
+            book = self.books_dict[entry[title_position]]
+            print(f"{book.book_id} - '{book.title}' by {book.author}, {book.stock} in stock")
+
+        browse_pages(order.find_page, display_entry)
+
+    def display_trending_books(self):
+        """
+        Displays the 50 most borrowed books right now, with recent checkouts counting for more than older ones.
+        Uses popularity, so the list is ready without counting every loan.
+        """
+        # Books removed from the collection are still counted, so they are left out here
+        trending = [(title, score) for title, score in self.popularity.trending(50) if self.find_book(title)]
+        if not trending:
+            print("No books have been borrowed yet.")
+            return
+
+        print("--- Trending Books ---")
+        for position, (title, score) in enumerate(trending, start=1):
+            print(f"{position} - '{title}' (popularity {score:.1f})")
+
     def edit_book_sub_menu(self):
         """
         Provides a sub menu for editing book attributes such as changing a books title or author.
@@ -382,31 +734,34 @@ class BookList:
             if user_choice == 1:
                 print(f"The book for edit currently has the title: '{book_to_edit}'")
                 new_title = book_to_edit.set_title(edit=True)
-                book_to_edit.title = new_title
+                if new_title != book_to_edit.title and self.find_book(new_title):
+                    print(f"A book titled '{new_title}' is already in the collection. The title was not changed.")
+                    continue
+                self.edit_book(book_to_edit, "title", new_title)
                 print(f"Title was successfully updated to {new_title}")
 
             elif user_choice == 2:
                 print(f"The book for edit currently has the author: {book_to_edit.author}")
                 new_author = book_to_edit.set_author(edit=True)
-                book_to_edit.author = new_author
+                self.edit_book(book_to_edit, "author", new_author)
                 print(f"Author was successfully updated to {new_author}")
 
             elif user_choice == 3:
                 print(f"The book for edit currently has release date set to {book_to_edit.release_date}")
-                new_release_date = book_to_edit.set_release_date(edit=True)
-                book_to_edit.release_date = new_release_date
+                new_release_date = book_to_edit.set_release_date(edit=True, clock=self.clock)
+                self.edit_book(book_to_edit, "release_date", new_release_date)
                 print(f"Release date has been successfully changed to {new_release_date}")
 
             elif user_choice == 4:
                 print(f"The book for edit currently has the publisher: {book_to_edit.publisher}")
                 new_publisher = book_to_edit.set_publisher(edit=True)
-                book_to_edit.publisher = new_publisher
+                self.edit_book(book_to_edit, "publisher", new_publisher)
                 print(f"Publisher was successfully updated to {new_publisher}")
 
             elif user_choice == 5:
                 print(f"The book for edit currently has {book_to_edit.stock} book(s) in stock.")
                 new_stock = book_to_edit.set_stock(edit=True)
-                book_to_edit.stock = new_stock
+                self.edit_book(book_to_edit, "stock", new_stock)
                 print(f"The stock amount has been changed to {new_stock}")
 
             elif user_choice == 6:
@@ -422,6 +777,10 @@ class BookList:
         - Removing a specific book by its title
         - Counting the total number of books in our books dictionary
         - Editing book attributes
+        - Browsing books by their release date
+        - Browsing books by author and/or publisher
+        - Browsing every book a page at a time
+        - Displaying the trending books
 
         - control_user_choice is utilised to safely navigate the Book sub menu.
         """
@@ -433,10 +792,14 @@ class BookList:
             print("3 - Remove Book from Library")
             print("4 - Count Total Books")
             print("5 - Edit Book")
-            print("6 - Return to Main Menu")
+            print("6 - Browse Books by Release Date")
+            print("7 - Browse Books by Author or Publisher")
+            print("8 - Browse All Books")
+            print("9 - Trending Books")
+            print("10 - Return to Main Menu")
 
             # Gets the users choice and ensures valid input by calling control_user_choice from utils.py
-            user_choice = control_user_choice("Enter here: ", range(1, 7))
+            user_choice = control_user_choice("Enter here: ", range(1, 11))
 
             # Takes the user to the appropriate sub menu or quits the programme
             if user_choice == 1:
@@ -455,5 +818,17 @@ class BookList:
                 self.edit_book_sub_menu()
 
             elif user_choice == 6:
+                self.browse_by_release_date()
+
+            elif user_choice == 7:
+                self.browse_by_facet()
+
+            elif user_choice == 8:
+                self.browse_all_books()
+
+            elif user_choice == 9:
+                self.display_trending_books()
+
+            elif user_choice == 10:
                 print("Returning to Main Menu..")
                 return
@@ -0,0 +1,176 @@
+import threading
+from collections import deque
+from datetime import date
+
+
+def plain_value(value):
+    """Converts dates to ISO format strings so every change can be written out as plain text, e.g. as JSON."""
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def book_data(book):
+    """Returns the attributes of a book as a dictionary of plain values."""
+    return {
+        "title": book.title,
+        "author": book.author,
+        "book_id": book.book_id,
+        "publisher": book.publisher,
+        "stock": book.stock,
+        "release_date": plain_value(book.release_date),
+    }
+
+
+def user_data(user):
+    """Returns the attributes of a user as a dictionary of plain values."""
+    return {
+        "username": user.username,
+        "firstname": user.firstname,
+        "surname": user.surname,
+        "house_number": user.house_number,
+        "street_name": user.street_name,
+        "postcode": user.postcode,
+        "email_address": user.email_address,
+        "date_of_birth": plain_value(user.date_of_birth),
+    }
+
+
+class Subscription:
+    """
+    A consumer of the change feed, e.g. a reporting or notification system. Contains the following attributes:
+
+    - name (str) - The name of the consumer
+    - pending (deque) - Changes waiting to be fetched, up to max_pending
+    - last_sequence (int) - The sequence number of the last change fetched by the consumer
+    - overflowed (bool) - True when the consumer fell too far behind and changes were not added to pending
+
+    Publishing never waits for a slow consumer. When pending is full, new changes are not added, and the
+    consumer catches up from the feed's retained changes the next time it fetches.
+    """
+
+    def __init__(self, name, last_sequence, max_pending):
+        self.name = name
+        self.pending = deque()
+        self.last_sequence = last_sequence
+        self.max_pending = max_pending
+        self.overflowed = False
+
+
+class ChangeFeed:
+    """
+    An ordered feed of every change made to books, users and loans, so other systems can follow changes
+    without comparing copies of the dictionaries. Contains the following attributes:
+
+    - sequence (int) - The sequence number of the most recent change. Each change gets the next number.
+    - retained (deque) - The most recent changes, up to max_retained, used by consumers to catch up
+    - subscriptions (dict) - Every consumer of the feed, using the consumer name as the key
+    - held (list) - Changes made inside a transaction open in the calling thread, published only if it
+      commits. None otherwise. Each thread has its own, so other threads keep publishing straight away.
+
+    Each change is a dictionary:
+    {"sequence": 1, "record_type": "book", "action": "add", "data": {...}}
+
+    - record_type: "book", "user" or "loan"
+    - action: "add", "remove" or "update" for books and users, "borrow" or "return" for loans
+    - data: The plain values needed to apply the change elsewhere, e.g. every attribute of a new book
+    """
+
+    def __init__(self, max_retained=10000):
+        self.sequence = 0
+        self.retained = deque(maxlen=max_retained)
+        self.subscriptions = {}
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.published = threading.Condition(self.lock)
+
+    @property
+    def held(self):
+        """The changes held back by a transaction open in the calling thread, or None."""
+        return getattr(self.local, "held", None)
+
+    @held.setter
+    def held(self, changes):
+        self.local.held = changes
+
+    def publish(self, record_type, action, data):
+        """
+        Adds a change to the feed and to the pending changes of every consumer that is keeping up.
+        Returns the change, or None if it is being held back until a transaction commits.
+        """
+        if self.held is not None:
+            self.held.append((record_type, action, data))
+            return None
+
+        with self.lock:
+            self.sequence += 1
+            change = {"sequence": self.sequence, "record_type": record_type, "action": action, "data": data}
+            self.retained.append(change)
+
+            for subscription in self.subscriptions.values():
+                if subscription.overflowed:
+                    continue
+                if len(subscription.pending) < subscription.max_pending:
+                    subscription.pending.append(change)
+                else:
+                    subscription.overflowed = True
+            self.published.notify_all()
+        return change
+
+    def subscribe(self, name, from_sequence=None, max_pending=1000):
+        """
+        Adds a consumer to the feed. from_sequence is the sequence number of the last change the consumer has
+        already seen, so it can resume where it left off. If None, the consumer only receives new changes.
+        """
+        with self.lock:
+            last_sequence = self.sequence if from_sequence is None else from_sequence
+            subscription = Subscription(name, last_sequence, max_pending)
+            # Changes the consumer has missed are read from the retained changes on the first fetch
+            subscription.overflowed = last_sequence < self.sequence
+            self.subscriptions[name] = subscription
+        return subscription
+
+    def unsubscribe(self, name):
+        """Removes a consumer from the feed."""
+        with self.lock:
+            self.subscriptions.pop(name, None)
+
+    def wait_for_changes(self, sequence, timeout=None):
+        """Waits up to timeout seconds for a change after the given sequence number. Returns True if there is one."""
+        with self.published:
+            return self.published.wait_for(lambda: self.sequence > sequence, timeout)
+
+    def changes_since(self, sequence, max_changes):
+        """
+        Returns up to max_changes retained changes after the given sequence number. Raises a LookupError if
+        changes after that sequence number are no longer retained, in which case the consumer must start again.
+        """
+        if not self.retained or sequence >= self.sequence:
+            return []
+
+        first_sequence = self.retained[0]["sequence"]
+        if sequence + 1 < first_sequence:
+            raise LookupError(f"Changes after sequence {sequence} are no longer retained.")
+
+        start = sequence + 1 - first_sequence
+        end = min(start + max_changes, len(self.retained))
+        return [self.retained[position] for position in range(start, end)]
+
+    def fetch(self, name, max_changes=100):
+        """Returns the next batch of up to max_changes changes for a consumer, oldest first."""
+        with self.lock:
+            subscription = self.subscriptions[name]
+
+            if subscription.overflowed:
+                batch = self.changes_since(subscription.last_sequence, max_changes)
+                subscription.pending.clear()
+                if subscription.last_sequence + len(batch) >= self.sequence:
+                    subscription.overflowed = False
+            else:
+                batch = []
+                while subscription.pending and len(batch) < max_changes:
+                    batch.append(subscription.pending.popleft())
+
+            if batch:
+                subscription.last_sequence = batch[-1]["sequence"]
+        return batch
@@ -0,0 +1,66 @@
+from datetime import datetime
+
+
+class SystemClock:
+    """
+    Provides the current date and time to the Library System. Every class that needs the current time
+    is given a clock instead of calling datetime.now() directly, so a SimulatedClock can be used instead.
+    """
+
+    def now(self):
+        """Returns the current date and time."""
+        return datetime.now()
+
+    def today(self):
+        """Returns the current date."""
+        return datetime.now().date()
+
+
+class SimulatedClock:
+    """
+    A clock that only moves when it is told to. Used to run the Library System in simulated time, e.g. to
+    model months of borrowing and returning in a few seconds.
+
+    - current_time (datetime) - The simulated date and time, which starts at start_time
+    """
+
+    def __init__(self, start_time=None):
+        self.current_time = start_time if start_time else datetime.now()
+
+    def now(self):
+        """Returns the simulated date and time."""
+        return self.current_time
+
+    def today(self):
+        """Returns the simulated date."""
+        return self.current_time.date()
+
+    def advance_to(self, new_time):
+        """Moves the simulated time forward to new_time. Time can never go backwards."""
+        if new_time > self.current_time:
+            self.current_time = new_time
+
+    def advance_by(self, amount):
+        """Moves the simulated time forward by a timedelta."""
+        self.current_time += amount
+
+
+class ReplayClock(SystemClock):
+    """
+    The current date and time, except while a change copied from another Library System is being applied, when
+    it is the time the change was made there. Used by replication followers, so a copied loan has the same
+    rented, due and returned dates as the original.
+
+    - replay_time (datetime) - The time of the change being applied, or None
+    """
+
+    def __init__(self):
+        self.replay_time = None
+
+    def now(self):
+        """Returns the time of the change being applied, or the current date and time."""
+        return self.replay_time if self.replay_time is not None else datetime.now()
+
+    def today(self):
+        """Returns the date of the change being applied, or the current date."""
+        return self.now().date()
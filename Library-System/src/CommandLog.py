@@ -0,0 +1,141 @@
+import sys
+from collections import deque
+
+
+class CommandLog:
+    """
+    Records every change made to books and users so changes can be undone and redone. Contains the following
+    attributes:
+
+    - undo_log (deque) - The most recent changes, oldest first
+    - redo_log (list) - Changes that have been undone, most recently undone last
+    - max_changes (int) - The most changes kept in the undo log, the oldest are forgotten first
+    - max_bytes (int) - The most memory the undo log may use, the oldest changes are forgotten first
+    - memory_used (int) - The memory currently used by the undo log, in bytes
+
+    Each change is a small tuple that only holds what changed, not a copy of the whole book or user:
+    (record_type, action, record, attribute, old_value, new_value)
+
+    - record_type: "book" or "user"
+    - action: "add", "remove" or "update"
+    - record: The Books or Users object that was changed
+    - attribute, old_value, new_value: The attribute that was updated and its values, None for add/remove
+
+    Undoing or redoing a change only touches the one record that changed.
+    """
+
+    def __init__(self, max_changes=100, max_bytes=64 * 1024):
+        self.undo_log = deque()
+        self.redo_log = []
+        self.max_changes = max_changes
+        self.max_bytes = max_bytes
+        self.memory_used = 0
+
+    def change_size(self, change):
+        """
+        Returns the memory used by a change in bytes. The record itself is not counted as it is shared
+        with the books or users dictionary rather than copied.
+        """
+        record_type, action, record, attribute, old_value, new_value = change
+        return sys.getsizeof(change) + sys.getsizeof(old_value) + sys.getsizeof(new_value)
+
+    def record(self, record_type, action, record, attribute=None, old_value=None, new_value=None):
+        """Records a new change. Any changes that were undone can no longer be redone."""
+        change = (record_type, action, record, attribute, old_value, new_value)
+        self.undo_log.append(change)
+        self.memory_used += self.change_size(change)
+        self.redo_log.clear()
+
+        # Forget the oldest changes once the log is full
+        while len(self.undo_log) > self.max_changes or self.memory_used > self.max_bytes:
+            self.memory_used -= self.change_size(self.undo_log.popleft())
+
+    def describe(self, change):
+        """Returns a description of a change, used to display the change to the user."""
+        record_type, action, record, attribute, old_value, new_value = change
+        if action == "update":
+            return f"{record_type} '{record}' {attribute} changed from '{old_value}' to '{new_value}'"
+        elif action == "add":
+            return f"{record_type} '{record}' added"
+        return f"{record_type} '{record}' removed"
+
+    def apply_change(self, change, book_list, user_list, undo):
+        """
+        Applies a change to the book or user list, or reverses it if undo is True. Returns False without
+        changing anything if the record has since been changed in a way that makes this impossible, e.g. a
+        removed book cannot be added back if another book now has the same title, and an edit is not undone
+        if the attribute has been changed again since, e.g. by a book being borrowed.
+        """
+        record_type, action, record, attribute, old_value, new_value = change
+        if action == "update" and getattr(record, attribute) != (new_value if undo else old_value):
+            return False
+
+        if action == "update":
+            action_to_apply = "update"
+        elif (action == "add") == undo:
+            action_to_apply = "remove"
+        else:
+            action_to_apply = "add"
+
+        if record_type == "book":
+            in_collection = book_list.books_dict.get(record.title) is record
+            if action_to_apply == "add":
+                if record.title in book_list.books_dict or record.book_id in book_list.book_titles:
+                    return False
+                book_list.save_book(record.title, record)
+            elif not in_collection:
+                return False
+            elif action_to_apply == "remove":
+                book_list.delete_book(record)
+            else:
+                value = old_value if undo else new_value
+                if attribute == "title" and value in book_list.books_dict:
+                    return False
+                book_list.update_book(record, attribute, value)
+
+        else:
+            in_system = user_list.users_dict.get(record.username) is record
+            if action_to_apply == "add":
+                if record.username in user_list.users_dict:
+                    return False
+                user_list.save_user(record.username, record)
+            elif not in_system:
+                return False
+            elif action_to_apply == "remove":
+                user_list.delete_user(record.username)
+            else:
+                user_list.update_user(record, attribute, old_value if undo else new_value)
+
+        return True
+
+    def undo(self, book_list, user_list):
+        """
+        Undoes the most recent change. Returns the change, None if there was nothing to undo, or False if the
+        change could not be undone, in which case it is forgotten.
+        """
+        if not self.undo_log:
+            return None
+
+        change = self.undo_log.pop()
+        self.memory_used -= self.change_size(change)
+        if not self.apply_change(change, book_list, user_list, undo=True):
+            return False
+
+        self.redo_log.append(change)
+        return change
+
+    def redo(self, book_list, user_list):
+        """
+        Redoes the most recently undone change. Returns the change, None if there was nothing to redo, or False
+        if the change could not be redone, in which case it is forgotten.
+        """
+        if not self.redo_log:
+            return None
+
+        change = self.redo_log.pop()
+        if not self.apply_change(change, book_list, user_list, undo=False):
+            return False
+
+        self.undo_log.append(change)
+        self.memory_used += self.change_size(change)
+        return change
@@ -0,0 +1,96 @@
+from difflib import SequenceMatcher
+
+
+class DuplicateDetector:
+    """
+    Finds users that may be the same person signed up more than once under different usernames.
+    Comparing every user with every other user would be far too slow, so users are grouped by blocking keys
+    and only users that share a key are compared. Contains the following attributes:
+
+    - blocks (dict) - Maps each blocking key to the set of usernames with that key
+    - threshold (float) - The similarity score (0-1) at which two users are reported as possible duplicates
+
+    Each user has two blocking keys:
+    - Their surname and date of birth, e.g. ("name", "smith", 1990-05-05)
+    - Their postcode and house number, e.g. ("address", "SW1A 1AA", 12)
+
+    Users sharing a key are scored on how similar their full names and email addresses are.
+    """
+
+    def __init__(self, threshold=0.75):
+        self.blocks = {}
+        self.threshold = threshold
+
+    def blocking_keys(self, user):
+        """Returns the blocking keys for a user."""
+        return [
+            ("name", user.surname.strip().lower(), user.date_of_birth),
+            ("address", user.postcode, user.house_number),
+        ]
+
+    def add(self, user):
+        """Adds a user to the block for each of their blocking keys."""
+        for key in self.blocking_keys(user):
+            self.blocks.setdefault(key, set()).add(user.username)
+
+    def remove(self, user):
+        """Removes a user from the block for each of their blocking keys."""
+        for key in self.blocking_keys(user):
+            usernames = self.blocks.get(key)
+            if usernames is None:
+                continue
+            usernames.discard(user.username)
+            if not usernames:
+                del self.blocks[key]
+
+    def similarity(self, user, other_user):
+        """Returns a score between 0 and 1 for how likely it is that two users are the same person."""
+        user_name = f"{user.firstname} {user.surname}".lower()
+        other_name = f"{other_user.firstname} {other_user.surname}".lower()
+        name_score = SequenceMatcher(None, user_name, other_name).ratio()
+
+        user_email = user.email_address.split("@")[0]
+        other_email = other_user.email_address.split("@")[0]
+        email_score = SequenceMatcher(None, user_email, other_email).ratio()
+
+        score = 0.6 * name_score + 0.4 * email_score
+        if user.date_of_birth == other_user.date_of_birth:
+            score = min(score + 0.1, 1.0)
+        return score
+
+    def find_matches(self, user, users_dict):
+        """
+        Returns the possible duplicates of a user as a list of (score, username), highest score first.
+        The user does not need to be saved yet, so new users can be checked before they are added.
+        """
+        candidates = set()
+        for key in self.blocking_keys(user):
+            candidates |= self.blocks.get(key, set())
+        candidates.discard(user.username)
+
+        matches = []
+        for username in candidates:
+            score = self.similarity(user, users_dict[username])
+            if score >= self.threshold:
+                matches.append((score, username))
+        return sorted(matches, reverse=True)
+
+    def find_all_duplicates(self, users_dict):
+        """
+        Returns every pair of possible duplicate users as a list of (score, username, other username), highest
+        score first. Only users in the same block are compared, and each pair is only compared once.
+        """
+        compared = set()
+        duplicates = []
+        for usernames in self.blocks.values():
+            ordered = sorted(usernames)
+            for position, username in enumerate(ordered):
+                for other_username in ordered[position + 1:]:
+                    if (username, other_username) in compared:
+                        continue
+                    compared.add((username, other_username))
+
+                    score = self.similarity(users_dict[username], users_dict[other_username])
+                    if score >= self.threshold:
+                        duplicates.append((score, username, other_username))
+        return sorted(duplicates, reverse=True)
@@ -0,0 +1,287 @@
+import csv
+import json
+import mmap
+import os
+import sys
+from array import array
+from collections.abc import Sequence
+from datetime import date, datetime, timedelta
+
+FORMAT_VERSION = 1
+
+# Whole numbers, dates and datetimes are all stored as 8 byte integers. NULL marks a missing value.
+NULL = -2 ** 63
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+# The columns of each dataset as (column name, column type)
+BOOK_COLUMNS = [
+    ("book_id", "int"),
+    ("title", "str"),
+    ("author", "str"),
+    ("publisher", "str"),
+    ("stock", "int"),
+    ("release_date", "date"),
+]
+USER_COLUMNS = [
+    ("username", "str"),
+    ("firstname", "str"),
+    ("surname", "str"),
+    ("house_number", "int"),
+    ("street_name", "str"),
+    ("postcode", "str"),
+    ("email_address", "str"),
+    ("date_of_birth", "date"),
+]
+LOAN_COLUMNS = [
+    ("title", "str"),
+    ("username", "str"),
+    ("rented_on", "datetime"),
+    ("due_date", "datetime"),
+]
+LOAN_HISTORY_COLUMNS = LOAN_COLUMNS + [("returned_on", "datetime")]
+
+
+def encode_value(value, column_type):
+    """Converts a value to the integer stored for it. Dates are stored as ordinals, datetimes as microseconds."""
+    if value is None:
+        return NULL
+    if column_type == "date":
+        return value.toordinal()
+    if column_type == "datetime":
+        return (value - EPOCH) // MICROSECOND
+    return value
+
+
+def decode_value(value, column_type):
+    """Converts a stored integer back to its value."""
+    if value == NULL:
+        return None
+    if column_type == "date":
+        return date.fromordinal(value)
+    if column_type == "datetime":
+        return EPOCH + value * MICROSECOND
+    return value
+
+
+class ColumnWriter:
+    """
+    Writes a single column to disk, a chunk at a time. Contains the following attributes:
+
+    - name (str), column_type (str) - The column name, and "int", "date", "datetime" or "str"
+    - files (dict) - The files written for the column, using "values", "offsets" or "data" as the key
+    - buffer (array) - The values waiting to be written, at most one chunk
+
+    Number columns are a single file of 8 byte integers. Text columns are two files: the UTF-8 text of every
+    value joined together ("data"), and the position in data where each value starts and ends ("offsets").
+    """
+
+    def __init__(self, directory, dataset, name, column_type):
+        self.name = name
+        self.column_type = column_type
+        self.buffer = array("q")
+
+        if column_type == "str":
+            self.files = {"offsets": f"{dataset}.{name}.offsets", "data": f"{dataset}.{name}.data"}
+            self.data_buffer = bytearray()
+            self.data_size = 0
+            # Offsets has one more entry than there are values, starting at 0
+            self.buffer.append(0)
+        else:
+            self.files = {"values": f"{dataset}.{name}.values"}
+
+        self.open_files = {kind: open(os.path.join(directory, filename), "wb")
+                           for kind, filename in self.files.items()}
+
+    def append(self, value):
+        """Adds a value to the column."""
+        if self.column_type == "str":
+            encoded = ("" if value is None else str(value)).encode("utf-8")
+            self.data_buffer += encoded
+            self.data_size += len(encoded)
+            self.buffer.append(self.data_size)
+        else:
+            self.buffer.append(encode_value(value, self.column_type))
+
+    def flush(self):
+        """Writes the buffered chunk to disk and empties the buffer."""
+        if self.column_type == "str":
+            self.open_files["offsets"].write(self.buffer.tobytes())
+            self.open_files["data"].write(self.data_buffer)
+            self.data_buffer = bytearray()
+        else:
+            self.open_files["values"].write(self.buffer.tobytes())
+        self.buffer = array("q")
+
+    def close(self):
+        """Writes any buffered values, closes the files and returns the column's entry for the manifest."""
+        self.flush()
+        for open_file in self.open_files.values():
+            open_file.close()
+        return {"name": self.name, "type": self.column_type, "files": self.files}
+
+
+def export_dataset(directory, dataset, columns, rows, chunk_size=10000, write_csv=False):
+    """
+    Writes a dataset to one set of files per column, streaming the rows so at most chunk_size rows are held
+    in memory at once. rows yields each row as a tuple in column order. If write_csv is True, a CSV file of
+    the dataset is written at the same time. Returns the dataset's entry for the manifest.
+    """
+    writers = [ColumnWriter(directory, dataset, name, column_type) for name, column_type in columns]
+
+    csv_file = None
+    if write_csv:
+        csv_file = open(os.path.join(directory, f"{dataset}.csv"), "w", newline="", encoding="utf-8")
+        csv_writer = csv.writer(csv_file)
+        csv_writer.writerow([name for name, column_type in columns])
+
+    row_count = 0
+    for row in rows:
+        for writer, value in zip(writers, row):
+            writer.append(value)
+        if csv_file:
+            csv_writer.writerow(["" if value is None else value for value in row])
+
+        row_count += 1
+        if row_count % chunk_size == 0:
+            for writer in writers:
+                writer.flush()
+
+    if csv_file:
+        csv_file.close()
+
+    return {"rows": row_count, "columns": [writer.close() for writer in writers]}
+
+
+def export_library(directory, book_list, user_list, loans, chunk_size=10000, write_csv=False):
+    """
+    Exports the books, users, active loans and loan history to a directory for offline analysis.
+    Each dataset is written in columns, with a manifest.json describing every column, its type and its files.
+    Returns the manifest.
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    books = ((book.book_id, book.title, book.author, book.publisher, book.stock, book.release_date)
+             for book in book_list.books_dict.values())
+    users = ((user.username, user.firstname, user.surname, user.house_number, user.street_name, user.postcode,
+              user.email_address, user.date_of_birth)
+             for user in user_list.users_dict.values())
+    active_loans = ((book_title, username, loan_details['rented_on'], loan_details['due_date'])
+                    for (book_title, username), loan_details in loans.books_on_loan.items())
+
+    datasets = {
+        "books": (BOOK_COLUMNS, books),
+        "users": (USER_COLUMNS, users),
+        "loans": (LOAN_COLUMNS, active_loans),
+        "loan_history": (LOAN_HISTORY_COLUMNS, loans.history.iter_loans()),
+    }
+
+    manifest = {"format_version": FORMAT_VERSION, "byteorder": sys.byteorder, "datasets": {}}
+    for dataset, (columns, rows) in datasets.items():
+        manifest["datasets"][dataset] = export_dataset(directory, dataset, columns, rows, chunk_size, write_csv)
+
+    with open(os.path.join(directory, "manifest.json"), "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    return manifest
+
+
+class NumberColumn(Sequence):
+    """A loaded int, date or datetime column. Values are converted from the mapped integers as they are read."""
+
+    def __init__(self, values, column_type):
+        self.values = values
+        self.column_type = column_type
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [decode_value(value, self.column_type) for value in self.values[position]]
+        return decode_value(self.values[position], self.column_type)
+
+
+class TextColumn(Sequence):
+    """A loaded text column. Each value is decoded from the mapped data file only when it is read."""
+
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[index] for index in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("column index out of range")
+        return bytes(self.data[self.offsets[position]:self.offsets[position + 1]]).decode("utf-8")
+
+
+class ColumnarLoader:
+    """
+    Loads a directory written by export_library. Column files are memory mapped rather than read, so only
+    the parts of a column that are used are loaded from disk. Contains the following attributes:
+
+    - directory (str) - The export directory
+    - manifest (dict) - The contents of manifest.json
+    - mapped (list) - Every open memory map and view, closed by close()
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "manifest.json"), encoding="utf-8") as manifest_file:
+            self.manifest = json.load(manifest_file)
+        if self.manifest["format_version"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported export format version: {self.manifest['format_version']}")
+        self.mapped = []
+
+    def map_file(self, filename, integers=False):
+        """Memory maps a column file, returning a view of its bytes, or of its 8 byte integers if integers is True."""
+        with open(os.path.join(self.directory, filename), "rb") as column_file:
+            if os.fstat(column_file.fileno()).st_size == 0:
+                return array("q") if integers else b""
+            if integers and self.manifest["byteorder"] != sys.byteorder:
+                # Written on a machine with the other byte order, so the integers must be read and swapped
+                values = array("q", column_file.read())
+                values.byteswap()
+                return values
+            file_map = mmap.mmap(column_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        view = memoryview(file_map)
+        self.mapped.append(file_map)
+        self.mapped.append(view)
+        if integers:
+            view = view.cast("q")
+            self.mapped.append(view)
+        return view
+
+    def column(self, dataset, name):
+        """Returns a column of a dataset as a sequence that reads its values from disk as they are used."""
+        for column in self.manifest["datasets"][dataset]["columns"]:
+            if column["name"] != name:
+                continue
+            if column["type"] == "str":
+                return TextColumn(self.map_file(column["files"]["offsets"], integers=True),
+                                  self.map_file(column["files"]["data"]))
+            return NumberColumn(self.map_file(column["files"]["values"], integers=True), column["type"])
+        raise KeyError(f"Dataset '{dataset}' has no column '{name}'")
+
+    def rows(self, dataset):
+        """Yields each row of a dataset as a dictionary of {column name: value}."""
+        names = [column["name"] for column in self.manifest["datasets"][dataset]["columns"]]
+        columns = [self.column(dataset, name) for name in names]
+        for position in range(self.manifest["datasets"][dataset]["rows"]):
+            yield {name: column[position] for name, column in zip(names, columns)}
+
+    def close(self):
+        """Closes every memory map. Columns returned by this loader cannot be used afterwards."""
+        for mapped in reversed(self.mapped):
+            if isinstance(mapped, memoryview):
+                mapped.release()
+            else:
+                mapped.close()
+        self.mapped = []
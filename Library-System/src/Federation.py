@@ -0,0 +1,96 @@
+from Books import Books
+
+
+class BranchFederation:
+    """
+    Connects the BookLists of several library branches so a book that is out of stock at one branch can be
+    found at another. Contains the following attributes:
+
+    - branches (dict) - Each branch's BookList, using the branch name as the key
+    - availability (dict) - Maps each book title to a dictionary of {branch name: copies in stock}, only
+      including branches with at least one copy in stock
+    - transfers (list) - Every copy moved between branches, as (book_title, from_branch, to_branch)
+
+    Each BookList tells the federation whenever the stock of one of its books changes, so availability is
+    always up to date and finding which branches have a book in stock is a single dictionary lookup.
+
+    A copy transferred so a user can borrow it is only lent to the receiving branch. The Loans class records
+    the branch it came from on the loan, and transfers it back with return_copy when the loan is returned.
+    """
+
+    def __init__(self):
+        self.branches = {}
+        self.availability = {}
+        self.transfers = []
+
+    def add_branch(self, branch_name, book_list):
+        """Adds a branch to the federation, including the stock of every book it already has."""
+        self.branches[branch_name] = book_list
+        book_list.federation = self
+        book_list.branch_name = branch_name
+
+        for book in book_list.books_dict.values():
+            self.stock_changed(branch_name, book.title, book.stock)
+
+    def stock_changed(self, branch_name, book_title, stock):
+        """Updates the availability of a book at a branch. Called by BookList whenever a book's stock changes."""
+        branches_in_stock = self.availability.setdefault(book_title, {})
+        if stock > 0:
+            branches_in_stock[branch_name] = stock
+        else:
+            branches_in_stock.pop(branch_name, None)
+
+        if not branches_in_stock:
+            del self.availability[book_title]
+
+    def book_removed(self, branch_name, book_title):
+        """Removes a book from the availability of a branch. Called by BookList when a book is removed."""
+        self.stock_changed(branch_name, book_title, 0)
+
+    def find_branches(self, book_title, exclude_branch=None):
+        """Returns a dictionary of {branch name: copies in stock} for every branch with the book in stock."""
+        branches_in_stock = self.availability.get(book_title, {})
+        return {branch: stock for branch, stock in branches_in_stock.items() if branch != exclude_branch}
+
+    def transfer_copy(self, book_title, from_branch, to_branch):
+        """
+        Moves one copy of a book from one branch to another, e.g. so a user can borrow it at their own branch.
+        If the receiving branch does not have the book, it is added to that branch's collection.
+        Returns True if the copy was moved, or False if the sending branch has no copies in stock or the
+        receiving branch has no free book ID to add it with.
+        """
+        if from_branch == to_branch or self.find_branches(book_title).get(from_branch, 0) < 1:
+            return False
+
+        sending_list = self.branches[from_branch]
+        receiving_list = self.branches[to_branch]
+        book = sending_list.books_dict[book_title]
+        received_book = receiving_list.books_dict.get(book_title)
+
+        # Choose the new book ID before changing any stock, so nothing needs undoing if there is none
+        if received_book is None:
+            try:
+                book_id = receiving_list.gen_book_id()
+            except ValueError:
+                return False
+
+        sending_list.update_book(book, "stock", book.stock - 1)
+
+        if received_book is not None:
+            receiving_list.update_book(received_book, "stock", received_book.stock + 1)
+        else:
+            received_book = Books(book.title, book.author, book_id, book.publisher, 1, book.release_date)
+            receiving_list.save_book(received_book.title, received_book)
+
+        self.transfers.append((book_title, from_branch, to_branch))
+        return True
+
+    def return_copy(self, book_title, branch_name, home_branch):
+        """
+        Sends a lent copy of a book back to the branch it was transferred from, once the loan it was lent for
+        has been returned. Returns True if the copy was sent back, or False if the home branch has left the
+        federation or the copy could not be moved, in which case it stays at branch_name.
+        """
+        if home_branch not in self.branches:
+            return False
+        return self.transfer_copy(book_title, branch_name, home_branch)
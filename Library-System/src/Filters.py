@@ -0,0 +1,94 @@
+import math
+from hashlib import blake2b
+
+
+class BloomFilter:
+    """
+    A fixed size set of bits that can say an item has definitely not been added, without storing the items.
+    Contains the following attributes:
+
+    - capacity (int) - The number of items the filter is sized for
+    - error_rate (float) - The chance of a false positive (an item that was not added being reported as added)
+      once capacity items have been added
+    - bit_count (int), hash_count (int) - The number of bits, and the number of bits set for each item
+    - bits (bytearray) - The bits, 8 per byte
+    - count (int) - The number of items added
+
+    Each item sets hash_count bits, chosen from one blake2b hash so they are the same every time the
+    programme runs. An item is reported as added only if all of its bits are set.
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bit_count = max(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hash_count = max(round(self.bit_count / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.bit_count + 7) // 8)
+        self.count = 0
+
+    def bit_positions(self, item):
+        """
+        Returns the positions of the bits for an item. The two halves of a 128 bit digest are combined
+        differently for each position (enhanced double hashing), which is as accurate as hashing the item
+        hash_count times, for the cost of one hash.
+        """
+        digest = blake2b(item.encode("utf-8"), digest_size=16).digest()
+        first_hash = int.from_bytes(digest[:8], "little")
+        second_hash = int.from_bytes(digest[8:], "little")
+
+        positions = []
+        for number in range(self.hash_count):
+            positions.append(first_hash % self.bit_count)
+            first_hash += second_hash
+            second_hash += number
+        return positions
+
+    def add(self, item):
+        """Adds an item to the filter."""
+        for position in self.bit_positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.bit_positions(item))
+
+
+class ScalableBloomFilter:
+    """
+    A Bloom filter that grows as items are added, used in front of the book title and username stores so
+    a title or username that does not exist can be ruled out without a disk read. Contains the following
+    attributes:
+
+    - filters (list) - The BloomFilters, oldest first. When the newest is full a larger one is added.
+    - error_rate (float) - The highest chance of a false positive across all of the filters
+    - growth (int) - How many times larger each new filter is than the one before
+    - tightening (float) - How much lower each new filter's error rate is than the one before
+
+    Items cannot be removed, so a removed title or renamed book is still reported as possibly added, and is
+    then looked up as normal. The filter is rebuilt from the stored records each time the programme starts.
+    """
+
+    def __init__(self, initial_capacity=1024, error_rate=0.001, growth=2, tightening=0.5):
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        # The error rates of the filters add up to at most error_rate, as each is smaller by tightening
+        self.filters = [BloomFilter(initial_capacity, error_rate * (1 - tightening))]
+
+    def add(self, item):
+        """Adds an item, starting a new larger filter first if the newest one is full."""
+        if item in self:
+            return
+
+        newest = self.filters[-1]
+        if newest.count >= newest.capacity:
+            newest = BloomFilter(newest.capacity * self.growth, newest.error_rate * self.tightening)
+            self.filters.append(newest)
+        newest.add(item)
+
+    def __contains__(self, item):
+        return any(item in bloom_filter for bloom_filter in self.filters)
+
+    def __len__(self):
+        # Items that were already reported as added are not counted again
+        return sum(bloom_filter.count for bloom_filter in self.filters)
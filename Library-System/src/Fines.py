@@ -0,0 +1,96 @@
+from Clock import SystemClock
+
+# Default fine rules. Amounts are stored in pence to avoid floating point rounding errors.
+DEFAULT_RATE_TABLE = {
+    "daily_rate": 25,    # 25p per day overdue
+    "grace_days": 2,     # Number of overdue days before any fine is charged
+    "max_fine": 1000,    # A single loan can never be fined more than £10.00
+}
+
+
+class Fines:
+    """
+    Calculates fines for overdue loans in the Library System. Contains the following attributes:
+
+    - books_on_loan (dict) - The loans dictionary from the Loans class, shared by reference so it is always current
+    - history (LoanHistory) - The returned loans from the Loans class. Books returned late are fined for the days
+      they were overdue. None if only active loans are fined.
+    - rate_table (dict) - The default daily rate, grace period and cap applied to every loan
+    - rate_overrides (dict) - Alternative rate tables keyed by book title, e.g. for short loan books
+    - clock (SystemClock) - Provides the current date and time fines are calculated up to
+
+    Fines are calculated for every loan in a single pass, and are totalled per user so the balances for
+    the whole library can be produced at once rather than one loan at a time. The same rates, grace period and
+    cap apply to active and returned loans.
+    """
+
+    def __init__(self, books_on_loan, clock=None, rate_table=None, history=None):
+        self.books_on_loan = books_on_loan
+        self.history = history
+        self.clock = clock if clock is not None else SystemClock()
+        self.rate_table = rate_table if rate_table else dict(DEFAULT_RATE_TABLE)
+        self.rate_overrides = {}
+
+    def set_rate_override(self, book_title, rate_table):
+        """Sets a different rate table for a specific book title. Missing keys fall back to the default table."""
+        self.rate_overrides[book_title] = {**self.rate_table, **rate_table}
+
+    def calculate_fine(self, days_overdue, rate_table):
+        """Returns the fine in pence for a number of overdue days using the given rate table."""
+        chargeable_days = days_overdue - rate_table["grace_days"]
+        if chargeable_days <= 0:
+            return 0
+        return min(chargeable_days * rate_table["daily_rate"], rate_table["max_fine"])
+
+    def calculate_balances(self, today_date=None):
+        """
+        Calculates the fine balance for every user with overdue loans, or books that were returned late.
+        Returns a dictionary with the username as the key and the total fine in pence as the value. Users with
+        nothing to pay are not included.
+        """
+        if today_date is None:
+            today_date = self.clock.now()
+
+        balances = {}
+        default_rates = self.rate_table
+        overrides = self.rate_overrides
+
+        for (book_title, username), loan_details in self.books_on_loan.items():
+            due_date = loan_details['due_date']
+            if due_date >= today_date:
+                continue
+
+            rate_table = overrides.get(book_title, default_rates)
+            fine = self.calculate_fine((today_date - due_date).days, rate_table)
+            if fine:
+                balances[username] = balances.get(username, 0) + fine
+
+        if self.history is None:
+            return balances
+
+        # Returned loans are fined up to the day they were returned, not up to today
+        for book_title, username, rented_on, due_date, returned_on in self.history.iter_loans():
+            fined_until = min(returned_on, today_date)
+            if due_date >= fined_until:
+                continue
+
+            rate_table = overrides.get(book_title, default_rates)
+            fine = self.calculate_fine((fined_until - due_date).days, rate_table)
+            if fine:
+                balances[username] = balances.get(username, 0) + fine
+
+        return balances
+
+    def display_fines(self):
+        """Displays to the user every user that owes a fine, including for books returned late, and the total owed."""
+        balances = self.calculate_balances()
+
+        if not balances:
+            print("No users currently owe any fines.")
+            print("Returning to Loans Menu")
+            return
+
+        print("--- Displaying Outstanding Fines ---")
+        for username, fine in sorted(balances.items()):
+            print(f"User {username} owes £{fine / 100:.2f}")
+        print(f"Total outstanding fines: £{sum(balances.values()) / 100:.2f}")
@@ -0,0 +1,106 @@
+class HistoryPartition:
+    """
+    Stores the returned loans for a single month. Records are only ever appended, and are only removed when the
+    transaction that archived them is rolled back. Contains the following attributes:
+
+    - year, month: The month this partition covers, based on the date each book was returned
+    - records (list) - Each returned loan as a tuple: (book_title, username, rented_on, due_date, returned_on)
+    - min_date, max_date: The earliest and latest return dates held in this partition
+    - usernames (set), book_titles (set): Every user and book that appears in this partition
+
+    The min/max dates and the username/title sets let queries skip whole partitions that cannot contain a match.
+    """
+
+    def __init__(self, year, month):
+        self.year = year
+        self.month = month
+        self.records = []
+        self.min_date = None
+        self.max_date = None
+        self.usernames = set()
+        self.book_titles = set()
+
+    def append(self, record):
+        """Appends a returned loan to the partition and updates the partition metadata."""
+        book_title, username, rented_on, due_date, returned_on = record
+        self.records.append(record)
+        self.usernames.add(username)
+        self.book_titles.add(book_title)
+
+        if self.min_date is None or returned_on < self.min_date:
+            self.min_date = returned_on
+        if self.max_date is None or returned_on > self.max_date:
+            self.max_date = returned_on
+
+
+class LoanHistory:
+    """
+    An append-only archive of every loan that has been returned in the Library System. Returned loans are
+    grouped into monthly partitions, using the year and month of return as the key of partitions (dict).
+
+    Provides methods to:
+    - Archive a returned loan
+    - Find returned loans between two dates, by user, or by book title, only looking inside partitions
+      that could contain a match
+    """
+
+    def __init__(self):
+        self.partitions = {}
+
+    def archive_loan(self, book_title, loan_details, returned_on):
+        """Moves a loan record into the partition for the month it was returned."""
+        key = (returned_on.year, returned_on.month)
+        if key not in self.partitions:
+            self.partitions[key] = HistoryPartition(returned_on.year, returned_on.month)
+
+        record = (book_title, loan_details['username'], loan_details['rented_on'],
+                  loan_details['due_date'], returned_on)
+        self.partitions[key].append(record)
+
+    def unarchive_loan(self, book_title, loan_details, returned_on):
+        """
+        Removes a loan record archived by archive_loan, when the return is rolled back. The partition's dates,
+        usernames and titles are left as they are, as they only rule partitions out of searches.
+        """
+        record = (book_title, loan_details['username'], loan_details['rented_on'],
+                  loan_details['due_date'], returned_on)
+        self.partitions[(returned_on.year, returned_on.month)].records.remove(record)
+
+    def count_loans(self):
+        """Returns the total number of returned loans held in the archive."""
+        return sum(len(partition.records) for partition in self.partitions.values())
+
+    def iter_loans(self):
+        """Yields every returned loan, oldest partition first."""
+        for key in sorted(self.partitions):
+            yield from self.partitions[key].records
+
+    def find_by_date(self, start_date, end_date):
+        """Yields each returned loan with a return date between start_date and end_date (inclusive)."""
+        for key in sorted(self.partitions):
+            partition = self.partitions[key]
+            if partition.max_date < start_date or partition.min_date > end_date:
+                continue
+            for record in partition.records:
+                if start_date <= record[4] <= end_date:
+                    yield record
+
+    def find_by_user(self, username):
+        """Yields each returned loan for the given username, oldest first."""
+        for key in sorted(self.partitions):
+            partition = self.partitions[key]
+            if username not in partition.usernames:
+                continue
+            for record in partition.records:
+                if record[1] == username:
+                    yield record
+
+    def find_by_book(self, book_title):
+        """Yields each returned loan for the given book title, oldest first."""
+        for key in sorted(self.partitions):
+            partition = self.partitions[key]
+            if book_title not in partition.book_titles:
+                continue
+            for record in partition.records:
+                if record[0] == book_title:
+                    yield record
@@ -0,0 +1,369 @@
+import calendar
+from bisect import bisect_left, bisect_right, insort
+from datetime import date, timedelta
+from itertools import islice
+
+
+class ReleaseDateIndex:
+    """
+    Keeps the books in the collection sorted by release date so they can be searched by date without
+    looping over the whole books dictionary. Contains the following attributes:
+
+    - entries (list) - A sorted list of (release_date, book_id, title) tuples, oldest first
+
+    Uses the bisect module to find the start of a date range in O(log n). Results are yielded one at a time
+    so large date ranges do not build large lists. Books without a release date are not indexed.
+    """
+
+    def __init__(self):
+        self.entries = []
+
+    def add(self, book):
+        """Adds a book to the index in release date order."""
+        if book.release_date is not None:
+            insort(self.entries, (book.release_date, book.book_id, book.title))
+
+    def remove(self, book):
+        """Removes a book from the index."""
+        if book.release_date is None:
+            return
+        entry = (book.release_date, book.book_id, book.title)
+        position = bisect_left(self.entries, entry)
+        if position < len(self.entries) and self.entries[position] == entry:
+            del self.entries[position]
+
+    def find_between(self, start_date, end_date):
+        """Yields the title of each book released between start_date and end_date (inclusive), oldest first."""
+        position = bisect_left(self.entries, (start_date,))
+        while position < len(self.entries):
+            release_date, book_id, title = self.entries[position]
+            if release_date > end_date:
+                return
+            yield title
+            position += 1
+
+    def find_newest(self, amount):
+        """Yields the titles of the most recently released books, newest first."""
+        last_position = max(len(self.entries) - amount, 0)
+        for position in range(len(self.entries) - 1, last_position - 1, -1):
+            yield self.entries[position][2]
+
+    def count_between(self, start_date, end_date):
+        """Returns the number of books released from start_date up to, but not including, end_date."""
+        return bisect_left(self.entries, (end_date,)) - bisect_left(self.entries, (start_date,))
+
+    def count_by_year(self, first_year, last_year):
+        """Returns a dictionary with each year from first_year to last_year and the number of books released."""
+        return {year: self.count_between(date(year, 1, 1), date(year + 1, 1, 1))
+                for year in range(first_year, last_year + 1)}
+
+    def count_by_month(self, year):
+        """Returns a dictionary with each month of the given year and the number of books released."""
+        counts = {}
+        for month in range(1, 13):
+            next_month = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+            counts[month] = self.count_between(date(year, month, 1), next_month)
+        return counts
+
+
+class FacetIndex:
+    """
+    Groups books by the value of a single attribute, such as author or publisher, so all books with the same
+    value can be found without looping over the whole books dictionary. Contains the following attributes:
+
+    - attribute (str) - The name of the Books attribute being indexed, e.g. "author"
+    - facets (dict) - Maps each normalised value to a bitmap of book IDs
+    - counts (dict) - The cached number of books for each normalised value
+
+    Each bitmap is a single integer where bit N is set when the book with ID N has that value. Finding books
+    that match two facets, e.g. publisher X and author Y, is then a single bitwise AND of two integers.
+    """
+
+    def __init__(self, attribute):
+        self.attribute = attribute
+        self.facets = {}
+        self.counts = {}
+
+    def normalise(self, value):
+        """Normalises a value so differences in case and spacing do not create separate facets."""
+        return " ".join(value.split()).lower()
+
+    def add(self, book):
+        """Adds a book to the facet for its current attribute value."""
+        key = self.normalise(getattr(book, self.attribute))
+        self.facets[key] = self.facets.get(key, 0) | (1 << book.book_id)
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+    def remove(self, book):
+        """Removes a book from the facet for its current attribute value."""
+        key = self.normalise(getattr(book, self.attribute))
+        self.facets[key] &= ~(1 << book.book_id)
+        self.counts[key] -= 1
+        if not self.counts[key]:
+            del self.facets[key]
+            del self.counts[key]
+
+    def lookup(self, value):
+        """Returns the bitmap of book IDs for a value, or 0 if no books have that value."""
+        return self.facets.get(self.normalise(value), 0)
+
+    def count(self, value):
+        """Returns the number of books with the given value."""
+        return self.counts.get(self.normalise(value), 0)
+
+
+def intersect_facets(*bitmaps):
+    """Returns the bitmap of book IDs that appear in every one of the given facet bitmaps."""
+    result = bitmaps[0]
+    for bitmap in bitmaps[1:]:
+        result &= bitmap
+    return result
+
+
+def bitmap_to_ids(bitmap):
+    """Yields each book ID set in a facet bitmap, lowest first."""
+    while bitmap:
+        lowest_bit = bitmap & -bitmap
+        yield lowest_bit.bit_length() - 1
+        bitmap ^= lowest_bit
+
+
+class PostcodeIndex:
+    """
+    Groups users by their UK postcode so users in an area can be found without looping over the whole users
+    dictionary. Postcodes are stored in a hierarchy, e.g. for the postcode SW1A 1AA:
+
+    area (SW) -> district (SW1A) -> sector (SW1A 1) -> full postcode (SW1A 1AA) -> set of usernames
+
+    - areas (dict) - The nested dictionaries described above
+    - counts (dict) - The cached number of users for every area, district, sector and full postcode
+
+    A search goes straight to the matching part of the hierarchy, so the work done is proportional to the
+    number of users found rather than the number of users in the system.
+    """
+
+    def __init__(self):
+        self.areas = {}
+        self.counts = {}
+
+    def split_postcode(self, postcode):
+        """
+        Splits a postcode, or the start of one, into a list of its area, district, sector and full postcode.
+        Only the parts included are returned, e.g. 'SW1A 1' returns ['SW', 'SW1A', 'SW1A 1'].
+        """
+        district, _, inward_code = " ".join(postcode.split()).upper().partition(" ")
+
+        area = ""
+        for char in district:
+            if not char.isalpha():
+                break
+            area += char
+
+        parts = [area]
+        if district != area:
+            parts.append(district)
+            if inward_code:
+                parts.append(f"{district} {inward_code[0]}")
+            if len(inward_code) == 3:
+                parts.append(f"{district} {inward_code}")
+        return parts
+
+    def add(self, user):
+        """Adds a user to the index under their postcode."""
+        area, district, sector, postcode = self.split_postcode(user.postcode)
+        sectors = self.areas.setdefault(area, {}).setdefault(district, {})
+        sectors.setdefault(sector, {}).setdefault(postcode, set()).add(user.username)
+
+        for key in (area, district, sector, postcode):
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def remove(self, user):
+        """Removes a user from the index, removing any part of the hierarchy that is left empty."""
+        area, district, sector, postcode = self.split_postcode(user.postcode)
+        districts = self.areas[area]
+        sectors = districts[district]
+        postcodes = sectors[sector]
+        postcodes[postcode].discard(user.username)
+
+        if not postcodes[postcode]:
+            del postcodes[postcode]
+        if not postcodes:
+            del sectors[sector]
+        if not sectors:
+            del districts[district]
+        if not districts:
+            del self.areas[area]
+
+        for key in (area, district, sector, postcode):
+            self.counts[key] -= 1
+            if not self.counts[key]:
+                del self.counts[key]
+
+    def count(self, prefix):
+        """Returns the number of users in an area, district, sector or full postcode."""
+        return self.counts.get(self.split_postcode(prefix)[-1], 0)
+
+    def count_by_district(self, area):
+        """Returns a dictionary with each district in an area and the number of users in it."""
+        area = self.split_postcode(area)[0]
+        return {district: self.counts[district] for district in sorted(self.areas.get(area, {}))}
+
+    def find_users(self, prefix):
+        """Yields the username of every user in an area, district, sector or full postcode."""
+        node = self.areas
+        for key in self.split_postcode(prefix):
+            if key not in node:
+                return
+            node = node[key]
+
+        # Walk down through any remaining levels of the hierarchy until we reach the sets of usernames
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, set):
+                yield from node
+            else:
+                stack.extend(node.values())
+
+    def mailing_batches(self, prefix, batch_size):
+        """Yields the usernames in an area, district, sector or full postcode in lists of up to batch_size."""
+        batch = []
+        for username in self.find_users(prefix):
+            batch.append(username)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def subtract_years(from_date, years):
+    """
+    Returns the latest date of birth of someone who is a number of years old on from_date. Uses the same rule
+    as find_birthdays, where 29th February birthdays are the 28th in non leap years, so someone born on the
+    29th February turns a year older on the 28th.
+    """
+    year = from_date.year - years
+    if (from_date.month, from_date.day) == (2, 28) and not calendar.isleap(from_date.year) and calendar.isleap(year):
+        return date(year, 2, 29)
+    if (from_date.month, from_date.day) == (2, 29) and not calendar.isleap(year):
+        return date(year, 2, 28)
+    return from_date.replace(year=year)
+
+
+class DateOfBirthIndex:
+    """
+    Keeps the users sorted by date of birth so users can be searched by age without looping over the whole
+    users dictionary and working out every users age. Contains the following attributes:
+
+    - entries (list) - A sorted list of (date_of_birth, username) tuples, oldest user first
+    - birthdays (dict) - Maps each (month, day) to the set of usernames with a birthday on that day
+
+    An age range is turned into a range of dates of birth, which the bisect module finds in O(log n).
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.birthdays = {}
+
+    def add(self, user):
+        """Adds a user to the index in date of birth order."""
+        dob = user.date_of_birth
+        insort(self.entries, (dob, user.username))
+        self.birthdays.setdefault((dob.month, dob.day), set()).add(user.username)
+
+    def remove(self, user):
+        """Removes a user from the index."""
+        dob = user.date_of_birth
+        entry = (dob, user.username)
+        position = bisect_left(self.entries, entry)
+        if position < len(self.entries) and self.entries[position] == entry:
+            del self.entries[position]
+
+        usernames = self.birthdays[(dob.month, dob.day)]
+        usernames.discard(user.username)
+        if not usernames:
+            del self.birthdays[(dob.month, dob.day)]
+
+    def find_positions(self, min_age, max_age, as_of):
+        """Returns the start and end positions in entries of the users aged min_age to max_age on as_of."""
+        earliest_dob = subtract_years(as_of, max_age + 1) + timedelta(days=1)
+        latest_dob = subtract_years(as_of, min_age)
+        start = bisect_left(self.entries, (earliest_dob,))
+        end = bisect_right(self.entries, (latest_dob, chr(0x10FFFF)))
+        return start, end
+
+    def find_aged_between(self, min_age, max_age, as_of):
+        """Yields the username of each user aged between min_age and max_age (inclusive) on the date as_of."""
+        start, end = self.find_positions(min_age, max_age, as_of)
+        for position in range(start, end):
+            yield self.entries[position][1]
+
+    def count_aged_between(self, min_age, max_age, as_of):
+        """Returns the number of users aged between min_age and max_age (inclusive) on the date as_of."""
+        start, end = self.find_positions(min_age, max_age, as_of)
+        return end - start
+
+    def count_by_age_band(self, age_bands, as_of):
+        """
+        Returns a dictionary with the number of users in each age band on the date as_of.
+        age_bands is a dictionary of band names and (min_age, max_age) tuples, e.g. {"Under 16": (0, 15)}.
+        """
+        return {band: self.count_aged_between(min_age, max_age, as_of)
+                for band, (min_age, max_age) in age_bands.items()}
+
+    def find_birthdays(self, on_date):
+        """Returns the usernames with a birthday on on_date. 29th February birthdays are the 28th in non leap years."""
+        usernames = set(self.birthdays.get((on_date.month, on_date.day), set()))
+        if (on_date.month, on_date.day) == (2, 28) and not calendar.isleap(on_date.year):
+            usernames |= self.birthdays.get((2, 29), set())
+        return usernames
+
+
+class SortedIndex:
+    """
+    Keeps records sorted so they can be listed a page at a time, e.g. books by title or loans by due date.
+    Contains the following attributes:
+
+    - entries (list) - A sorted list of tuples. Each tuple starts with the sort key and must be unique, e.g.
+      (title, book_id) or (due_date, title, username).
+
+    Pages use a cursor rather than a page number. The cursor is the last entry of the previous page, and the
+    next page starts straight after it using bisect, so every page costs O(log n + page size) however far
+    into the list it is. Records added or removed between pages are never skipped or shown twice.
+    """
+
+    def __init__(self):
+        self.entries = []
+
+    def add(self, entry):
+        """Adds an entry to the index in sorted order."""
+        insort(self.entries, entry)
+
+    def __contains__(self, entry):
+        position = bisect_left(self.entries, entry)
+        return position < len(self.entries) and self.entries[position] == entry
+
+    def remove(self, entry):
+        """Removes an entry from the index."""
+        position = bisect_left(self.entries, entry)
+        if position < len(self.entries) and self.entries[position] == entry:
+            del self.entries[position]
+
+    def iter_after(self, cursor=None):
+        """Yields each entry after the cursor in sorted order, or every entry if cursor is None."""
+        position = 0 if cursor is None else bisect_right(self.entries, cursor)
+        while position < len(self.entries):
+            yield self.entries[position]
+            position += 1
+
+    def find_page(self, cursor=None, page_size=10):
+        """
+        Returns the page of up to page_size entries after the cursor, and the cursor for the next page.
+        The next cursor is None when there are no more entries.
+        """
+        entries = list(islice(self.iter_after(cursor), page_size + 1))
+        if len(entries) > page_size:
+            page = entries[:page_size]
+            return page, page[-1]
+        return entries, None
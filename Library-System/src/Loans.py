@@ -1,5 +1,13 @@
 from utils import control_user_choice
 from utils import retry_func
+from utils import browse_pages
+from Fines import Fines
+from History import LoanHistory
+from Clock import SystemClock
+from Indexes import SortedIndex
+from ChangeFeed import plain_value
+from Reminders import ReminderDispatcher
+from Tracing import traced
 import datetime
 from datetime import datetime, timedelta
 
@@ -9,7 +17,8 @@ class Loans:
     Handles all operations related to borrowing and returning Books in the Library system.
     - book_list (BookList) - An instance of the BookList class to access the books dictionary
     - user_list (UserList) - An instance of the Userlist class to access the users dictionary
-    - books_on_load (dict) - A dictionary that stores information on books that have been rented
+    - books_on_load (dict) - A dictionary that stores information on books that have been rented, using
+      (book title, username) as its key so several users can rent copies of the same book
 
     Contains the following methods:
     - borrow_book: Users can rent a book as long as its available stock wise
@@ -17,11 +26,155 @@ class Loans:
     - return_all_books: Users can return all books that they are currently renting
     - find_overdue_books: Displays any overdue books. Overdue books are books that have not been returned
       within two weeks.
+    - fines (Fines) - Calculates the fines owed by users for their overdue books and books returned late
+    - history (LoanHistory) - An archive of every loan that has been returned
+    - clock (SystemClock) - Provides the current date and time, and can be replaced with a SimulatedClock
+    - feed (ChangeFeed) - Publishes every borrow and return for other systems to follow, shared with BookList
+    - transactions (TransactionManager) - Groups loans and returns so they are kept or undone together, e.g.
+      when a user returns all of their books at once
+    - due_order (SortedIndex) - Keeps the active loans sorted by due date, as (due_date, book_title, username)
+    - reminders (ReminderDispatcher) - Emails users about overdue books and books due back soon
+    - tracer (Tracer) - Times the core loan operations and profiles any that are slow, shared with BookList
+    - renamed_titles (dict) - Maps the old title of each renamed book to its new title, as the loan history
+      keeps the title a book had when it was returned
     """
-    def __init__(self, book_list, user_list):
+    def __init__(self, book_list, user_list, clock=None):
         self.books_on_loan = {}
         self.book_list = book_list
         self.user_list = user_list
+        self.clock = clock if clock is not None else SystemClock()
+        self.history = LoanHistory()
+        self.fines = Fines(self.books_on_loan, self.clock, history=self.history)
+        self.stats = book_list.stats
+        self.feed = book_list.feed
+        self.transactions = book_list.transactions
+        self.tracer = book_list.tracer
+        self.due_order = SortedIndex()
+        self.renamed_titles = {}
+        book_list.loans = self
+        self.reminders = ReminderDispatcher(self.due_order, user_list.users_dict, self.clock)
+
+    @traced
+    def create_loan(self, current_user, book_to_rent, home_branch=None):
+        """
+        Saves a new loan record for a user renting a book, and deducts one copy from the book stock.
+        home_branch is the branch a copy was transferred from for this loan, which it is sent back to when the
+        loan is returned. Returns the loan details.
+        """
+        self.transactions.check_writable()
+
+        # Set the loan records for overdue logic
+        rented_time = self.clock.now()
+        due_date = rented_time + timedelta(weeks=2)
+
+        loan_details = {
+            "username": current_user.username,
+            "rented_on": rented_time,
+            "due_date": due_date
+        }
+        if home_branch is not None:
+            loan_details["home_branch"] = home_branch
+        # Deduct the copy from the Book stock and save the loan together, so a snapshot sees both or neither
+        with self.book_list.snapshots.change():
+            self.book_list.change_loan_stock(book_to_rent, -1)
+            self.books_on_loan[(book_to_rent.title, current_user.username)] = loan_details
+        self.due_order.add((due_date, book_to_rent.title, current_user.username))
+        self.stats.loan_opened(current_user.username)
+        self.book_list.recommendations.record_borrow(current_user.username, book_to_rent.title)
+        self.book_list.popularity.record_borrow(book_to_rent.title)
+        self.transactions.record_undo(self.discard_loan, book_to_rent.title, current_user.username)
+        self.feed.publish("loan", "borrow", {"title": book_to_rent.title, "username": current_user.username,
+                                             "rented_on": plain_value(rented_time),
+                                             "due_date": plain_value(due_date)})
+        return loan_details
+
+    @traced
+    def close_loan(self, book_title, username):
+        """
+        Removes a returned book from books_on_loan, archives the loan record in the loan history so circulation
+        history is kept, and adds the copy back to the book stock.
+        """
+        self.transactions.check_writable()
+
+        # Remove the loan and update stock together, unless the book has since been removed from the collection
+        book = self.book_list.find_book(book_title)
+        with self.book_list.snapshots.change():
+            loan_details = self.books_on_loan.pop((book_title, username))
+            if book:
+                self.book_list.change_loan_stock(book, 1)
+        self.due_order.remove((loan_details['due_date'], book_title, username))
+        returned_on = self.clock.now()
+        self.history.archive_loan(book_title, loan_details, returned_on)
+
+        # Send a copy that was transferred for this loan back to the branch it came from
+        federation = self.book_list.federation
+        if book and federation and "home_branch" in loan_details:
+            federation.return_copy(book_title, self.book_list.branch_name, loan_details["home_branch"])
+        self.stats.loan_closed(username, restocked=book is not None)
+        self.transactions.record_undo(self.restore_loan, book_title, loan_details, returned_on, book is not None)
+        self.feed.publish("loan", "return", {"title": book_title, "username": username,
+                                             "returned_on": plain_value(returned_on)})
+        return loan_details
+
+    def discard_loan(self, book_title, username):
+        """
+        Removes a loan without archiving it, when the transaction that created it is rolled back. The book stock
+        is put back separately by the rollback. Recommendations are only suggestions, so they are not changed.
+        """
+        loan_details = self.books_on_loan.pop((book_title, username))
+        self.due_order.remove((loan_details['due_date'], book_title, username))
+        self.stats.loan_closed(username)
+
+    def restore_loan(self, book_title, loan_details, returned_on, restocked):
+        """Puts a returned loan back on loan, when the transaction that closed it is rolled back."""
+        self.books_on_loan[(book_title, loan_details['username'])] = loan_details
+        self.due_order.add((loan_details['due_date'], book_title, loan_details['username']))
+        self.history.unarchive_loan(book_title, loan_details, returned_on)
+        self.stats.loan_opened(loan_details['username'], from_stock=restocked)
+
+    def rename_loans(self, old_title, new_title):
+        """
+        Moves the active loans, due dates and fine rates of a book to its new title. Called by BookList when a book
+        is renamed, so the copies on loan can still be returned.
+        """
+        for book_title, username in [key for key in self.books_on_loan if key[0] == old_title]:
+            loan_details = self.books_on_loan.pop((old_title, username))
+            self.books_on_loan[(new_title, username)] = loan_details
+            self.due_order.remove((loan_details['due_date'], old_title, username))
+            self.due_order.add((loan_details['due_date'], new_title, username))
+
+        rate_overrides = self.fines.rate_overrides
+        if old_title in rate_overrides:
+            rate_overrides[new_title] = rate_overrides.pop(old_title)
+
+        # new_title is a current title again, so it no longer leads anywhere
+        self.renamed_titles.pop(new_title, None)
+        self.renamed_titles[old_title] = new_title
+
+    def current_title(self, book_title):
+        """Returns the title a book has now, following any renames since book_title was recorded."""
+        while book_title in self.renamed_titles:
+            book_title = self.renamed_titles[book_title]
+        return book_title
+
+    def rebuild_recommendations(self):
+        """
+        Rebuilds the borrowed together recommendations from the loan history and the books currently on loan,
+        leaving out books that have since been removed from the collection. Returned loans of renamed books are
+        counted under their current title. Returns the number of users counted.
+        """
+        books_dict = self.book_list.books_dict
+        user_titles = {}
+        for book_title, username, rented_on, due_date, returned_on in self.history.iter_loans():
+            book_title = self.current_title(book_title)
+            if book_title in books_dict:
+                user_titles.setdefault(username, set()).add(book_title)
+        for book_title, username in self.books_on_loan:
+            if book_title in books_dict:
+                user_titles.setdefault(username, set()).add(book_title)
+
+        self.book_list.recommendations.rebuild(user_titles)
+        return len(user_titles)
 
     def borrow_book(self):
         """
@@ -49,35 +202,47 @@ class Loans:
             return
 
         # Check user is not already renting the specified Book
-        for book_title, loan_details in self.books_on_loan.items():
-            if loan_details['username'] == current_user.username and book_title == book_to_rent.title:
-                print(f"User '{current_user.username}' is already renting this book {book_to_rent.title}")
-                print(f"Reminder, this book is due on {loan_details['due_date']}")
-                return
+        loan_details = self.books_on_loan.get((book_to_rent.title, current_user.username))
+        if loan_details:
+            print(f"User '{current_user.username}' is already renting this book {book_to_rent.title}")
+            print(f"Reminder, this book is due on {loan_details['due_date']}")
+            return
 
         if book_to_rent.stock > 0:
             print(f"Book '{book_to_rent.title}' was found and is available to rent.")
 
-            # Set the loan records for overdue logic and save Book rental
-            rented_time = datetime.now()
-            due_date = rented_time + timedelta(weeks=2)
-
-            # Saves our book on rental using the Book title as the key
-            self.books_on_loan[book_to_rent.title] = {
-                "username": current_user.username,
-                "rented_on": rented_time,
-                "due_date": due_date
-            }
-
-            # Update and deduct the current Book stock
-            book_to_rent.stock -= 1
+            # Saves our book on rental using the Book title and username as the key
+            loan_details = self.create_loan(current_user, book_to_rent)
             print(f"'{book_to_rent.title}' is now being rented by {current_user.username}")
-            print(f"Day of rental {rented_time}")
-            print(f"Due date {due_date}")
+            print(f"Day of rental {loan_details['rented_on']}")
+            print(f"Due date {loan_details['due_date']}")
             return
         else:
             print(f"'{book_to_rent.title} is currently out of stock. Please choose another Book to rent.")
 
+            # Offer to transfer a copy if another branch has the book in stock
+            federation = self.book_list.federation
+            if not federation:
+                return
+
+            branch_name = self.book_list.branch_name
+            other_branches = federation.find_branches(book_to_rent.title, exclude_branch=branch_name)
+            if not other_branches:
+                return
+
+            for other_branch, stock in other_branches.items():
+                print(f"Branch '{other_branch}' has {stock} copy(s) in stock.")
+
+            from_branch = max(other_branches, key=other_branches.get)
+            if retry_func(f"Transfer a copy from '{from_branch}' and rent it"):
+                if not federation.transfer_copy(book_to_rent.title, from_branch, branch_name):
+                    print(f"A copy could not be transferred from '{from_branch}'. Returning to Loans Menu")
+                    return
+                loan_details = self.create_loan(current_user, book_to_rent, home_branch=from_branch)
+                print(f"'{book_to_rent.title}' was transferred from '{from_branch}' and is now being rented by "
+                      f"{current_user.username}")
+                print(f"Due date {loan_details['due_date']}")
+
     def return_book(self):
         """
         Takes user input to specify a single book in stock and allows a user to return it. Gets the specific
@@ -98,8 +263,8 @@ class Loans:
         # Find the books that are currently on loan for the current user
         current_user_loaned_books = {}
 
-        for book_title, loan_details in self.books_on_loan.items():
-            if loan_details['username'] == current_user.username:
+        for (book_title, username), loan_details in self.books_on_loan.items():
+            if username == current_user.username:
                 # Saves currently loaned books to a dictionary with the book title as its key
                 current_user_loaned_books[book_title] = loan_details
 
@@ -122,11 +287,8 @@ class Loans:
 
         # Return the loaned book
         if book_to_rent.title in current_user_loaned_books:
-            del self.books_on_loan[book_to_rent.title]
+            self.close_loan(book_to_rent.title, current_user.username)
             print(f"Book titled '{book_to_rent.title}' has been successfully returned.")
-
-            # Update stock
-            book_to_rent.stock += 1
             print("Returning to Loans Menu")
             return
         else:
@@ -154,8 +316,8 @@ class Loans:
         # Find the books that are currently on loan for the current user
         current_user_loaned_books = {}
 
-        for book_title, loan_details in self.books_on_loan.items():
-            if loan_details['username'] == current_user.username:
+        for (book_title, username), loan_details in self.books_on_loan.items():
+            if username == current_user.username:
                 # Saves currently loaned books to a dictionary with the book title as its key
                 current_user_loaned_books[book_title] = loan_details
 
@@ -174,13 +336,11 @@ class Loans:
 
         # Confirm if the user would like to return all rented books
         if retry_func("Return all books"):
-            for book_title in list(current_user_loaned_books.keys()):
-                del self.books_on_loan[book_title]
-
-                # Update stock accordingly
-                book = self.book_list.books_dict[book_title]
-                book.stock += 1
-
+            # Every book is returned, or if anything goes wrong, none of them are
+            with self.tracer.span("Loans.return_all_books"), self.transactions.transaction():
+                for book_title in list(current_user_loaned_books.keys()):
+                    self.close_loan(book_title, current_user.username)
+            for book_title in current_user_loaned_books:
                 print(f"Book titled '{book_title}' has been successfully returned.")
             print(f"All books rented by {current_user.username} were returned.")
         else:
@@ -193,7 +353,7 @@ class Loans:
         it has not been returned within two weeks from the day it was rented.
         Ensures there are books in the library system and also books on loan before proceeding.
         Utilises the datetime module and accesses values in our books_on_loan dictionary in order to calculate
-        overdue books.
+        overdue books. Reads from a snapshot, so books borrowed or returned during the report do not change it.
         """
         if not self.book_list.books_dict:
             print("There are no books in the Library System.")
@@ -205,27 +365,100 @@ class Loans:
             print("Returning to Loans Menu")
             return
 
-        today_date = datetime.now()
+        today_date = self.clock.now()
         overdue = False
 
-        for book_title, loan_details in self.books_on_loan.items():
-            user = loan_details['username']
-            due_date = loan_details['due_date']
+        with self.book_list.snapshots.snapshot(self.book_list.books_dict, self.books_on_loan) as snapshot:
+            for (book_title, user), loan_details in snapshot.books_on_loan.items():
+                due_date = loan_details['due_date']
 
-            if due_date < today_date:
-                if not overdue:
-                    print("--- Displaying Overdue Books ---")
-                    overdue = True
+                if due_date < today_date:
+                    if not overdue:
+                        print("--- Displaying Overdue Books ---")
+                        overdue = True
 
-                print(f"\nUser {user} has overdue books:")
-                print(f"Book titled '{book_title}'. Was due on {due_date}")
-                print(f"Days overdue: {(today_date - due_date).days}")
+                    print(f"\nUser {user} has overdue books:")
+                    print(f"Book titled '{book_title}'. Was due on {due_date}")
+                    print(f"Days overdue: {(today_date - due_date).days}")
 
         if not overdue:
             print("No users have overdue books")
             print("Returning to Loans Main Menu")
             return
 
+    def browse_active_loans(self):
+        """
+        Displays every book currently on loan a page at a time, due soonest first.
+        Uses due_order, so each page only looks at the loans on that page.
+        """
+        if not self.books_on_loan:
+            print("There are no active books on loan.")
+            return
+
+        def display_entry(entry):
+            due_date, book_title, username = entry
+            print(f"'{book_title}' rented by {username}, due on {due_date}")
+
+        browse_pages(self.due_order.find_page, display_entry)
+
+    def send_reminder_emails(self):
+        """
+        Emails every user with overdue books or books due back soon, one email per user. Users who have already
+        been sent a notice for a book are not emailed about it again.
+        """
+        if not self.books_on_loan:
+            print("There are no active books on loan.")
+            return
+
+        print("Sending emails...")
+        sent, failed = self.reminders.dispatch()
+        if not sent and not failed:
+            print("No users need to be emailed.")
+            return
+
+        print(f"Emails sent: {sent}")
+        if failed:
+            print(f"Emails that could not be sent: {failed}")
+
+    def display_loan_history(self):
+        """
+        Displays returned loans from the loan history, either for a specific user or for a specific book.
+        Uses lookup_username or lookup_book to get the user or book to search the history for.
+        """
+        if not self.history.partitions:
+            print("No books have been returned yet.")
+            print("Returning to Loans Menu")
+            return
+
+        print("Would you like to view the loan history of a user or a book?")
+        print("1 - User")
+        print("2 - Book")
+        user_choice = control_user_choice("Enter here: ", range(1, 3))
+
+        if user_choice == 1:
+            current_user = self.user_list.lookup_username()
+            if not current_user:
+                print("Returning to Loans Menu")
+                return
+            records = self.history.find_by_user(current_user.username)
+        else:
+            book = self.book_list.lookup_book()
+            if not book:
+                print("Returning to Loans Menu")
+                return
+            records = self.history.find_by_book(book.title)
+
+        found = False
+        for book_title, username, rented_on, due_date, returned_on in records:
+            found = True
+            print(f"\nBook titled '{book_title}' rented by {username}")
+            print(f"Rented on: {rented_on}")
+            print(f"Due date: {due_date}")
+            print(f"Returned on: {returned_on}")
+
+        if not found:
+            print("No returned loans were found.")
+
     def loans_sub_menu(self):
         """
         Provides the user with a sub menu for interacting with our Books. Provides multiple options including:
@@ -234,6 +467,12 @@ class Loans:
         - Return all books: Allows a user to return all books that are currently on loan by that user in one go
         - Find overdue books: Displays to the user, without specifying a user beforehand, all books that are overdue
           and for which users.
+        - View fines: Displays the fines currently owed by each user for overdue books and books returned late
+        - View loan history: Displays the returned loans for a specific user or book
+        - Browse active loans: Displays every book on loan a page at a time, due soonest first
+        - Send reminder emails: Emails users about overdue books and books due back soon
+        - Rebuild recommendations: Recounts the books borrowed together from the loan history, dropping books
+          that have been removed
 
         - Utilises control_user_choice from Utils.py to safely navigate the sub menu.
         """
@@ -244,10 +483,15 @@ class Loans:
             print("2 - Return a Book")
             print("3 - Return all Books")
             print("4 - Find overdue Books")
-            print("5 - Return to Main Menu")
+            print("5 - View Fines")
+            print("6 - View Loan History")
+            print("7 - Browse Active Loans")
+            print("8 - Send Reminder Emails")
+            print("9 - Rebuild Recommendations")
+            print("10 - Return to Main Menu")
 
             # Gets the users choice and ensures valid input by calling control_user_choice from utils.py
-            user_choice = control_user_choice("Enter here: ", range(1,6))
+            user_choice = control_user_choice("Enter here: ", range(1,11))
 
             # Takes the user to the appropriate sub menu or quits the programme
             if user_choice == 1:
@@ -263,6 +507,22 @@ class Loans:
                 self.find_overdue_books()
 
             elif user_choice == 5:
+                self.fines.display_fines()
+
+            elif user_choice == 6:
+                self.display_loan_history()
+
+            elif user_choice == 7:
+                self.browse_active_loans()
+
+            elif user_choice == 8:
+                self.send_reminder_emails()
+
+            elif user_choice == 9:
+                user_count = self.rebuild_recommendations()
+                print(f"Recommendations were rebuilt from the loans of {user_count} user(s).")
+
+            elif user_choice == 10:
                 print("Returning to Main Menu..")
                 return
 
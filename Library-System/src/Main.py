@@ -1,6 +1,13 @@
 from Books import BookList
 from Users import UserList
 from Loans import Loans
+from Stats import LibraryStats
+from Clock import SystemClock
+from CommandLog import CommandLog
+from ChangeFeed import ChangeFeed
+from Transactions import TransactionManager
+from Export import export_library
+from Tracing import Tracer
 from utils import control_user_choice
 
 
@@ -11,10 +18,81 @@ class LibraryProgramme:
     our Books, Users, and Loans classes, where users can manage these functionalities.
     """
 
-    def __init__(self):
-        self.book_list = BookList()
-        self.user_list = UserList()
-        self.loans = Loans(self.book_list, self.user_list)
+    def __init__(self, clock=None):
+        self.clock = clock if clock is not None else SystemClock()
+        self.stats = LibraryStats()
+        self.command_log = CommandLog()
+        self.feed = ChangeFeed()
+        self.transactions = TransactionManager(self.feed)
+        self.tracer = Tracer()
+        self.book_list = BookList(self.stats, self.clock, self.command_log, self.feed, self.transactions,
+                                  self.tracer)
+        self.user_list = UserList(self.stats, self.clock, self.command_log, self.feed, self.transactions,
+                                  self.tracer)
+        self.loans = Loans(self.book_list, self.user_list, self.clock)
+
+    def display_statistics(self):
+        """
+        Displays the library statistics, then recounts every statistic from scratch to check the running
+        totals are correct, and reports any counters that do not match.
+        """
+        self.stats.display_stats()
+
+        differences = self.stats.verify_stats(self.book_list.books_dict, self.user_list.users_dict,
+                                              self.loans.books_on_loan)
+        if not differences:
+            print("All statistics have been verified.")
+            return
+
+        print("The following statistics did not match a full recount:")
+        for name, (running_total, recount) in differences.items():
+            print(f"{name}: {running_total} (recount: {recount})")
+
+    def undo_last_change(self):
+        """Undoes the most recent change made to a book or user, and displays the change that was undone."""
+        change = self.command_log.undo(self.book_list, self.user_list)
+        if change is None:
+            print("There are no changes to undo.")
+        elif not change:
+            print("The last change could not be undone as the book or user has changed since.")
+        else:
+            print(f"Undone: {self.command_log.describe(change)}")
+
+    def redo_last_change(self):
+        """Redoes the most recently undone change, and displays the change that was redone."""
+        change = self.command_log.redo(self.book_list, self.user_list)
+        if change is None:
+            print("There are no changes to redo.")
+        elif not change:
+            print("The change could not be redone as the book or user has changed since.")
+        else:
+            print(f"Redone: {self.command_log.describe(change)}")
+
+    def export_data(self):
+        """
+        Exports the books, users, active loans and loan history to a directory for offline analysis, in columns
+        that can be loaded back with ColumnarLoader, and optionally as CSV files.
+        """
+        print("Please enter the directory to export to. E.g. library_export")
+        directory = input("Enter here: ").strip()
+        if not directory:
+            print("Directory cannot be empty. Returning to Main Menu")
+            return
+
+        print("Would you like CSV files as well?")
+        print("1 - Columns only")
+        print("2 - Columns and CSV files")
+        write_csv = control_user_choice("Enter here: ", range(1, 3)) == 2
+
+        try:
+            manifest = export_library(directory, self.book_list, self.user_list, self.loans, write_csv=write_csv)
+        except OSError as error:
+            print(f"The export failed: {error}")
+            return
+
+        for dataset, details in manifest["datasets"].items():
+            print(f"{dataset}: {details['rows']} rows exported")
+        print(f"Export written to {directory}")
 
     def library_menu(self):
         """
@@ -23,6 +101,10 @@ class LibraryProgramme:
         Books: (add, search, remove, count total books, edit books)
         Users: (add, remove, edit users, count total users, display user info)
         Loans: (borrow, return, return all, find overdue books)
+        Statistics: (display and verify library statistics)
+        Undo/Redo: (undo or redo changes made to books and users)
+        Export: (export all data for offline analysis)
+        Slow operations: (display operations that took longer than expected)
         """
 
         while True:
@@ -31,10 +113,15 @@ class LibraryProgramme:
             print("1 - Books")
             print("2 - Users")
             print("3 - Loans")
-            print("4 - Quit")
+            print("4 - Statistics")
+            print("5 - Undo Last Change")
+            print("6 - Redo Last Change")
+            print("7 - Export Data")
+            print("8 - Slow Operations")
+            print("9 - Quit")
 
             # Gets the users choice and ensures valid input by calling control_user_choice from utils.py
-            user_choice = control_user_choice("Enter here: ", range(1, 5))
+            user_choice = control_user_choice("Enter here: ", range(1, 10))
 
             # Takes the user to the appropriate sub menu or quits the programme
             if user_choice == 1:
@@ -47,6 +134,21 @@ class LibraryProgramme:
                 self.loans.loans_sub_menu()
 
             elif user_choice == 4:
+                self.display_statistics()
+
+            elif user_choice == 5:
+                self.undo_last_change()
+
+            elif user_choice == 6:
+                self.redo_last_change()
+
+            elif user_choice == 7:
+                self.export_data()
+
+            elif user_choice == 8:
+                self.tracer.display_slow_operations()
+
+            elif user_choice == 9:
                 print("Exiting the Library System... Goodbye!")
                 return
 
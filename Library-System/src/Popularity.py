@@ -0,0 +1,128 @@
+import math
+from array import array
+from hashlib import blake2b
+from Clock import SystemClock
+
+# Counts are rescaled when new borrows would be weighted more than this, long before floats run out
+RESCALE_LIMIT = 1e100
+
+
+class DecayedCountMinSketch:
+    """
+    Estimates how often each item has been seen recently, in a fixed amount of memory however many different
+    items there are. Older sightings count for less, halving in weight every half_life_days.
+    Contains the following attributes:
+
+    - rows (list) - depth rows of width counters. Each item adds to one counter in every row, chosen by a hash.
+    - decay_rate (float) - How quickly older sightings lose weight, per day
+    - landmark (datetime) - The time weights are measured from
+
+    Rather than reducing every counter as time passes, each new sighting is added with a weight that grows
+    over time (forward decay). Dividing by the current weight when reading gives the decayed count, so adding
+    and reading are both constant time. Estimates can be too high, when other items share counters, but never
+    too low. Taking the lowest counter across the rows keeps the overestimate small.
+    """
+
+    def __init__(self, width=2048, depth=4, half_life_days=7.0):
+        self.width = width
+        self.depth = depth
+        self.rows = [array("d", bytes(8 * width)) for row in range(depth)]
+        self.decay_rate = math.log(2) / half_life_days
+        self.landmark = None
+
+    def positions(self, item):
+        """Returns the counter used by an item in each row, from one blake2b hash."""
+        digest = blake2b(item.encode("utf-8"), digest_size=4 * self.depth).digest()
+        return [int.from_bytes(digest[4 * row:4 * row + 4], "little") % self.width for row in range(self.depth)]
+
+    def weight_at(self, when):
+        """Returns the weight a sighting at the given time is added with."""
+        if self.landmark is None:
+            return 1.0
+        days = (when - self.landmark).total_seconds() / 86400
+        return math.exp(self.decay_rate * days)
+
+    def rescale(self, when):
+        """
+        Moves the landmark to the given time, dividing every counter by the weight of that time. Only needed once
+        weights become very large. Returns the factor the counters were multiplied by.
+        """
+        factor = 1 / self.weight_at(when)
+        for row in self.rows:
+            for position in range(self.width):
+                row[position] *= factor
+        self.landmark = when
+        return factor
+
+    def add(self, item, when, amount=1.0):
+        """Adds a sighting of an item at the given time. Returns the item's new undecayed (forward) count."""
+        if self.landmark is None:
+            self.landmark = when
+        weight = amount * self.weight_at(when)
+
+        lowest = math.inf
+        for row, position in zip(self.rows, self.positions(item)):
+            row[position] += weight
+            lowest = min(lowest, row[position])
+        return lowest
+
+    def forward_count(self, item):
+        """Returns the undecayed count of an item, which must be divided by weight_at(now) to decay it."""
+        return min(row[position] for row, position in zip(self.rows, self.positions(item)))
+
+    def estimate(self, item, when):
+        """Returns the decayed count of an item at the given time."""
+        return self.forward_count(item) / self.weight_at(when)
+
+
+class PopularityTracker:
+    """
+    Tracks how popular each book is from its checkouts, with recent checkouts counting for more, and keeps
+    a list of the top_k trending titles. Uses constant memory and constant time per checkout, however large
+    the collection or however many loans are made. Contains the following attributes:
+
+    - sketch (DecayedCountMinSketch) - The decayed checkout count of every title
+    - top_titles (dict) - The top_k most popular titles, with their undecayed counts from the sketch
+    - top_k (int) - The number of trending titles kept
+    - clock (SystemClock) - Provides the time of each checkout
+
+    Every count decays at the same rate, so the order of top_titles does not change as time passes and only
+    needs updating when a book is borrowed. With the default half life of 7 days, a checkout a week ago counts
+    half as much as one today.
+    """
+
+    def __init__(self, clock=None, top_k=50, width=2048, depth=4, half_life_days=7.0):
+        self.clock = clock if clock is not None else SystemClock()
+        self.sketch = DecayedCountMinSketch(width, depth, half_life_days)
+        self.top_titles = {}
+        self.top_k = top_k
+
+    def record_borrow(self, book_title):
+        """Counts a checkout of a book, and updates the trending titles."""
+        now = self.clock.now()
+        if self.sketch.weight_at(now) > RESCALE_LIMIT:
+            factor = self.sketch.rescale(now)
+            for title in self.top_titles:
+                self.top_titles[title] *= factor
+
+        count = self.sketch.add(book_title, now)
+
+        if book_title in self.top_titles or len(self.top_titles) < self.top_k:
+            self.top_titles[book_title] = count
+            return
+
+        # top_k is small and fixed, so finding the least popular title does not depend on the collection size
+        least_popular = min(self.top_titles, key=self.top_titles.get)
+        if count > self.top_titles[least_popular]:
+            del self.top_titles[least_popular]
+            self.top_titles[book_title] = count
+
+    def popularity(self, book_title):
+        """Returns the decayed checkout count of a book."""
+        return self.sketch.estimate(book_title, self.clock.now())
+
+    def trending(self, amount=None):
+        """Returns up to amount trending titles as a list of (title, decayed checkout count), most popular first."""
+        weight = self.sketch.weight_at(self.clock.now())
+        ranked = sorted(self.top_titles.items(), key=lambda item: -item[1])
+        return [(title, count / weight) for title, count in ranked[:amount]]
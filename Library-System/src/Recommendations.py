@@ -0,0 +1,125 @@
+from collections import Counter
+from itertools import combinations
+
+
+class BorrowedTogether:
+    """
+    Recommends books that are often borrowed by the same users, for "patrons who borrowed this also
+    borrowed..." on the search screen. Contains the following attributes:
+
+    - co_counts (dict) - For each book title, a dictionary of {other book title: number of users who have
+      borrowed both}. Only pairs of books that have been borrowed by the same user are stored.
+    - user_titles (dict) - The set of book titles each user has borrowed, using the username as the key
+    - top_related (dict) - For each book title, the top_k most borrowed together titles as a list of
+      (count, other book title), highest count first
+    - top_k (int) - The number of related titles kept for each book
+
+    Counts only ever go up, so top_related can be kept correct as each loan is recorded and looking up the
+    related titles of a book never needs to sort all of its counts. Renaming or removing a title re-ranks only
+    the titles that were borrowed together with it.
+    """
+
+    def __init__(self, top_k=5):
+        self.co_counts = {}
+        self.user_titles = {}
+        self.top_related = {}
+        self.top_k = top_k
+
+    def record_borrow(self, username, book_title):
+        """Records a user borrowing a book. Borrowing the same book again does not change any counts."""
+        borrowed_titles = self.user_titles.setdefault(username, set())
+        if book_title in borrowed_titles:
+            return
+
+        for other_title in borrowed_titles:
+            self.increase_count(book_title, other_title)
+            self.increase_count(other_title, book_title)
+        borrowed_titles.add(book_title)
+
+    def increase_count(self, book_title, other_title, amount=1):
+        """Increases the borrowed together count of two books, updating the top related titles of book_title."""
+        counts = self.co_counts.setdefault(book_title, {})
+        counts[other_title] = counts.get(other_title, 0) + amount
+        new_count = counts[other_title]
+
+        top_related = self.top_related.setdefault(book_title, [])
+        for position, (count, title) in enumerate(top_related):
+            if title == other_title:
+                del top_related[position]
+                break
+        else:
+            # other_title is not in the top list, so it only gets in if it beats the lowest count
+            if len(top_related) == self.top_k and new_count <= top_related[-1][0]:
+                return
+            if len(top_related) == self.top_k:
+                top_related.pop()
+
+        # Insert in order, highest count first. The list is at most top_k long.
+        position = 0
+        while position < len(top_related) and top_related[position][0] >= new_count:
+            position += 1
+        top_related.insert(position, (new_count, other_title))
+
+    def rank_related(self, book_title):
+        """Sorts every count of a book to find its top related titles again."""
+        counts = self.co_counts.get(book_title, {})
+        ranked = sorted(((count, title) for title, count in counts.items()), key=lambda pair: -pair[0])
+        self.top_related[book_title] = ranked[:self.top_k]
+
+    def rename_title(self, old_title, new_title):
+        """
+        Moves the counts of a renamed book to its new title. Any counts left under the new title by a book that
+        was removed are dropped first, so they are not mixed in with the renamed book's counts.
+        """
+        self.remove_title(new_title)
+        for borrowed_titles in self.user_titles.values():
+            if old_title in borrowed_titles:
+                borrowed_titles.discard(old_title)
+                borrowed_titles.add(new_title)
+
+        counts = self.co_counts.pop(old_title, {})
+        self.top_related.pop(old_title, None)
+        if not counts:
+            return
+
+        self.co_counts[new_title] = counts
+        self.rank_related(new_title)
+        for other_title in counts:
+            other_counts = self.co_counts[other_title]
+            other_counts[new_title] = other_counts.pop(old_title)
+            self.rank_related(other_title)
+
+    def remove_title(self, book_title):
+        """Removes every count of a book, e.g. when another book is renamed to its title."""
+        for borrowed_titles in self.user_titles.values():
+            borrowed_titles.discard(book_title)
+
+        counts = self.co_counts.pop(book_title, {})
+        self.top_related.pop(book_title, None)
+        for other_title in counts:
+            del self.co_counts[other_title][book_title]
+            self.rank_related(other_title)
+
+    def find_related(self, book_title):
+        """Returns the titles most often borrowed together with a book, most often first."""
+        return [title for count, title in self.top_related.get(book_title, [])]
+
+    def rebuild(self, user_titles):
+        """
+        Rebuilds every count from scratch, e.g. from the loan history. user_titles is a dictionary of
+        {username: set of book titles borrowed}. Pairs are counted for all users at once with a Counter.
+        """
+        pair_counts = Counter()
+        for borrowed_titles in user_titles.values():
+            pair_counts.update(combinations(sorted(borrowed_titles), 2))
+
+        self.co_counts = {}
+        self.top_related = {}
+        self.user_titles = {username: set(titles) for username, titles in user_titles.items()}
+
+        for (first_title, second_title), count in pair_counts.items():
+            self.co_counts.setdefault(first_title, {})[second_title] = count
+            self.co_counts.setdefault(second_title, {})[first_title] = count
+
+        for book_title in self.co_counts:
+            self.rank_related(book_title)
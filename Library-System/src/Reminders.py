@@ -0,0 +1,227 @@
+import queue
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from email.message import EmailMessage
+from Clock import SystemClock
+
+
+class SMTPPool:
+    """
+    Shares a small number of SMTP connections between the threads sending emails, so each email does not
+    have to connect and log in again. Contains the following attributes:
+
+    - host, port - The SMTP server
+    - max_connections (int) - The most connections open at once. Threads wait for a free connection.
+    - idle (LifoQueue) - Open connections not currently in use, most recently used first
+    """
+
+    def __init__(self, host="localhost", port=25, max_connections=4, timeout=10):
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(max_connections)
+
+    @contextmanager
+    def connection(self):
+        """Lends out an open connection, connecting if none are idle. A connection that fails is closed."""
+        with self.slots:
+            try:
+                smtp = self.idle.get_nowait()
+            except queue.Empty:
+                smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+
+            try:
+                yield smtp
+            except Exception:
+                self.discard(smtp)
+                raise
+            self.idle.put(smtp)
+
+    def discard(self, smtp):
+        """Closes a connection without waiting for the server to reply."""
+        try:
+            smtp.close()
+        except OSError:
+            pass
+
+    def close(self):
+        """Closes every idle connection."""
+        while True:
+            try:
+                smtp = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                self.discard(smtp)
+
+
+class ReminderDispatcher:
+    """
+    Emails users about their overdue books, and books due back soon, with one email per user listing every
+    book. Emails are sent in the background by a pool of threads. Contains the following attributes:
+
+    - due_order (SortedIndex) - The active loans sorted by due date, from the Loans class
+    - users_dict (dict) - Every user, for their email address
+    - clock (SystemClock) - Provides the current date and time
+    - pool (SMTPPool) - The shared SMTP connections. Only pool.max_connections emails are sent at once.
+    - remind_days (int) - How many days before the due date a reminder is sent
+    - overdue_repeat_days (int) - How often, in days, an overdue notice for the same book is sent again
+    - max_attempts (int), backoff (float) - How many times a failed email is tried, and the seconds waited
+      before the second attempt, doubling for each attempt after
+    - sent (dict) - For each username, when each notice was last sent, as {(title, due_date, kind): date}.
+      A reminder is only sent once per loan, so running the dispatcher again does not email users twice.
+      Notices for loans that have been returned are removed each time notices are collected.
+    - sending (set) - Usernames with an email waiting to be sent or being sent. A user is added when their
+      notices are collected, under the same lock, so two dispatches running at once never both email them.
+    """
+
+    def __init__(self, due_order, users_dict, clock=None, pool=None, sender="library@example.com",
+                 remind_days=2, overdue_repeat_days=7, max_attempts=3, backoff=1.0):
+        self.due_order = due_order
+        self.users_dict = users_dict
+        self.clock = clock if clock is not None else SystemClock()
+        self.pool = pool if pool is not None else SMTPPool()
+        self.sender = sender
+        self.remind_days = remind_days
+        self.overdue_repeat_days = overdue_repeat_days
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.sent = {}
+        self.sending = set()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=self.pool.max_connections)
+
+    def needs_notice(self, username, notice):
+        """Returns True if a notice has not been sent yet, or is an overdue notice due to be sent again."""
+        sent_on = self.sent.get(username, {}).get(notice)
+        if sent_on is None:
+            return True
+        return notice[2] == "overdue" and (self.clock.today() - sent_on).days >= self.overdue_repeat_days
+
+    def forget_returned(self):
+        """Removes the sent notices of loans that are no longer active. Called with the lock held."""
+        for username, sent_notices in list(self.sent.items()):
+            for notice in [notice for notice in sent_notices if (notice[1], notice[0], username) not in self.due_order]:
+                del sent_notices[notice]
+            if not sent_notices:
+                del self.sent[username]
+
+    def collect_notices(self):
+        """
+        Returns the notices to send, grouped by user, as {username: [(title, due_date, kind), ...]}.
+        kind is "overdue" or "due soon". Only loans due before the end of the reminder window are looked at,
+        as due_order is sorted by due date. Every user returned is added to sending, and must be removed from
+        it once their email has been sent or given up on.
+        """
+        now = self.clock.now()
+        remind_until = now + timedelta(days=self.remind_days)
+        notices = {}
+
+        with self.lock:
+            self.forget_returned()
+            for due_date, title, username in self.due_order.iter_after():
+                if due_date > remind_until:
+                    break
+                if username in self.sending:
+                    continue
+
+                notice = (title, due_date, "overdue" if due_date < now else "due soon")
+                if self.needs_notice(username, notice):
+                    notices.setdefault(username, []).append(notice)
+            self.sending.update(notices)
+        return notices
+
+    def build_message(self, user, notices):
+        """Returns the email for a user, listing their overdue books first."""
+        today = self.clock.today()
+        overdue = [notice for notice in notices if notice[2] == "overdue"]
+        due_soon = [notice for notice in notices if notice[2] == "due soon"]
+
+        lines = [f"Dear {user.firstname},", ""]
+        if overdue:
+            lines.append("The following books are overdue. Please return them as soon as possible:")
+            for title, due_date, kind in overdue:
+                days_overdue = (today - due_date.date()).days
+                lines.append(f"- '{title}', due on {due_date:%d %B %Y} ({days_overdue} days overdue)")
+            lines.append("")
+        if due_soon:
+            lines.append("The following books are due back soon:")
+            for title, due_date, kind in due_soon:
+                lines.append(f"- '{title}', due on {due_date:%d %B %Y}")
+            lines.append("")
+        lines.append("Thank you, the Library")
+
+        message = EmailMessage()
+        message["From"] = self.sender
+        message["To"] = user.email_address
+        if overdue:
+            message["Subject"] = f"You have {len(overdue)} overdue book(s)"
+        else:
+            message["Subject"] = f"You have {len(due_soon)} book(s) due back soon"
+        message.set_content("\n".join(lines))
+        return message
+
+    def send_notices(self, username, notices, message):
+        """
+        Sends one user's email, trying again with a growing wait if it fails. Errors the server reports as
+        permanent, e.g. an unknown address, are not tried again. Returns True if the email was sent.
+        """
+        try:
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    with self.pool.connection() as smtp:
+                        smtp.send_message(message)
+                except smtplib.SMTPRecipientsRefused:
+                    return False
+                except smtplib.SMTPResponseException as error:
+                    if error.smtp_code >= 500 or attempt == self.max_attempts:
+                        return False
+                except (smtplib.SMTPException, OSError):
+                    if attempt == self.max_attempts:
+                        return False
+                else:
+                    with self.lock:
+                        sent_notices = self.sent.setdefault(username, {})
+                        for notice in notices:
+                            sent_notices[notice] = self.clock.today()
+                    return True
+
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+        finally:
+            with self.lock:
+                self.sending.discard(username)
+
+    def queue_notices(self):
+        """
+        Collects the notices to send and queues one email per user. Returns immediately with a dictionary of
+        {username: Future}, where each Future's result is True once the email has been sent.
+        """
+        futures = {}
+        for username, notices in self.collect_notices().items():
+            user = self.users_dict.get(username)
+            if not user:
+                with self.lock:
+                    self.sending.discard(username)
+                continue
+            message = self.build_message(user, notices)
+            futures[username] = self.executor.submit(self.send_notices, username, notices, message)
+        return futures
+
+    def dispatch(self):
+        """Queues every notice and waits for the emails to be sent. Returns (emails sent, emails failed)."""
+        futures = self.queue_notices()
+        sent = sum(1 for future in futures.values() if future.result())
+        return sent, len(futures) - sent
+
+    def close(self):
+        """Waits for queued emails to be sent, then closes the SMTP connections."""
+        self.executor.shutdown(wait=True)
+        self.pool.close()
@@ -0,0 +1,498 @@
+import itertools
+import json
+import multiprocessing
+import socket
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime
+from Books import Books
+from Users import Users
+from Clock import ReplayClock
+from Main import LibraryProgramme
+from Simulation import LibrarySimulation
+from Sharding import Borrower
+
+# Attributes sent as ISO format strings that must be turned back into dates
+DATE_ATTRIBUTES = ("release_date", "date_of_birth")
+
+
+def read_date(value):
+    """Converts an ISO format string from the change feed back into a date."""
+    return None if value is None else date.fromisoformat(value)
+
+
+def read_datetime(value):
+    """Converts an ISO format string from the change feed back into a datetime."""
+    return datetime.fromisoformat(value)
+
+
+class Checkpoint:
+    """
+    A copy of every book, user and loan in a Library System as plain values, kept up to date from its change
+    feed on a background thread, so a follower that is further behind than the feed retains can start again
+    from it. Contains the following attributes:
+
+    - sequence (int) - The sequence number of the last change included in the checkpoint
+    - books (dict) - The data of each book, as sent in the feed, using the title as the key
+    - users (dict) - The data of each user, as sent in the feed, using the username as the key
+    - loans (dict) - The rented_on and due_date of each active loan, using (book title, username) as the key
+    - returned_loans (list) - Each returned loan as [book title, username, rented_on, due_date, returned_on]
+    - renamed_titles (dict) - Maps the old title of each renamed book to its new title, as Loans does
+    - error (str) - Why the checkpoint stopped following the feed, if it did
+
+    The checkpoint must start from the first change, so it is created before any changes are made, or while
+    the feed still retains them all. It holds a plain copy of every record, including the loan history.
+    """
+
+    def __init__(self, feed, name="checkpoint"):
+        self.feed = feed
+        self.name = name
+        self.sequence = 0
+        self.books = {}
+        self.users = {}
+        self.loans = {}
+        self.returned_loans = []
+        self.renamed_titles = {}
+        self.error = None
+        self.running = True
+        self.lock = threading.Lock()
+
+        feed.subscribe(name, from_sequence=0)
+        self.thread = threading.Thread(target=self.follow, daemon=True)
+        self.thread.start()
+
+    def follow(self):
+        """Applies each change from the feed until the checkpoint is closed."""
+        try:
+            while self.running:
+                changes = self.feed.fetch(self.name)
+                with self.lock:
+                    for change in changes:
+                        self.apply_change(change)
+                if not changes:
+                    self.feed.wait_for_changes(self.sequence, 0.5)
+        except LookupError as error:
+            self.error = str(error)
+        finally:
+            self.feed.unsubscribe(self.name)
+
+    def apply_change(self, change):
+        """Applies one change to the plain copy."""
+        record_type, action, data = change["record_type"], change["action"], change["data"]
+
+        if record_type == "book" and action == "add":
+            self.books[data["title"]] = dict(data)
+        elif record_type == "book" and action == "remove":
+            del self.books[data["title"]]
+        elif record_type == "book":
+            old_title = data["title"]
+            self.books[old_title][data["attribute"]] = data["value"]
+            if data["attribute"] == "title" and data["value"] != old_title:
+                new_title = data["value"]
+                self.books[new_title] = self.books.pop(old_title)
+                for book_title, username in [key for key in self.loans if key[0] == old_title]:
+                    self.loans[(new_title, username)] = self.loans.pop((old_title, username))
+                self.renamed_titles.pop(new_title, None)
+                self.renamed_titles[old_title] = new_title
+
+        elif record_type == "user" and action == "add":
+            self.users[data["username"]] = dict(data)
+        elif record_type == "user" and action == "remove":
+            del self.users[data["username"]]
+        elif record_type == "user":
+            self.users[data["username"]][data["attribute"]] = data["value"]
+
+        elif action == "borrow":
+            self.loans[(data["title"], data["username"])] = {"rented_on": data["rented_on"],
+                                                             "due_date": data["due_date"]}
+            self.books[data["title"]]["stock"] -= 1
+        else:
+            loan = self.loans.pop((data["title"], data["username"]))
+            if data["title"] in self.books:
+                self.books[data["title"]]["stock"] += 1
+            self.returned_loans.append([data["title"], data["username"], loan["rented_on"], loan["due_date"],
+                                        data["returned_on"]])
+
+        self.sequence = change["sequence"]
+
+    def to_message(self):
+        """
+        Returns a copy of the checkpoint as plain values that can be sent as JSON, or None if it has stopped.
+        Every record is copied while the lock is held, as the message is only serialised after it is released
+        and changes applied meanwhile would otherwise appear in a checkpoint claiming an earlier sequence.
+        """
+        with self.lock:
+            if self.error is not None:
+                return None
+            return {
+                "sequence": self.sequence,
+                "books": [dict(book) for book in self.books.values()],
+                "users": [dict(user) for user in self.users.values()],
+                "loans": [[book_title, username, loan["rented_on"]]
+                          for (book_title, username), loan in self.loans.items()],
+                "returned_loans": list(self.returned_loans),
+                "renamed_titles": dict(self.renamed_titles),
+            }
+
+    def close(self):
+        """Stops following the feed."""
+        self.running = False
+        self.thread.join()
+
+
+class ReplicationLeader:
+    """
+    Sends every change made to a Library System to its followers over local sockets, as one JSON message per
+    line. Contains the following attributes:
+
+    - feed (ChangeFeed) - The change feed of the Library System being copied
+    - address (tuple) - The (host, port) followers connect to. Port 0 picks any free port.
+    - heartbeat_interval (float) - How often, in seconds, an idle follower is told the leader is still there
+    - checkpoint (Checkpoint) - Sent to followers that are further behind than the feed retains. None if
+      checkpoints is False, in which case those followers are sent an error.
+
+    A follower sends the sequence number of the last change it has applied, and receives every change after it.
+    A follower that has missed changes the feed no longer retains is sent the checkpoint, once per connection,
+    then every change after it. Messages are one of:
+    {"type": "change", "change": {...}, "leader_sequence": 10, "sent_at": 1760000000.0}
+    {"type": "checkpoint", "checkpoint": {...}, "leader_sequence": 10, "sent_at": 1760000000.0}
+    {"type": "heartbeat", "leader_sequence": 10, "sent_at": 1760000000.0}
+    {"type": "error", "message": "..."}
+    """
+
+    def __init__(self, feed, host="127.0.0.1", port=0, heartbeat_interval=0.5, checkpoints=True):
+        self.feed = feed
+        self.heartbeat_interval = heartbeat_interval
+        self.checkpoint = Checkpoint(feed) if checkpoints else None
+        self.server = socket.create_server((host, port))
+        self.address = self.server.getsockname()
+        self.follower_ids = itertools.count(1)
+        self.running = True
+
+        self.accept_thread = threading.Thread(target=self.accept_followers, daemon=True)
+        self.accept_thread.start()
+
+    def accept_followers(self):
+        """Accepts follower connections, serving each one on its own thread."""
+        while self.running:
+            try:
+                connection, follower_address = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.serve_follower, args=(connection,), daemon=True).start()
+
+    def send(self, connection, message):
+        """Sends one message to a follower."""
+        message["sent_at"] = time.time()
+        connection.sendall((json.dumps(message) + "\n").encode("utf-8"))
+
+    def serve_follower(self, connection):
+        """Sends a follower every change after the sequence number it asks for, until it disconnects."""
+        name = f"follower-{next(self.follower_ids)}"
+        with connection, connection.makefile("r", encoding="utf-8") as reader:
+            try:
+                last_sequence = json.loads(reader.readline())["from_sequence"]
+                self.feed.subscribe(name, from_sequence=last_sequence)
+                checkpoint_sent = False
+
+                while self.running:
+                    try:
+                        changes = self.feed.fetch(name)
+                    except LookupError:
+                        checkpoint = self.checkpoint.to_message() if self.checkpoint else None
+                        if checkpoint is None or checkpoint_sent:
+                            raise
+
+                        # Start the follower again from the checkpoint, then send the changes after it
+                        self.send(connection, {"type": "checkpoint", "checkpoint": checkpoint,
+                                               "leader_sequence": self.feed.sequence})
+                        checkpoint_sent = True
+                        last_sequence = checkpoint["sequence"]
+                        self.feed.subscribe(name, from_sequence=last_sequence)
+                        continue
+
+                    for change in changes:
+                        self.send(connection, {"type": "change", "change": change,
+                                               "leader_sequence": self.feed.sequence})
+                    if changes:
+                        last_sequence = changes[-1]["sequence"]
+                    elif not self.feed.wait_for_changes(last_sequence, self.heartbeat_interval):
+                        self.send(connection, {"type": "heartbeat", "leader_sequence": self.feed.sequence})
+
+            except LookupError as error:
+                # The follower has fallen too far behind to catch up from the retained changes
+                self.send(connection, {"type": "error", "message": str(error)})
+            except (OSError, ValueError):
+                # The follower disconnected
+                pass
+            finally:
+                self.feed.unsubscribe(name)
+
+    def close(self):
+        """Stops accepting followers and stops sending changes."""
+        self.running = False
+        self.server.close()
+        if self.checkpoint:
+            self.checkpoint.close()
+
+
+class ReplicationFollower:
+    """
+    A read only copy of a Library System, kept up to date by applying the changes sent by a ReplicationLeader.
+    Used to move searches and reports off the leader, and to take over quickly if the leader fails.
+    Contains the following attributes:
+
+    - programme (LibraryProgramme) - The copy, which starts empty and uses a ReplayClock
+    - applied_sequence (int) - The sequence number of the last change applied
+    - leader_sequence (int) - The sequence number of the leader's latest change, as last heard from the leader
+    - caught_up_at (float) - The leader's time (from time.time()) when this follower was last fully caught up
+    - error (str) - Why replication stopped, if it stopped because of a problem
+
+    Changes are applied with the same BookList, UserList and Loans methods the leader used, so the copy's own
+    change feed numbers each change the same as the leader did. This means other followers can carry on from
+    this one if it is promoted. Only the replication thread may change the copy until it is promoted, so
+    changes made by a query, e.g. from read, raise a PermissionError.
+
+    A follower further behind than the leader's feed retains, including a new follower of a leader that has
+    been running a while, is sent a checkpoint. The copy is rebuilt from it and then follows the changes after it.
+    """
+
+    def __init__(self, address):
+        self.address = address
+        self.thread = threading.Thread(target=self.replicate, daemon=True)
+        self.programme = self.new_programme()
+        self.applied_sequence = self.programme.feed.sequence
+        self.leader_sequence = 0
+        self.caught_up_at = None
+        self.error = None
+        self.running = False
+        self.connection = None
+        self.updated = threading.Condition()
+
+    def new_programme(self):
+        """Returns an empty read only copy, which only the replication thread can change."""
+        programme = LibraryProgramme(ReplayClock())
+        programme.transactions.writer = self.thread
+        return programme
+
+    def start(self):
+        """Connects to the leader and starts applying its changes in the background."""
+        self.connection = socket.create_connection(self.address)
+        message = {"from_sequence": self.applied_sequence}
+        self.connection.sendall((json.dumps(message) + "\n").encode("utf-8"))
+        self.running = True
+        self.thread.start()
+
+    def replicate(self):
+        """Applies each message from the leader until the connection closes or replication is stopped."""
+        try:
+            with self.connection.makefile("r", encoding="utf-8") as reader:
+                for line in reader:
+                    message = json.loads(line)
+                    with self.updated:
+                        if message["type"] == "error":
+                            self.error = message["message"]
+                            return
+                        if message["type"] == "change":
+                            self.apply_change(message["change"])
+                        elif message["type"] == "checkpoint":
+                            self.load_checkpoint(message["checkpoint"])
+
+                        self.leader_sequence = max(self.leader_sequence, message["leader_sequence"])
+                        if self.applied_sequence >= self.leader_sequence:
+                            self.caught_up_at = message["sent_at"]
+                        self.updated.notify_all()
+            if self.running:
+                self.error = "The leader closed the connection."
+        except OSError as error:
+            if self.running:
+                self.error = f"Lost connection to the leader: {error}"
+        except (KeyError, ValueError) as error:
+            self.error = f"Replication stopped: {error}"
+        finally:
+            with self.updated:
+                self.running = False
+                self.updated.notify_all()
+
+    def apply_change(self, change):
+        """Applies one change from the leader's change feed."""
+        record_type, action, data = change["record_type"], change["action"], change["data"]
+        book_list = self.programme.book_list
+        user_list = self.programme.user_list
+        loans = self.programme.loans
+
+        if record_type == "book" and action == "add":
+            book_list.save_book(data["title"], Books(data["title"], data["author"], data["book_id"],
+                                                     data["publisher"], data["stock"],
+                                                     read_date(data["release_date"])))
+        elif record_type == "book" and action == "remove":
+            book_list.delete_book(book_list.books_dict[data["title"]])
+        elif record_type == "book":
+            value = read_date(data["value"]) if data["attribute"] in DATE_ATTRIBUTES else data["value"]
+            book_list.update_book(book_list.books_dict[data["title"]], data["attribute"], value)
+
+        elif record_type == "user" and action == "add":
+            user_data = dict(data, date_of_birth=read_date(data["date_of_birth"]))
+            user_list.save_user(data["username"], Users(**user_data))
+        elif record_type == "user" and action == "remove":
+            user_list.delete_user(data["username"])
+        elif record_type == "user":
+            value = read_date(data["value"]) if data["attribute"] in DATE_ATTRIBUTES else data["value"]
+            user_list.update_user(user_list.users_dict[data["username"]], data["attribute"], value)
+
+        else:
+            # Loans are dated with the time they were made on the leader
+            clock = self.programme.clock
+            try:
+                if action == "borrow":
+                    clock.replay_time = datetime.fromisoformat(data["rented_on"])
+                    loans.create_loan(user_list.users_dict[data["username"]], book_list.books_dict[data["title"]])
+                else:
+                    clock.replay_time = datetime.fromisoformat(data["returned_on"])
+                    loans.close_loan(data["title"], data["username"])
+            finally:
+                clock.replay_time = None
+
+        self.applied_sequence = change["sequence"]
+        if self.programme.feed.sequence != self.applied_sequence:
+            raise ValueError(f"Change {self.applied_sequence} did not apply in order, the copy is out of step.")
+
+    def load_checkpoint(self, checkpoint):
+        """
+        Replaces the copy with one rebuilt from a leader's checkpoint. Each active loan is made again with
+        create_loan at the time it was made on the leader, so the books are saved with their copies on loan
+        added back to their stock first. A loan of a removed book is made on a stand in that is then removed.
+        """
+        programme = self.new_programme()
+        book_list, user_list, loans, clock = programme.book_list, programme.user_list, programme.loans, \
+            programme.clock
+        copies_on_loan = Counter(book_title for book_title, username, rented_on in checkpoint["loans"])
+
+        for data in checkpoint["books"]:
+            book_list.save_book(data["title"], Books(data["title"], data["author"], data["book_id"],
+                                                     data["publisher"], data["stock"] + copies_on_loan[data["title"]],
+                                                     read_date(data["release_date"])))
+        for data in checkpoint["users"]:
+            user_data = dict(data, date_of_birth=read_date(data["date_of_birth"]))
+            user_list.save_user(data["username"], Users(**user_data))
+
+        removed_titles = [book_title for book_title in copies_on_loan if book_title not in book_list.books_dict]
+        for book_title in removed_titles:
+            book_list.save_book(book_title, Books(book_title, "Removed", book_list.gen_book_id(), "Removed",
+                                                  copies_on_loan[book_title], None))
+
+        try:
+            for book_title, username, rented_on in checkpoint["loans"]:
+                clock.replay_time = read_datetime(rented_on)
+                borrower = user_list.users_dict.get(username) or Borrower(username)
+                loans.create_loan(borrower, book_list.books_dict[book_title])
+        finally:
+            clock.replay_time = None
+
+        for book_title in removed_titles:
+            book_list.delete_book(book_list.books_dict[book_title])
+
+        for book_title, username, rented_on, due_date, returned_on in checkpoint["returned_loans"]:
+            loan_details = {"username": username, "rented_on": read_datetime(rented_on),
+                            "due_date": read_datetime(due_date)}
+            loans.history.archive_loan(book_title, loan_details, read_datetime(returned_on))
+        loans.renamed_titles = dict(checkpoint["renamed_titles"])
+        loans.rebuild_recommendations()
+
+        # The copy now matches the leader at the checkpoint, so its feed carries on from the same sequence
+        programme.feed.retained.clear()
+        programme.feed.sequence = checkpoint["sequence"]
+        self.programme = programme
+        self.applied_sequence = checkpoint["sequence"]
+
+    def lag(self):
+        """
+        Returns how far behind the leader this follower is, as (number of changes, seconds). Seconds is how
+        long ago the follower was last fully caught up, so it keeps growing if the leader stops responding.
+        """
+        with self.updated:
+            changes_behind = self.leader_sequence - self.applied_sequence
+            if self.caught_up_at is None:
+                return changes_behind, float("inf")
+            return changes_behind, max(time.time() - self.caught_up_at, 0.0)
+
+    def wait_until_applied(self, sequence, timeout=10.0):
+        """Waits until the change with the given sequence number has been applied. Returns True if it has."""
+        with self.updated:
+            return self.updated.wait_for(lambda: self.applied_sequence >= sequence or not self.running, timeout) \
+                and self.applied_sequence >= sequence
+
+    def read(self, query, max_lag=1.0, timeout=5.0):
+        """
+        Runs a read only query, a function given the programme, once the follower is no more than max_lag
+        seconds behind the leader. No changes are applied while the query runs, and any change the query makes
+        raises a PermissionError. Raises a TimeoutError if the follower does not catch up within timeout seconds.
+        """
+        with self.updated:
+            if not self.updated.wait_for(lambda: self.lag()[1] <= max_lag, timeout):
+                raise TimeoutError(f"The follower is more than {max_lag} seconds behind the leader.")
+            return query(self.programme)
+
+    def stop(self):
+        """Stops applying changes and disconnects from the leader."""
+        self.running = False
+        if self.connection:
+            try:
+                self.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.connection.close()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def promote(self):
+        """
+        Stops following the leader and returns the programme, which can now be changed and can lead other
+        followers. Every change received before promotion has been applied.
+        """
+        self.stop()
+        self.programme.transactions.writer = None
+        return self.programme
+
+
+def run_follower(address, final_sequences, results):
+    """Runs a follower in its own process, reporting its lag, statistics and how long promotion took."""
+    follower = ReplicationFollower(address)
+    follower.start()
+    final_sequence = final_sequences.get()
+    follower.wait_until_applied(final_sequence)
+    lag = follower.lag()
+    snapshot = follower.read(lambda programme: programme.stats.snapshot())
+
+    start_time = time.perf_counter()
+    follower.promote()
+    results.put((lag, snapshot, time.perf_counter() - start_time, follower.error))
+
+
+def main():
+    """Runs a 30 day simulation on a leader while a follower process copies it, then promotes the follower."""
+    simulation = LibrarySimulation(seed=1)
+    leader = ReplicationLeader(simulation.book_list.feed)
+
+    final_sequences = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_follower, args=(leader.address, final_sequences, results))
+    process.start()
+
+    simulation.run(30)
+    final_sequences.put(simulation.book_list.feed.sequence)
+    (changes_behind, seconds_behind), snapshot, promotion_time, error = results.get()
+    process.join()
+    leader.close()
+
+    print(f"Changes sent: {simulation.book_list.feed.sequence}")
+    print(f"Follower lag: {changes_behind} changes, {seconds_behind:.2f} seconds")
+    print(f"Follower statistics match the leader: {snapshot == simulation.stats.snapshot()}")
+    print(f"Promotion took {promotion_time * 1000:.1f} ms")
+    if error:
+        print(f"Replication error: {error}")
+
+
+if __name__ == "__main__":
+    main()
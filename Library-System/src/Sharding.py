@@ -0,0 +1,364 @@
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+import zlib
+from collections import namedtuple
+from datetime import date
+from Books import BookList
+from Books import Books
+from Users import UserList
+from Users import Users
+from Loans import Loans
+from Stats import LibraryStats
+
+# The borrower of a loan held on a book shard, where the user themselves may be stored on another shard
+Borrower = namedtuple("Borrower", ["username"])
+
+
+def shard_for(key, shard_count):
+    """
+    Returns the shard that owns a book ID or username. Uses crc32 rather than hash(), as hash() of a string
+    is different in every process.
+    """
+    return zlib.crc32(str(key).encode("utf-8")) % shard_count
+
+
+class CatalogShard:
+    """
+    The books, users and loans owned by one shard, kept in its own worker process. Contains the following attributes:
+
+    - book_list, user_list, loans - The same classes used by the Library System, holding this shard's records
+    - held_copies (dict) - Copies of each book set aside by prepared borrows, using the book title as the key
+    - prepared (dict) - Each copy set aside and waiting to be committed or aborted, as (title, username, expiry
+      time), using the transaction ID as the key
+    - user_loans (dict) - The titles each user on this shard has on loan, on any shard, using the username as key
+    - prepare_timeout (float) - Seconds a copy stays set aside before it is put back without a commit
+
+    A loan is stored on the shard that owns the book. The shard that owns the user only keeps the titles.
+    The router does not keep a durable record of its transactions, so if it stops between prepare and commit
+    nothing will commit or abort them. Set aside copies are put back once prepare_timeout has passed, and a
+    commit that arrives after that is refused.
+    """
+
+    def __init__(self, prepare_timeout=30):
+        stats = LibraryStats()
+        self.book_list = BookList(stats)
+        self.user_list = UserList(stats, feed=self.book_list.feed, transactions=self.book_list.transactions,
+                                  tracer=self.book_list.tracer)
+        self.loans = Loans(self.book_list, self.user_list)
+        self.held_copies = {}
+        self.prepared = {}
+        self.user_loans = {}
+        self.prepare_timeout = prepare_timeout
+
+    def handle(self, command, arguments):
+        """Runs a command sent by the router and returns its result."""
+        return getattr(self, f"do_{command}")(*arguments)
+
+    def do_add_book(self, book):
+        """Adds a book to this shard."""
+        self.book_list.save_book(book.title, book)
+
+    def do_find_book(self, title):
+        """Returns the book with the given title, or None."""
+        return self.book_list.books_dict.get(title)
+
+    def do_add_user(self, user):
+        """Adds a user to this shard."""
+        self.user_list.save_user(user.username, user)
+        self.user_loans[user.username] = set()
+
+    def do_find_user(self, username):
+        """Returns the user with the given username, or None."""
+        return self.user_list.users_dict.get(username)
+
+    def can_lend(self, title, username):
+        """
+        Returns True if a copy of the book is in stock, and not set aside, and the user is not renting it or
+        waiting on a prepared borrow of it.
+        """
+        book = self.book_list.books_dict.get(title)
+        if not book or (title, username) in self.loans.books_on_loan:
+            return False
+        if any(prepared[:2] == (title, username) for prepared in self.prepared.values()):
+            return False
+        return book.stock - self.held_copies.get(title, 0) > 0
+
+    def expire_prepared(self):
+        """Puts back every copy that has been set aside for longer than prepare_timeout."""
+        now = time.monotonic()
+        for transaction_id, (title, username, expires_at) in list(self.prepared.items()):
+            if expires_at <= now:
+                del self.prepared[transaction_id]
+                self.release_copy(title)
+
+    def do_prepare_copy(self, transaction_id, title, username):
+        """First phase on the book shard. Sets a copy aside if it can be lent to the user."""
+        self.expire_prepared()
+        if not self.can_lend(title, username):
+            return False
+
+        self.held_copies[title] = self.held_copies.get(title, 0) + 1
+        self.prepared[transaction_id] = (title, username, time.monotonic() + self.prepare_timeout)
+        return True
+
+    def do_prepare_borrower(self, transaction_id, title, username):
+        """First phase on the user shard. Checks the user exists. Nothing is set aside, so nothing is stored."""
+        return username in self.user_list.users_dict
+
+    def do_commit(self, transaction_id):
+        """
+        Second phase on the book shard. Creates the loan from the copy set aside. Returns False if the copy was
+        put back because the commit arrived after prepare_timeout, or if the user is already renting the book.
+        """
+        self.expire_prepared()
+        prepared = self.prepared.pop(transaction_id, None)
+        if prepared is None:
+            return False
+
+        title, username, expires_at = prepared
+        self.release_copy(title)
+        if (title, username) in self.loans.books_on_loan:
+            return False
+        self.loans.create_loan(Borrower(username), self.book_list.books_dict[title])
+        return True
+
+    def do_record_loan(self, title, username):
+        """Second phase on the user shard. Records the title the user now has on loan."""
+        self.user_loans[username].add(title)
+
+    def release_copy(self, title):
+        """Returns a copy set aside by a prepared borrow."""
+        self.held_copies[title] -= 1
+        if not self.held_copies[title]:
+            del self.held_copies[title]
+
+    def do_borrow(self, title, username):
+        """Borrows a book when the book and the user are on this shard, in a single step."""
+        self.expire_prepared()
+        if username not in self.user_list.users_dict or not self.can_lend(title, username):
+            return False
+        self.loans.create_loan(Borrower(username), self.book_list.books_dict[title])
+        self.user_loans[username].add(title)
+        return True
+
+    def do_close_loan(self, title, username):
+        """Returns a book on the book shard. Returns False if the user is not renting it."""
+        if (title, username) not in self.loans.books_on_loan:
+            return False
+        self.loans.close_loan(title, username)
+        return True
+
+    def do_forget_loan(self, title, username):
+        """Removes a returned book from the user's titles on the user shard."""
+        self.user_loans[username].discard(title)
+
+    def do_find_user_loans(self, username):
+        """Returns the titles a user on this shard has on loan."""
+        return set(self.user_loans.get(username, ()))
+
+    def do_count(self):
+        """Returns the number of books, users and active loans on this shard."""
+        return len(self.book_list.books_dict), len(self.user_list.users_dict), len(self.loans.books_on_loan)
+
+
+def run_shard(connection, prepare_timeout=30):
+    """The main loop of a shard's worker process. Handles one command at a time until sent None."""
+    shard = CatalogShard(prepare_timeout)
+    while True:
+        request = connection.recv()
+        if request is None:
+            connection.close()
+            return
+
+        command, arguments = request
+        try:
+            reply = (True, shard.handle(command, arguments))
+        except Exception as error:
+            reply = (False, error)
+        connection.send(reply)
+
+
+class ShardRouter:
+    """
+    Spreads books and users across several worker processes, so lookups and checkouts use every CPU core
+    instead of one. Books are split by a hash of their book ID, and users by a hash of their username.
+    Contains the following attributes:
+
+    - shard_count (int) - The number of worker processes. Defaults to the number of CPU cores.
+    - connections (list) - A pipe to each worker process
+    - locks (list) - One lock per worker, so several threads can use the router, with each worker answering
+      one request at a time
+    - book_ids (dict) - Maps each book title to its book ID, so lookups by title can be sent to the right shard
+    - book_ids_lock (Lock) - Held while a title is added to book_ids, so two threads cannot add the same title
+
+    Borrowing a book held on another shard than the user uses a two phase protocol:
+    1. Prepare - The user's shard checks the user exists, and the book's shard sets a copy aside.
+    2. Commit if both shards agreed, creating the loan on the book's shard and then recording the title on
+       the user's shard. The book's shard is prepared last, so if either shard refuses no copy is set aside.
+    When the book and user are on the same shard, the borrow is a single request.
+
+    Transactions are only held in memory. If the router stops after prepare, the book's shard puts the copy
+    back after prepare_timeout seconds. If it stops after the book's shard commits, the loan exists but the
+    user's shard does not list it until the book is returned.
+    """
+
+    def __init__(self, shard_count=None, prepare_timeout=30):
+        self.shard_count = shard_count or os.cpu_count() or 1
+        self.connections = []
+        self.processes = []
+        self.locks = []
+        self.book_ids = {}
+        self.book_ids_lock = threading.Lock()
+        self.transaction_ids = itertools.count(1)
+
+        for shard_number in range(self.shard_count):
+            router_end, shard_end = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=run_shard, args=(shard_end, prepare_timeout), daemon=True)
+            process.start()
+            shard_end.close()
+            self.connections.append(router_end)
+            self.processes.append(process)
+            self.locks.append(threading.Lock())
+
+    def call(self, shard_number, command, *arguments):
+        """Sends a command to a shard and returns its result, raising any error the shard raised."""
+        with self.locks[shard_number]:
+            self.connections[shard_number].send((command, arguments))
+            succeeded, result = self.connections[shard_number].recv()
+        if not succeeded:
+            raise result
+        return result
+
+    def book_shard(self, title):
+        """Returns the shard that owns a book, or None if there is no book with that title."""
+        book_id = self.book_ids.get(title)
+        return None if book_id is None else shard_for(book_id, self.shard_count)
+
+    def user_shard(self, username):
+        """Returns the shard that owns a user."""
+        return shard_for(username, self.shard_count)
+
+    def add_book(self, book):
+        """Adds a book to the shard that owns its book ID. Returns False if the title is already used."""
+        with self.book_ids_lock:
+            if book.title in self.book_ids:
+                return False
+            self.call(shard_for(book.book_id, self.shard_count), "add_book", book)
+            self.book_ids[book.title] = book.book_id
+        return True
+
+    def add_user(self, user):
+        """Adds a user to the shard that owns their username."""
+        self.call(self.user_shard(user.username), "add_user", user)
+
+    def lookup_book(self, title):
+        """Returns a copy of the book with the given title, or None."""
+        shard_number = self.book_shard(title)
+        return None if shard_number is None else self.call(shard_number, "find_book", title)
+
+    def lookup_user(self, username):
+        """Returns a copy of the user with the given username, or None."""
+        return self.call(self.user_shard(username), "find_user", username)
+
+    def borrow_book(self, username, title):
+        """Lends a copy of a book to a user. Returns True if the book was borrowed."""
+        book_shard = self.book_shard(title)
+        if book_shard is None:
+            return False
+        user_shard = self.user_shard(username)
+        if book_shard == user_shard:
+            return self.call(book_shard, "borrow", title, username)
+
+        transaction_id = next(self.transaction_ids)
+        if not self.call(user_shard, "prepare_borrower", transaction_id, title, username):
+            return False
+        if not self.call(book_shard, "prepare_copy", transaction_id, title, username):
+            return False
+
+        # The user's shard set nothing aside, so only the book's shard can refuse a late commit
+        if not self.call(book_shard, "commit", transaction_id):
+            return False
+        self.call(user_shard, "record_loan", title, username)
+        return True
+
+    def return_book(self, username, title):
+        """
+        Returns a borrowed book. The loan is closed on the book's shard first, so if the user's shard is not
+        updated the user still lists the title, and returning it again tidies it up.
+        Returns True if the book was returned.
+        """
+        book_shard = self.book_shard(title)
+        returned = book_shard is not None and self.call(book_shard, "close_loan", title, username)
+        self.call(self.user_shard(username), "forget_loan", title, username)
+        return returned
+
+    def find_user_loans(self, username):
+        """Returns the titles a user currently has on loan, from any shard."""
+        return self.call(self.user_shard(username), "find_user_loans", username)
+
+    def count(self):
+        """Returns the total number of books, users and active loans across every shard."""
+        totals = [self.call(shard_number, "count") for shard_number in range(self.shard_count)]
+        return tuple(sum(column) for column in zip(*totals))
+
+    def close(self):
+        """Stops every worker process."""
+        for lock, connection in zip(self.locks, self.connections):
+            with lock:
+                connection.send(None)
+                connection.close()
+        for process in self.processes:
+            process.join()
+
+
+def benchmark(shard_count, number_of_books=2000, number_of_users=2000, operations=40000, threads=None):
+    """
+    Measures lookups and checkouts per second through a ShardRouter. Requests are sent from the given number
+    of threads, or one per shard by default. Each request goes to the shard that owns its book or user, so the
+    load on each shard depends on how the titles and usernames hash, not on which thread sent it.
+    Returns the operations per second.
+    """
+    router = ShardRouter(shard_count)
+    try:
+        for book_id in range(number_of_books):
+            router.add_book(Books(f"Book {book_id}", "Author", book_id, "Publisher", 5, date(2000, 1, 1)))
+        for user_number in range(number_of_users):
+            router.add_user(Users(f"Patron{user_number:05}", "Patron", "Benchmark", 1, "Library Road",
+                                  "SW1A 1AA", f"patron{user_number:05}@example.com", date(1990, 1, 1)))
+
+        thread_count = threads or router.shard_count
+        per_thread = operations // thread_count
+
+        def send_requests(thread_number):
+            for operation in range(per_thread):
+                number = thread_number * per_thread + operation
+                title = f"Book {number % number_of_books}"
+                if operation % 4:
+                    router.lookup_book(title)
+                else:
+                    router.borrow_book(f"Patron{number % number_of_users:05}", title)
+
+        workers = [threading.Thread(target=send_requests, args=(number,)) for number in range(thread_count)]
+        start_time = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start_time
+    finally:
+        router.close()
+    return per_thread * thread_count / elapsed
+
+
+def main():
+    """Compares throughput with one shard against one shard per CPU core."""
+    cores = os.cpu_count() or 1
+    for shard_count in sorted({1, max(cores // 2, 1), cores}):
+        print(f"{shard_count} shard(s): {benchmark(shard_count):,.0f} operations per second")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import heapq
+import random
+from datetime import date, datetime, timedelta
+from Books import BookList
+from Books import Books
+from Users import UserList
+from Users import Users
+from Loans import Loans
+from Clock import SimulatedClock
+from Stats import LibraryStats
+
+
+class LibrarySimulation:
+    """
+    Simulates patrons borrowing and returning books over weeks or months of library time, using a
+    SimulatedClock so the simulation runs as fast as the computer allows. Used for capacity planning,
+    e.g. to see whether there are enough copies of each book before term starts.
+
+    Events (a patron arriving, or a patron returning a book) are kept in a heap ordered by time. Each event is
+    handled in turn, moving the simulated clock forward to the time of the event. Patrons arrive at random,
+    and keep each book for a random number of days, so some books are returned late.
+
+    The simulation reports:
+    - The number of loans made, and the number of times a patron found a book out of stock
+    - The longest and average waiting list for an out of stock book
+    - The percentage of returned books that were overdue
+    """
+
+    def __init__(self, number_of_books=50, copies_per_book=2, number_of_patrons=200,
+                 arrivals_per_day=40, average_loan_days=12, seed=None):
+        self.random = random.Random(seed)
+        self.clock = SimulatedClock(datetime(2025, 9, 1, 9, 0))
+        self.stats = LibraryStats()
+        self.book_list = BookList(self.stats, self.clock)
+        self.user_list = UserList(self.stats, self.clock, feed=self.book_list.feed,
+                                  transactions=self.book_list.transactions, tracer=self.book_list.tracer)
+        self.loans = Loans(self.book_list, self.user_list, self.clock)
+
+        self.arrivals_per_day = arrivals_per_day
+        self.average_loan_days = average_loan_days
+        self.events = []
+        self.event_count = 0
+
+        # Waiting lists of usernames for out of stock books, using the book title as the key
+        self.waiting_lists = {}
+        self.patrons_waiting = 0
+
+        # Results
+        self.loans_made = 0
+        self.stock_outs = 0
+        self.returns = 0
+        self.overdue_returns = 0
+        self.longest_waiting_list = 0
+        self.waiting_list_samples = []
+
+        self.create_books(number_of_books, copies_per_book)
+        self.create_patrons(number_of_patrons)
+        self.titles = list(self.book_list.books_dict)
+        self.usernames = list(self.user_list.users_dict)
+
+    def create_books(self, number_of_books, copies_per_book):
+        """Adds the books used in the simulation. Book IDs are 0-299 so at most 300 books can be created."""
+        for book_id in range(min(number_of_books, 300)):
+            book = Books(title=f"Book {book_id}", author="Author", book_id=book_id, publisher="Publisher",
+                         stock=copies_per_book, release_date=date(2000, 1, 1))
+            self.book_list.save_book(book.title, book)
+
+    def create_patrons(self, number_of_patrons):
+        """Adds the users that borrow books in the simulation."""
+        for number in range(number_of_patrons):
+            username = f"Patron{number:05d}"
+            user = Users(username, "Patron", "Simulated", 1, "Library Road", "SW1A 1AA",
+                         f"{username.lower()}@example.com", date(1990, 1, 1))
+            self.user_list.save_user(username, user)
+
+    def schedule(self, event_time, event_type, details):
+        """Adds an event to the heap. event_count keeps events at the same time in the order they were added."""
+        self.event_count += 1
+        heapq.heappush(self.events, (event_time, self.event_count, event_type, details))
+
+    def schedule_next_arrival(self):
+        """Schedules the next patron to arrive, using a random gap based on arrivals_per_day."""
+        gap_in_days = self.random.expovariate(self.arrivals_per_day)
+        self.schedule(self.clock.now() + timedelta(days=gap_in_days), "arrive", None)
+
+    def lend(self, user, book):
+        """Lends a book to a user and schedules the day they return it."""
+        self.loans.create_loan(user, book)
+        self.loans_made += 1
+
+        loan_days = self.random.expovariate(1 / self.average_loan_days)
+        self.schedule(self.clock.now() + timedelta(days=loan_days), "return", (book.title, user.username))
+
+    def handle_arrival(self):
+        """A patron arrives and tries to borrow a random book, joining the waiting list if it is out of stock."""
+        user = self.user_list.users_dict[self.random.choice(self.usernames)]
+        book = self.book_list.books_dict[self.random.choice(self.titles)]
+
+        if (book.title, user.username) in self.loans.books_on_loan:
+            return
+
+        if book.stock > 0:
+            self.lend(user, book)
+        else:
+            self.stock_outs += 1
+            waiting_list = self.waiting_lists.setdefault(book.title, [])
+            if user.username not in waiting_list:
+                waiting_list.append(user.username)
+                self.patrons_waiting += 1
+            self.longest_waiting_list = max(self.longest_waiting_list, len(waiting_list))
+
+    def handle_return(self, book_title, username):
+        """A patron returns a book, which is then lent to the next patron on the waiting list."""
+        loan_details = self.loans.close_loan(book_title, username)
+        self.returns += 1
+        if loan_details['due_date'] < self.clock.now():
+            self.overdue_returns += 1
+
+        waiting_list = self.waiting_lists.get(book_title)
+        while waiting_list:
+            next_user = self.user_list.users_dict[waiting_list.pop(0)]
+            self.patrons_waiting -= 1
+            if (book_title, next_user.username) not in self.loans.books_on_loan:
+                self.lend(next_user, self.book_list.books_dict[book_title])
+                break
+
+    def run(self, days):
+        """Runs the simulation for a number of days and returns the results."""
+        end_time = self.clock.now() + timedelta(days=days)
+        self.schedule_next_arrival()
+
+        while self.events and self.events[0][0] <= end_time:
+            event_time, _, event_type, details = heapq.heappop(self.events)
+            self.clock.advance_to(event_time)
+
+            if event_type == "arrive":
+                self.handle_arrival()
+                self.schedule_next_arrival()
+                self.waiting_list_samples.append(self.patrons_waiting)
+            elif event_type == "return":
+                self.handle_return(*details)
+
+        self.clock.advance_to(end_time)
+        return self.results()
+
+    def results(self):
+        """Returns the results of the simulation in a dictionary."""
+        samples = self.waiting_list_samples
+        return {
+            "loans_made": self.loans_made,
+            "stock_outs": self.stock_outs,
+            "longest_waiting_list": self.longest_waiting_list,
+            "average_patrons_waiting": sum(samples) / len(samples) if samples else 0,
+            "overdue_return_rate": self.overdue_returns / self.returns if self.returns else 0,
+            "copies_on_loan_at_end": self.stats.copies_on_loan,
+            "overdue_at_end": sum(1 for loan_details in self.loans.books_on_loan.values()
+                                  if loan_details['due_date'] < self.clock.now()),
+        }
+
+    def display_results(self, days):
+        """Runs the simulation for a number of days and displays the results to the user."""
+        results = self.run(days)
+        print(f"--- Library Simulation Results ({days} days) ---")
+        print(f"Loans made: {results['loans_made']}")
+        print(f"Times a book was out of stock: {results['stock_outs']}")
+        print(f"Longest waiting list for a book: {results['longest_waiting_list']}")
+        print(f"Average number of patrons waiting: {results['average_patrons_waiting']:.1f}")
+        print(f"Books returned overdue: {results['overdue_return_rate']:.1%}")
+        print(f"Copies on loan at the end: {results['copies_on_loan_at_end']}")
+        print(f"Loans overdue at the end: {results['overdue_at_end']}")
+
+
+def main():
+    """Runs a 90 day simulation with the default settings."""
+    simulation = LibrarySimulation(seed=1)
+    simulation.display_results(days=90)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+# A read only copy of a book's attributes, as they were when a snapshot was taken
+BookView = namedtuple("BookView", ["title", "author", "book_id", "publisher", "stock", "release_date"])
+
+
+def view_book(book):
+    """Returns a BookView holding the current attributes of a book."""
+    return BookView(book.title, book.author, book.book_id, book.publisher, book.stock, book.release_date)
+
+
+class LibrarySnapshot:
+    """
+    A point in time view of the books and loans in the Library System, used by long running reports so they
+    see a consistent view while books continue to be borrowed, returned and edited. Contains the following
+    attributes:
+
+    - version (int) - Increases by one for every snapshot taken
+    - books_dict (dict) - The live books dictionary, which may be a TieredBookDict stored partly on disk
+    - books_on_loan (dict) - A copy of the loans dictionary when the snapshot was taken
+    - saved_books (dict) - The old BookView of every title changed after the snapshot was taken, or None for a
+      title that was added after it was taken
+    - lock (RLock) - The lock of the SnapshotManager, held while reading so a book is never read mid-change
+
+    The books dictionary is not copied. A book is only copied, into saved_books, the first time it is changed,
+    added or removed while the snapshot is open, and every other book is read from books_dict when it is
+    needed, so a report that reads a few books never reads the rest from disk.
+    """
+
+    def __init__(self, version, books_dict, books_on_loan, lock):
+        self.version = version
+        self.books_dict = books_dict
+        self.books_on_loan = books_on_loan.copy()
+        self.saved_books = {}
+        self.lock = lock
+
+    def get_book(self, title):
+        """Returns a BookView of a book as it was when the snapshot was taken, or None if it did not exist."""
+        with self.lock:
+            if title in self.saved_books:
+                return self.saved_books[title]
+            book = self.books_dict.get(title)
+            return view_book(book) if book is not None else None
+
+    def iter_books(self):
+        """Yields a BookView of every book as it was when the snapshot was taken."""
+        with self.lock:
+            titles = list(self.books_dict)
+            titles.extend(title for title in self.saved_books if title not in self.books_dict)
+
+        for title in titles:
+            book_view = self.get_book(title)
+            if book_view is not None:
+                yield book_view
+
+
+class SnapshotManager:
+    """
+    Takes and releases snapshots of the Library System. Contains the following attributes:
+
+    - open_snapshots (list) - Snapshots that are still being read
+    - version (int) - The version number given to the most recent snapshot
+
+    Before a book is changed or removed, before_book_change must be called so any open snapshots keep the old
+    attributes, and before a title is added, before_title_added must be called so they do not see the new book.
+    When no snapshots are open these do nothing, so writers are not slowed down. Snapshots are
+    forgotten as soon as they are released, along with any books saved for them.
+
+    A change that updates several things at once, e.g. a loan and the stock of its book, is made inside
+    a with statement using change, so a snapshot is never taken half way through it.
+    """
+
+    def __init__(self):
+        self.open_snapshots = []
+        self.version = 0
+        self.lock = threading.RLock()
+
+    @contextmanager
+    def snapshot(self, books_dict, books_on_loan):
+        """
+        Takes a snapshot for use in a with statement, and releases it at the end of the with statement.
+        E.g. with snapshots.snapshot(books_dict, books_on_loan) as snapshot:
+        """
+        with self.lock:
+            self.version += 1
+            current_snapshot = LibrarySnapshot(self.version, books_dict, books_on_loan, self.lock)
+            self.open_snapshots.append(current_snapshot)
+        try:
+            yield current_snapshot
+        finally:
+            with self.lock:
+                self.open_snapshots.remove(current_snapshot)
+
+    @contextmanager
+    def change(self):
+        """
+        Holds the snapshot lock for use in a with statement, so no snapshot is taken until the changes made in
+        the with statement are complete. E.g. with snapshots.change():
+        """
+        with self.lock:
+            yield
+
+    def before_book_change(self, book):
+        """Saves the current attributes of a book into every open snapshot that has not already saved it."""
+        with self.lock:
+            for open_snapshot in self.open_snapshots:
+                if book.title not in open_snapshot.saved_books:
+                    open_snapshot.saved_books[book.title] = view_book(book)
+
+    def before_title_added(self, title):
+        """Records in every open snapshot that has not already saved the title that it did not exist."""
+        with self.lock:
+            for open_snapshot in self.open_snapshots:
+                open_snapshot.saved_books.setdefault(title, None)
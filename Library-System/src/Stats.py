@@ -0,0 +1,128 @@
+class LibraryStats:
+    """
+    Keeps running totals about the Library System so statistics can be displayed without looping over
+    every book, user and loan. Contains the following counters:
+
+    - total_books: Number of book titles in the collection
+    - available_copies: Number of copies in stock and available to rent
+    - copies_on_loan: Number of copies currently being rented
+    - total_users: Number of users in the system
+    - author_counts (dict): Number of book titles for each author
+    - borrower_counts (dict): Number of books currently being rented by each user
+
+    The counters are updated every time a book or user is added, removed or edited, and every time a book
+    is borrowed or returned. verify_stats recounts everything from scratch to check the counters are correct.
+    """
+
+    def __init__(self):
+        self.total_books = 0
+        self.available_copies = 0
+        self.copies_on_loan = 0
+        self.total_users = 0
+        self.author_counts = {}
+        self.borrower_counts = {}
+
+    def book_added(self, book):
+        """Updates the counters when a new book is saved to the collection."""
+        self.total_books += 1
+        self.available_copies += book.stock
+        self.author_counts[book.author] = self.author_counts.get(book.author, 0) + 1
+
+    def book_removed(self, book):
+        """Updates the counters when a book is removed from the collection."""
+        self.total_books -= 1
+        self.available_copies -= book.stock
+        self.author_counts[book.author] -= 1
+        if not self.author_counts[book.author]:
+            del self.author_counts[book.author]
+
+    def book_updated(self, attribute, old_value, new_value):
+        """Updates the counters when the author or the stock of an existing book is edited."""
+        if attribute == "author":
+            self.author_counts[old_value] -= 1
+            if not self.author_counts[old_value]:
+                del self.author_counts[old_value]
+            self.author_counts[new_value] = self.author_counts.get(new_value, 0) + 1
+
+        elif attribute == "stock":
+            self.available_copies += new_value - old_value
+
+    def user_added(self):
+        """Updates the counters when a new user is saved to the system."""
+        self.total_users += 1
+
+    def user_removed(self):
+        """Updates the counters when a user is removed from the system."""
+        self.total_users -= 1
+
+    def loan_opened(self, username, from_stock=True):
+        """
+        Updates the counters when a user borrows a book. from_stock is False when a return is rolled back for a
+        book that has been removed from the collection, as the copy never went back into stock.
+        """
+        if from_stock:
+            self.available_copies -= 1
+        self.copies_on_loan += 1
+        self.borrower_counts[username] = self.borrower_counts.get(username, 0) + 1
+
+    def loan_closed(self, username, restocked=True):
+        """
+        Updates the counters when a user returns a book. restocked is False when the book has been removed from
+        the collection while it was on loan, so the returned copy does not go back into stock.
+        """
+        if restocked:
+            self.available_copies += 1
+        self.copies_on_loan -= 1
+        self.borrower_counts[username] -= 1
+        if not self.borrower_counts[username]:
+            del self.borrower_counts[username]
+
+    def total_copies(self):
+        """Returns the number of copies owned by the library, both in stock and on loan."""
+        return self.available_copies + self.copies_on_loan
+
+    def active_borrowers(self):
+        """Returns the number of users currently renting at least one book."""
+        return len(self.borrower_counts)
+
+    def snapshot(self):
+        """Returns every counter in a dictionary, used to compare the running totals with a full recount."""
+        return {
+            "total_books": self.total_books,
+            "available_copies": self.available_copies,
+            "copies_on_loan": self.copies_on_loan,
+            "total_users": self.total_users,
+            "author_counts": dict(self.author_counts),
+            "borrower_counts": dict(self.borrower_counts),
+        }
+
+    def verify_stats(self, books_dict, users_dict, books_on_loan):
+        """
+        Recounts every statistic from the books, users and loans dictionaries and compares the result with the
+        running totals. Returns a dictionary of the counters that do not match, as (running total, recount).
+        An empty dictionary means the counters are correct.
+        """
+        recount = LibraryStats()
+        for book in books_dict.values():
+            recount.book_added(book)
+        for _ in users_dict:
+            recount.user_added()
+        for loan_details in books_on_loan.values():
+            recount.copies_on_loan += 1
+            username = loan_details['username']
+            recount.borrower_counts[username] = recount.borrower_counts.get(username, 0) + 1
+
+        current = self.snapshot()
+        expected = recount.snapshot()
+        return {name: (current[name], expected[name]) for name in current if current[name] != expected[name]}
+
+    def display_stats(self):
+        """Displays the library statistics to the user."""
+        print("--- Library System Statistics ---")
+        print(f"Book titles in the collection: {self.total_books}")
+        print(f"Total copies owned: {self.total_copies()}")
+        print(f"Copies available to rent: {self.available_copies}")
+        print(f"Copies currently on loan: {self.copies_on_loan}")
+        print(f"Registered users: {self.total_users}")
+        print(f"Users currently renting books: {self.active_borrowers()}")
+        print(f"Number of authors: {len(self.author_counts)}")
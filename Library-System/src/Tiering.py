@@ -0,0 +1,197 @@
+import shelve
+import sys
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from Books import BookList
+from Filters import ScalableBloomFilter
+
+
+def book_size(book):
+    """Returns an estimate of the memory used by a book object and its attributes, in bytes."""
+    return sys.getsizeof(book) + sys.getsizeof(book.__dict__) + sum(
+        sys.getsizeof(value) for value in book.__dict__.values())
+
+
+def deep_size(value, seen=None):
+    """
+    Returns an estimate of the memory used by a value and everything it holds, in bytes. Follows dictionaries,
+    lists, tuples, sets and the attributes of objects, counting each object once.
+    """
+    seen = seen if seen is not None else set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_size(key, seen) + deep_size(item, seen) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(deep_size(item, seen) for item in value)
+    elif hasattr(value, "__dict__"):
+        size += deep_size(value.__dict__, seen)
+    return size
+
+
+class TieredBookDict(MutableMapping):
+    """
+    A dictionary of books that keeps recently used books in memory (the hot tier) and every other book in
+    a file on disk (the cold tier), so very large collections can be stored in a fixed amount of memory.
+    Contains the following attributes:
+
+    - hot_books (OrderedDict) - The books held in memory, least recently used first
+    - cold_books (shelf) - The books stored on disk, using the shelve module
+    - max_bytes (int) - The most memory the hot tier may use, in bytes
+    - memory_used (int) - The estimated memory currently used by the hot tier, in bytes
+    - sizes (dict) - The size charged to memory_used for each book in memory, so the same amount is taken off
+      when it leaves memory even if the book has been edited since
+    - hits, misses (int) - How often a book was found in memory, and how often it had to be read from disk
+
+    When a book on disk is used, it is read back into memory. When the hot tier uses more than max_bytes, the
+    least recently used books are written to disk and removed from memory. Each book is only ever held in
+    one of the two tiers. Books read back from disk are new objects, so anything holding on to the old object
+    (e.g. an undo change) will no longer match the book in the collection.
+    """
+
+    def __init__(self, filename, max_bytes=16 * 1024 * 1024):
+        self.hot_books = OrderedDict()
+        self.cold_books = shelve.open(filename)
+        self.max_bytes = max_bytes
+        self.memory_used = 0
+        self.sizes = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __getitem__(self, title):
+        if title in self.hot_books:
+            self.hits += 1
+            self.hot_books.move_to_end(title)
+            return self.hot_books[title]
+
+        if title not in self.cold_books:
+            raise KeyError(title)
+
+        # Read the book back into memory
+        self.misses += 1
+        book = self.cold_books.pop(title)
+        self.add_to_memory(title, book)
+        return book
+
+    def __setitem__(self, title, book):
+        if title in self.hot_books:
+            del self.hot_books[title]
+            self.memory_used -= self.sizes.pop(title)
+        elif title in self.cold_books:
+            del self.cold_books[title]
+        self.add_to_memory(title, book)
+
+    def __delitem__(self, title):
+        if title in self.hot_books:
+            del self.hot_books[title]
+            self.memory_used -= self.sizes.pop(title)
+        else:
+            del self.cold_books[title]
+
+    def __contains__(self, title):
+        return title in self.hot_books or title in self.cold_books
+
+    def __iter__(self):
+        yield from list(self.hot_books)
+        yield from list(self.cold_books.keys())
+
+    def __len__(self):
+        return len(self.hot_books) + len(self.cold_books)
+
+    def add_to_memory(self, title, book):
+        """Adds a book to the hot tier, then moves least recently used books to disk until under max_bytes."""
+        self.hot_books[title] = book
+        self.sizes[title] = book_size(book)
+        self.memory_used += self.sizes[title]
+
+        # Always keep the book that was just added in memory
+        while self.memory_used > self.max_bytes and len(self.hot_books) > 1:
+            old_title, old_book = self.hot_books.popitem(last=False)
+            self.memory_used -= self.sizes.pop(old_title)
+            self.cold_books[old_title] = old_book
+
+    def hit_ratio(self):
+        """Returns the fraction of lookups that found the book in memory."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0
+
+    def close(self):
+        """Writes every book in memory to disk and closes the file."""
+        for title, book in self.hot_books.items():
+            self.cold_books[title] = book
+        self.hot_books.clear()
+        self.sizes.clear()
+        self.memory_used = 0
+        self.cold_books.close()
+
+
+class TieredBookList(BookList):
+    """
+    A BookList that stores its books in a TieredBookDict, keeping the most recently used books in memory and
+    the rest on disk. Works the same as BookList, with an extra method to display the cache hit ratio.
+    Changes made to a book in memory are written to disk when the book is moved out of memory, or on close.
+
+    Books already saved in the file are added to the statistics, indexes and title filter on start up, without
+    reading them into memory. title_error_rate is the chance the title filter lets a missing title through to
+    a disk read.
+
+    A book looked up earlier may have been written to disk and read back as a new object since, so
+    update_book, change_loan_stock and delete_book change the book currently held in books_dict rather than
+    the object they are given, then copy the change onto that object so the caller still sees it.
+
+    max_bytes only limits the books held in memory. The indexes are always held in memory and hold a few short
+    entries (title, book ID, author, publisher and release date) for every book, including the books on disk,
+    so they grow with the size of the collection. index_size estimates their memory, and is shown with the
+    cache statistics.
+    """
+
+    def __init__(self, filename, max_bytes=16 * 1024 * 1024, stats=None, clock=None, command_log=None,
+                 feed=None, transactions=None, title_error_rate=0.001, tracer=None):
+        super().__init__(stats, clock, command_log, feed, transactions, tracer)
+        self.books_dict = TieredBookDict(filename, max_bytes)
+        self.title_filter = ScalableBloomFilter(max(len(self.books_dict.cold_books), 1024), title_error_rate)
+
+        for book in self.books_dict.cold_books.values():
+            self.index_book(book)
+
+    def stored_book(self, book):
+        """Returns the object held in books_dict for a book, reading it back into memory if it is on disk."""
+        return self.books_dict[book.title]
+
+    def update_book(self, book, attribute, new_value):
+        """Changes a single attribute of the stored copy of a book, as BookList.update_book does."""
+        super().update_book(self.stored_book(book), attribute, new_value)
+        setattr(book, attribute, new_value)
+
+    def change_loan_stock(self, book, amount):
+        """Changes the stock of the stored copy of a book, as BookList.change_loan_stock does."""
+        stored_book = self.stored_book(book)
+        super().change_loan_stock(stored_book, amount)
+        book.stock = stored_book.stock
+
+    def delete_book(self, book):
+        """Deletes the stored copy of a book, so the statistics remove the stock it really has."""
+        super().delete_book(self.stored_book(book))
+
+    def display_cache_stats(self):
+        """Displays how many books are in memory and on disk, and how often books were found in memory."""
+        books_dict = self.books_dict
+        print(f"Books in memory: {len(books_dict.hot_books)} ({books_dict.memory_used} bytes)")
+        print(f"Books on disk: {len(books_dict.cold_books)}")
+        print(f"Index memory: {self.index_size()} bytes")
+        print(f"Memory hits: {books_dict.hits}, Disk reads: {books_dict.misses}")
+        print(f"Hit ratio: {books_dict.hit_ratio():.1%}")
+
+    def index_size(self):
+        """Returns an estimate of the memory used by the indexes and title filter, in bytes."""
+        indexes = (self.release_index, self.author_index, self.publisher_index, self.book_titles, self.id_order,
+                   self.title_order, self.title_filter)
+        seen = set()
+        return sum(deep_size(index, seen) for index in indexes)
+
+    def close(self):
+        """Writes every book to disk and closes the file."""
+        self.books_dict.close()
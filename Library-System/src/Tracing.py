@@ -0,0 +1,204 @@
+import functools
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from collections import deque
+from datetime import datetime
+
+# Profiles are kept next to the source folder rather than wherever the programme was started from
+DEFAULT_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "traces")
+
+
+class Span:
+    """
+    Times one call of an operation. Used as a context manager by Tracer.span. A plain class rather than a
+    generator, as it is entered on every traced call and must cost as little as possible.
+    """
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+        self.start_time = 0.0
+
+    def __enter__(self):
+        self.tracer.enter_span(self)
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        duration = time.perf_counter() - self.start_time
+        self.tracer.exit_span(self, duration)
+        return False
+
+
+class Tracer:
+    """
+    Times the core operations of the Library System and keeps a log of any that are slow. Contains the
+    following attributes:
+
+    - thresholds (dict) - The time in milliseconds above which each operation is slow, using the operation
+      name as the key, e.g. {"Loans.close_loan": 50}. Operations not listed use default_threshold_ms.
+    - slow_log (deque) - The most recent slow operations as (finished_at, path, milliseconds). path includes
+      the operations it was called from, e.g. "Loans.return_all_books > Loans.close_loan".
+    - directory (str) - Where profiles are written, the traces folder next to src by default. Created when
+      the first profile is written.
+    - max_captures (int) - The number of profiles kept. The oldest are deleted when there are more.
+    - sample_interval (float) - How often, in seconds, the stack of each thread inside a traced operation is
+      sampled
+    - samples (dict) - The recent stack samples of each thread inside a traced operation, as a deque of
+      (perf_counter time, stack), using the thread ID as the key. Removed when the thread leaves the operation.
+
+    While any thread is inside a traced operation, a background thread samples its stack every
+    sample_interval seconds. When an operation is slow, the samples taken during that call are written to
+    directory as folded stacks, one "outermost;...;innermost count" line per stack, so the slow call itself
+    is profiled rather than a later call that may be fast. If tracemalloc is running, the largest memory
+    allocations are written too. A call costs two clock readings, plus a lock for the outermost operation
+    of each thread. The sampler stops after idle_timeout seconds with no traced operations.
+    """
+
+    def __init__(self, default_threshold_ms=100.0, thresholds=None, directory=DEFAULT_DIRECTORY, max_captures=20,
+                 max_log=1000, sample_interval=0.005, max_samples=10000, idle_timeout=5.0):
+        self.default_threshold_ms = default_threshold_ms
+        self.thresholds = thresholds if thresholds is not None else {}
+        self.slow_log = deque(maxlen=max_log)
+        self.directory = directory
+        self.max_captures = max_captures
+        self.sample_interval = sample_interval
+        self.max_samples = max_samples
+        self.idle_timeout = idle_timeout
+        self.samples = {}
+        self.sampler = None
+        self.enabled = True
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def span(self, name):
+        """Returns a context manager that times an operation. Spans inside other spans are logged with their path."""
+        return Span(self, name)
+
+    def enter_span(self, span):
+        """Adds a span to this thread's stack of open spans. The outermost span starts sampling the thread."""
+        stack = self.local.__dict__.setdefault("stack", [])
+        stack.append(span.name)
+
+        if len(stack) == 1:
+            with self.lock:
+                self.samples[threading.get_ident()] = deque(maxlen=self.max_samples)
+                if self.sampler is None:
+                    self.sampler = threading.Thread(target=self.sample_stacks, name="tracer-sampler", daemon=True)
+                    self.sampler.start()
+
+    def exit_span(self, span, duration):
+        """Removes a span from the stack, logging it and writing its samples if it was slow."""
+        stack = self.local.stack
+        path = " > ".join(stack)
+        stack.pop()
+
+        milliseconds = duration * 1000
+        slow = self.enabled and milliseconds >= self.thresholds.get(span.name, self.default_threshold_ms)
+
+        with self.lock:
+            thread_samples = self.samples.get(threading.get_ident(), ())
+            stacks = Counter(sample for taken_at, sample in thread_samples if taken_at >= span.start_time) \
+                if slow else None
+            if not stack:
+                self.samples.pop(threading.get_ident(), None)
+
+        if slow:
+            self.slow_log.append((datetime.now(), path, milliseconds))
+            self.write_capture(span, path, milliseconds, stacks)
+
+    def sample_stacks(self):
+        """Samples the stack of every thread inside a traced operation, until none have been for idle_timeout."""
+        sampler_id = threading.get_ident()
+        idle_since = time.perf_counter()
+        while True:
+            time.sleep(self.sample_interval)
+            with self.lock:
+                thread_ids = list(self.samples)
+                if not thread_ids and time.perf_counter() - idle_since >= self.idle_timeout:
+                    self.sampler = None
+                    return
+            if not thread_ids:
+                continue
+
+            taken_at = idle_since = time.perf_counter()
+            frames = sys._current_frames()
+            folded = {thread_id: fold_stack(frames[thread_id]) for thread_id in thread_ids
+                      if thread_id in frames and thread_id != sampler_id}
+            with self.lock:
+                for thread_id, sample in folded.items():
+                    if thread_id in self.samples:
+                        self.samples[thread_id].append((taken_at, sample))
+
+    def write_capture(self, span, path, milliseconds, stacks):
+        """Writes the stack samples of a slow call, and the largest memory allocations if tracemalloc is running."""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            filename = f"{datetime.now():%Y%m%d-%H%M%S-%f}-{span.name.replace('.', '-')}"
+            stem = os.path.join(self.directory, filename)
+            with open(f"{stem}.stacks.txt", "w", encoding="utf-8") as stacks_file:
+                stacks_file.write(f"# {path} took {milliseconds:.1f} ms, {sum(stacks.values())} samples taken every "
+                                  f"{self.sample_interval * 1000:g} ms\n")
+                for sample, count in stacks.most_common():
+                    stacks_file.write(f"{sample} {count}\n")
+
+            if tracemalloc.is_tracing():
+                memory_snapshot = tracemalloc.take_snapshot()
+                with open(f"{stem}.memory.txt", "w", encoding="utf-8") as memory_file:
+                    memory_file.write(f"{path} took {milliseconds:.1f} ms\n\nLargest allocations:\n")
+                    for statistic in memory_snapshot.statistics("lineno")[:25]:
+                        memory_file.write(f"{statistic}\n")
+            self.rotate_captures()
+        except OSError as error:
+            self.slow_log.append((datetime.now(), f"Could not write profile of {path}: {error}", milliseconds))
+
+    def rotate_captures(self):
+        """Deletes the oldest profiles so at most max_captures are kept."""
+        extensions = (".stacks.txt", ".memory.txt")
+        stems = set()
+        for filename in os.listdir(self.directory):
+            for extension in extensions:
+                if filename.endswith(extension):
+                    stems.add(filename[:-len(extension)])
+
+        # File names start with the time of the capture, so sorting them puts the oldest first
+        for stem in sorted(stems)[:max(len(stems) - self.max_captures, 0)]:
+            for extension in extensions:
+                path = os.path.join(self.directory, stem + extension)
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def display_slow_operations(self, amount=20):
+        """Displays the most recent slow operations, newest first."""
+        if not self.slow_log:
+            print("No slow operations have been recorded.")
+            return
+
+        print("--- Slow Operations ---")
+        for finished_at, path, milliseconds in list(self.slow_log)[::-1][:amount]:
+            print(f"{finished_at:%Y-%m-%d %H:%M:%S} {path}: {milliseconds:.1f} ms")
+        print(f"Profiles of slow operations are written to '{self.directory}'.")
+
+
+def fold_stack(frame, max_depth=64):
+    """Returns a stack as one line, outermost call first, e.g. "Main.py:main;Loans.py:borrow_book"."""
+    calls = []
+    while frame is not None and len(calls) < max_depth:
+        calls.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(calls))
+
+
+def traced(method):
+    """Times every call of a BookList, UserList or Loans method with the tracer of the object it is called on."""
+    name = method.__qualname__
+
+    @functools.wraps(method)
+    def traced_method(self, *arguments, **keyword_arguments):
+        with self.tracer.span(name):
+            return method(self, *arguments, **keyword_arguments)
+    return traced_method
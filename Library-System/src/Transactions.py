@@ -0,0 +1,207 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+
+class Journal:
+    """
+    A durable log of every committed change, written to a file as one JSON change per line.
+    Contains the following attributes:
+
+    - filename (str) - The file the changes are written to
+    - pending (list) - Lines waiting to be written by the next flush
+    - appended (int) - The number of commits added to pending so far
+    - flushed (int) - The number of commits written to disk so far
+    - flushes (int) - The number of times the file has been flushed to disk
+    - error (OSError) - The error raised by a failed flush, or None
+
+    Flushing to disk is slow, so commits are grouped. While one caller is flushing, other callers add their
+    changes to pending and wait. The next flush then writes every waiting commit at once, so a busy system
+    flushes far less often than once per commit.
+
+    If a flush fails, part of the batch may already be in the file, so it cannot safely be written again.
+    The journal is marked as failed instead, and every commit not already on disk raises an OSError.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, "a", encoding="utf-8")
+        self.pending = []
+        self.appended = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.error = None
+        self.flushing = False
+        self.lock = threading.Lock()
+        self.flush_finished = threading.Condition(self.lock)
+
+    def append(self, changes):
+        """Adds the changes of one commit to pending, in commit order. Returns a ticket to pass to wait_for_flush."""
+        with self.lock:
+            self.pending.extend(json.dumps(change) + "\n" for change in changes)
+            self.appended += 1
+            return self.appended
+
+    def wait_for_flush(self, ticket):
+        """
+        Waits until the commit with the given ticket is on disk, flushing every waiting commit if no one else is.
+        Raises an OSError if the journal has failed before the commit was written.
+        """
+        with self.lock:
+            while self.flushed < ticket:
+                if self.error is not None:
+                    raise OSError(f"The journal failed, so commit {ticket} was not written.") from self.error
+
+                if self.flushing:
+                    self.flush_finished.wait()
+                    continue
+
+                self.flushing = True
+                lines = self.pending
+                self.pending = []
+                last_ticket = self.appended
+
+                # Other callers can add to pending while this batch is written
+                failure = None
+                self.lock.release()
+                try:
+                    self.file.writelines(lines)
+                    self.file.flush()
+                    os.fsync(self.file.fileno())
+                except OSError as error:
+                    failure = error
+                    raise
+                finally:
+                    self.lock.acquire()
+                    self.error = failure if failure is not None else self.error
+                    self.flushing = False
+                    self.flush_finished.notify_all()
+
+                self.flushed = last_ticket
+                self.flushes += 1
+
+    def commit(self, changes):
+        """Writes the changes of one commit to disk, returning once they are durable."""
+        self.wait_for_flush(self.append(changes))
+
+    def close(self):
+        """Writes any waiting commits and closes the file, even if the journal has failed."""
+        try:
+            self.wait_for_flush(self.appended)
+        finally:
+            self.file.close()
+
+
+class Transaction:
+    """
+    A group of changes to books, users and loans that are kept or undone together. Contains the following attributes:
+
+    - undo_steps (list) - The steps that reverse each change made so far, as (function, arguments)
+    - changes (list) - The changes published to the feed once the transaction is committed
+    """
+
+    def __init__(self):
+        self.undo_steps = []
+        self.changes = []
+
+
+class TransactionManager:
+    """
+    Groups several changes to books, users and loans into one transaction, so either every change is kept or,
+    if an error happens part way through, none of them are. Contains the following attributes:
+
+    - feed (ChangeFeed) - Changes made inside a transaction are held back and only published when it commits
+    - journal (Journal) - Optional. Every committed transaction is written to the journal before it completes
+    - active (Transaction) - The transaction currently open in the calling thread, or None
+    - writer (Thread) - The only thread allowed to make changes, e.g. the thread applying a replication
+      leader's changes to a read only follower. None allows every thread to make changes.
+
+    Each thread has its own active transaction, so a change made by another thread, e.g. a replication or
+    simulation thread, is never recorded in or undone with a transaction it was not part of. Transactions
+    themselves still run one at a time, as they hold lock until they commit.
+
+    The BookList, UserList and Loans classes call record_undo each time they change something, giving the step
+    that reverses the change. Outside a transaction record_undo does nothing. They call check_writable before
+    making a change, so it is refused before anything has been changed.
+
+    Usage:
+    with transactions.transaction():
+        loans.close_loan(first_title, username)
+        loans.close_loan(second_title, username)
+    """
+
+    def __init__(self, feed, journal=None):
+        self.feed = feed
+        self.journal = journal
+        self.local = threading.local()
+        self.writer = None
+        self.lock = threading.RLock()
+        self.commits = 0
+        self.rollbacks = 0
+
+    @property
+    def active(self):
+        """The transaction currently open in the calling thread, or None."""
+        return getattr(self.local, "active", None)
+
+    @active.setter
+    def active(self, transaction):
+        self.local.active = transaction
+
+    def check_writable(self):
+        """Raises a PermissionError if the calling thread is not allowed to make changes."""
+        if self.writer is not None and self.writer is not threading.current_thread():
+            raise PermissionError("This copy of the Library System is read only.")
+
+    def record_undo(self, function, *arguments):
+        """Records the step that reverses a change, if a transaction is open."""
+        if self.active is not None:
+            self.active.undo_steps.append((function, arguments))
+
+    @contextmanager
+    def transaction(self):
+        """
+        Opens a transaction, committing it when the with block finishes or rolling it back if an error is raised.
+        A transaction opened inside another one joins the outer transaction.
+
+        The journal is flushed after the transaction has committed, i.e. after its changes are made in memory and
+        published to the feed, where other transactions and followers may already be using them. So if the flush
+        fails, the OSError raised here means the changes are kept but may not be on disk. They are not rolled
+        back, and as the journal stays failed every later transaction also commits and then raises an OSError.
+        """
+        with self.lock:
+            if self.active is not None:
+                yield self.active
+                return
+
+            transaction = Transaction()
+            self.active = transaction
+            self.feed.held = []
+            try:
+                yield transaction
+            except BaseException:
+                self.rollback(transaction)
+                raise
+
+            self.active = None
+            held_changes = self.feed.held
+            self.feed.held = None
+            transaction.changes = [self.feed.publish(*change) for change in held_changes]
+            self.commits += 1
+
+            # Added to the journal in commit order, but flushed after other callers can start their transactions
+            ticket = self.journal.append(transaction.changes) if self.journal else None
+
+        if ticket is not None:
+            self.journal.wait_for_flush(ticket)
+
+    def rollback(self, transaction):
+        """Reverses every change made in a transaction, newest first, and discards its held back changes."""
+        self.active = None
+        try:
+            for function, arguments in reversed(transaction.undo_steps):
+                function(*arguments)
+        finally:
+            self.feed.held = None
+            self.rollbacks += 1
@@ -3,6 +3,29 @@ from datetime import datetime
 from utils import control_user_choice
 from utils import retry_func
 from utils import validate_text
+from utils import intern_text
+from utils import browse_pages
+from Stats import LibraryStats
+from Clock import SystemClock
+from Indexes import PostcodeIndex
+from Indexes import DateOfBirthIndex
+from Indexes import SortedIndex
+from Filters import ScalableBloomFilter
+from Tracing import Tracer
+from Tracing import traced
+from CommandLog import CommandLog
+from Duplicates import DuplicateDetector
+from ChangeFeed import ChangeFeed
+from ChangeFeed import plain_value
+from ChangeFeed import user_data
+from Transactions import TransactionManager
+
+# Age bands used for age reporting, as (youngest age, oldest age)
+AGE_BANDS = {
+    "Under 16": (0, 15),
+    "16 to 64": (16, 64),
+    "65 and over": (65, 110),
+}
 
 
 class Users:
@@ -22,7 +45,7 @@ class Users:
 
     Contains methods to:
     - Retrieve user attributes i.e. return_username
-    - Edit each user attribute
+    - Edit each user attribute, through a UserList so its indexes stay up to date and the change can be undone
     - String representation method for cleanly display
     """
 
@@ -73,27 +96,27 @@ class Users:
         """Returns the date of birth of the User object"""
         return self.date_of_birth
 
-    def edit_firstname(self, new_firstname):
-        """Takes user input to edit a users firstname"""
-        self.firstname = new_firstname
+    def edit_firstname(self, new_firstname, user_list):
+        """Changes a users firstname through user_list, recording the change so it can be undone"""
+        user_list.edit_user(self, "firstname", new_firstname)
         print(f"Firstname was updated to '{new_firstname}'")
         print("Returning to Edit Menu")
 
-    def edit_surname(self, new_surname):
-        """Takes user input to edit a users surname"""
-        self.surname = new_surname
+    def edit_surname(self, new_surname, user_list):
+        """Changes a users surname through user_list, recording the change so it can be undone"""
+        user_list.edit_user(self, "surname", new_surname)
         print(f"Surname was updated to '{new_surname}'")
         print("Returning to Edit Menu")
 
-    def edit_email_address(self, new_email):
-        """Takes user input to edit a users email address"""
-        self.email_address = new_email
+    def edit_email_address(self, new_email, user_list):
+        """Changes a users email address through user_list, recording the change so it can be undone"""
+        user_list.edit_user(self, "email_address", new_email)
         print(f"Email address was updated to '{new_email}'")
         print("Returning to Edit Menu")
 
-    def edit_dob(self, new_dob):
-        """Takes user input to edit a users date of birth"""
-        self.date_of_birth = new_dob
+    def edit_dob(self, new_dob, user_list):
+        """Changes a users date of birth through user_list, recording the change so it can be undone"""
+        user_list.edit_user(self, "date_of_birth", new_dob)
         print(f"Date of birth was updated to '{new_dob}'")
         print("Returning to Edit Menu")
 
@@ -110,17 +133,98 @@ class UserList:
     - Save users in a dictionary for easy lookup
 
     - users_dict (dict) stores our users objects, using a users username as its key.
+    - stats (LibraryStats) keeps running totals of the system, shared with the BookList and Loans classes.
+    - postcode_index (PostcodeIndex) groups users by postcode area, district and sector for locality searches.
+    - dob_index (DateOfBirthIndex) keeps users sorted by date of birth for age searches and birthdays.
+    - username_order (SortedIndex) keeps users sorted by username, for browsing every user a page at a time.
+    - username_filter (ScalableBloomFilter) rules out usernames that are not taken without looking in users_dict.
+    - clock (SystemClock) provides the current date, and can be replaced with a SimulatedClock.
+    - command_log (CommandLog) records each change to a user so it can be undone, shared with the BookList class.
+    - duplicates (DuplicateDetector) finds users that may be the same person signed up more than once.
+    - feed (ChangeFeed) publishes every change to a user for other systems to follow, shared with the BookList class.
+    - transactions (TransactionManager) groups changes so they are kept or undone together, shared with the
+      BookList class.
+    - tracer (Tracer) times the core user operations and profiles any that are slow, shared with the BookList class.
 
     - Leverages retry_func from utils.py, which provides the user the choice to retry whatever
       process they were performing. i.e. title was not found, retry.
     """
 
-    def __init__(self):
+    def __init__(self, stats=None, clock=None, command_log=None, feed=None, transactions=None, tracer=None):
         self.users_dict = {}
-
+        self.stats = stats if stats is not None else LibraryStats()
+        self.clock = clock if clock is not None else SystemClock()
+        self.command_log = command_log if command_log is not None else CommandLog()
+        self.duplicates = DuplicateDetector()
+        self.postcode_index = PostcodeIndex()
+        self.dob_index = DateOfBirthIndex()
+        self.username_order = SortedIndex()
+        self.username_filter = ScalableBloomFilter()
+        self.feed = feed if feed is not None else ChangeFeed()
+        self.transactions = transactions if transactions is not None else TransactionManager(self.feed)
+        self.tracer = tracer if tracer is not None else Tracer()
+
+    @traced
     def save_user(self, username, new_user):
         """Saves a user to the user dictionary using a users username as the key."""
+        self.transactions.check_writable()
         self.users_dict[username] = new_user
+        self.stats.user_added()
+        self.postcode_index.add(new_user)
+        self.dob_index.add(new_user)
+        self.duplicates.add(new_user)
+        self.username_order.add((username,))
+        self.username_filter.add(username)
+        self.transactions.record_undo(self.delete_user, username)
+        self.feed.publish("user", "add", user_data(new_user))
+
+    @traced
+    def delete_user(self, username):
+        """Deletes a user from the user dictionary."""
+        self.transactions.check_writable()
+        user = self.users_dict.pop(username)
+        self.stats.user_removed()
+        self.postcode_index.remove(user)
+        self.dob_index.remove(user)
+        self.duplicates.remove(user)
+        self.username_order.remove((username,))
+        self.transactions.record_undo(self.save_user, username, user)
+        self.feed.publish("user", "remove", {"username": username})
+
+    @traced
+    def update_user(self, user, attribute, new_value):
+        """Changes a single attribute of an existing user, keeping the user indexes updated."""
+        self.transactions.check_writable()
+        old_value = getattr(user, attribute)
+        if attribute == "postcode":
+            self.postcode_index.remove(user)
+        elif attribute == "date_of_birth":
+            self.dob_index.remove(user)
+        self.duplicates.remove(user)
+
+        setattr(user, attribute, new_value)
+
+        if attribute == "postcode":
+            self.postcode_index.add(user)
+        elif attribute == "date_of_birth":
+            self.dob_index.add(user)
+        self.duplicates.add(user)
+
+        self.transactions.record_undo(self.update_user, user, attribute, old_value)
+        self.feed.publish("user", "update", {"username": user.username, "attribute": attribute,
+                                             "value": plain_value(new_value)})
+
+    def edit_user(self, user, attribute, new_value):
+        """Edits a user attribute from the editor menu, recording the change so it can be undone."""
+        self.command_log.record("user", "update", user, attribute, getattr(user, attribute), new_value)
+        self.update_user(user, attribute, new_value)
+
+    @traced
+    def find_user(self, username):
+        """Returns the user with the given username, or None. Usernames ruled out by username_filter are not checked."""
+        if username not in self.username_filter:
+            return None
+        return self.users_dict.get(username)
 
     def set_username(self):
         """
@@ -134,7 +238,7 @@ class UserList:
                 print("Username must not be empty. Try again.")
             elif not (6 <= len(username) <= 15):
                 print("Username must be between 6 and 15 characters. Please try again.")
-            elif username in self.users_dict:
+            elif self.find_user(username):
                 print(f"Username: {username} is already taken. Please try another username.")
             else:
                 print("Username accepted.")
@@ -208,18 +312,23 @@ class UserList:
         street_name = input("Street name: ")
         validate_street_name = validate_text(street_name, "Street name")
         print("Street name accepted.")
-        return validate_street_name.title()
+        return intern_text(validate_street_name.title())
 
-    def set_postcode(self):
+    def set_postcode(self, new_user):
         """
-        Takes user input to set the postcode of the new user. Uses the re module to validate
-        the input using UK postcode format.
+        Takes user input to set the postcode of the user. Uses the re module to validate
+        the input using UK postcode format. Uses new_user as a boolean to indicate whether logic is for
+        a new user or existing one.
         """
 
         # Regex pattern for UK postcodes
         postcode_format = r"^[A-Z]{1,2}[0-9][A-Z0-9]?\s?[0-9][A-Z]{2}$"
 
-        print("Please write a valid UK postcode for this new user")
+        if new_user:
+            print("Please write a valid UK postcode for this new user")
+
+        elif not new_user:
+            print("Please write a new UK postcode to update this user.")
 
         while True:
             print("Example postcode: SW1A 1AA")
@@ -295,9 +404,10 @@ class UserList:
                 validate_dob = datetime.strptime(dob, "%Y-%m-%d").date()
 
                 # Validate new user dob.
-                if validate_dob >= datetime.now().date():
+                today_date = self.clock.today()
+                if validate_dob >= today_date:
                     print("The date of birth entered cannot be in the future. Please try again.")
-                elif (datetime.now().year - validate_dob.year) > 110:
+                elif (today_date.year - validate_dob.year) > 110:
                     print("Year is too far below the current year. Please try again")
                 else:
                     print("Date of birth accepted.")
@@ -321,14 +431,27 @@ class UserList:
         surname = self.set_surname(new_user=True)
         house_number = self.set_house_number()
         street_name = self.set_street_name()
-        postcode = self.set_postcode()
+        postcode = self.set_postcode(new_user=True)
         email = self.set_email(new_user=True)
         date_of_birth = self.set_dob(new_user=True)
 
         # Create and save the user
         new_user = Users(username, firstname, surname, house_number, street_name, postcode, email, date_of_birth)
+
+        # Check the user has not already signed up under a different username
+        matches = self.duplicates.find_matches(new_user, self.users_dict)
+        if matches:
+            print("This user may already be in the system:")
+            for score, match_username in matches:
+                user = self.users_dict[match_username]
+                print(f"Username: {match_username}, Full Name: {user.firstname} {user.surname}, Match: {score:.0%}")
+            if not retry_func("Add this user anyway"):
+                print("The new user was not added. Returning to User Menu")
+                return
+
         print(f"A new user: '{new_user.username}' was successfully added to the system.")
         self.save_user(new_user.username, new_user)
+        self.command_log.record("user", "add", new_user)
 
     def remove_single_user(self, matching_users):
         """
@@ -346,7 +469,8 @@ class UserList:
         print(f"User: {user_attribute.firstname} {user_attribute.surname}.")
         print("Would you like to proceed to remove this user?")
         if retry_func("Remove user"):
-            del self.users_dict[username]
+            self.delete_user(username)
+            self.command_log.record("user", "remove", user_attribute)
             print(f"{user_attribute.firstname} {user_attribute.surname} has been removed from the system.")
             print("Returning to User Menu")
             return
@@ -444,8 +568,8 @@ class UserList:
                 print("Username cannot be empty")
                 continue
 
-            if username_to_find in self.users_dict:
-                user = self.users_dict[username_to_find]
+            user = self.find_user(username_to_find)
+            if user:
                 return user
             else:
                 print(f"No user found with username: {username_to_find}")
@@ -476,6 +600,119 @@ class UserList:
         print(f"Date of birth: {user.return_dob()}")
         return
 
+    def browse_all_users(self):
+        """
+        Displays every user in the Library System a page at a time, sorted by username.
+        Uses username_order, so each page only looks at the users on that page.
+        """
+        if not self.users_dict:
+            print("There are no users in the Library system database.")
+            return
+
+        def display_entry(entry):
+            user = self.users_dict[entry[0]]
+            print(f"{user.username} - {user.firstname} {user.surname}, {user.postcode}")
+
+        browse_pages(self.username_order.find_page, display_entry)
+
+    def find_users_by_postcode(self):
+        """
+        Displays every user living in a postcode area (e.g. SW), district (e.g. SW1A), sector (e.g. SW1A 1) or
+        full postcode, split into mailing batches. For an area, the number of users in each district is also shown.
+        Uses postcode_index so only the users in that part of the postcode are looked at.
+        """
+        if not self.users_dict:
+            print("There are no users in the Library system database.")
+            return
+
+        print("Please enter a postcode area, district, sector or full postcode. E.g. SW, SW1A, SW1A 1 or SW1A 1AA")
+        prefix = input("Enter here: ").strip()
+        if not prefix:
+            print("Postcode cannot be empty. Returning to User Menu")
+            return
+
+        total_users = self.postcode_index.count(prefix)
+        if not total_users:
+            print(f"No users were found in postcode {prefix.upper()}")
+            return
+
+        print(f"There are {total_users} user(s) in postcode {prefix.upper()}")
+        if prefix.isalpha():
+            for district, count in self.postcode_index.count_by_district(prefix).items():
+                print(f"District {district}: {count} user(s)")
+
+        for batch_number, batch in enumerate(self.postcode_index.mailing_batches(prefix, 10), start=1):
+            print(f"\nMailing batch {batch_number}:")
+            for username in batch:
+                user = self.users_dict[username]
+                print(f"{user.firstname} {user.surname}, {user.house_number} {user.street_name}, {user.postcode}")
+
+    def find_duplicate_users(self):
+        """
+        Displays every pair of users that may be the same person signed up more than once. Uses the duplicates
+        detector so only users with the same surname and date of birth, or the same address, are compared.
+        """
+        if not self.users_dict:
+            print("There are no users in the Library system database.")
+            return
+
+        duplicates = self.duplicates.find_all_duplicates(self.users_dict)
+        if not duplicates:
+            print("No possible duplicate users were found.")
+            return
+
+        print("--- Displaying Possible Duplicate Users ---")
+        for score, username, other_username in duplicates:
+            print(f"{username} and {other_username}, Match: {score:.0%}")
+
+    def set_age_range(self):
+        """Takes user input for a youngest and oldest age, used to search for users by their age."""
+        while True:
+            try:
+                print("Please input the youngest age to search for. E.g. 16")
+                min_age = int(input("Enter here: "))
+                print("Please input the oldest age to search for. E.g. 65")
+                max_age = int(input("Enter here: "))
+
+                if not (0 <= min_age <= max_age <= 110):
+                    print("Ages must be between 0 and 110, and the youngest age must not be above the oldest age.")
+                else:
+                    return min_age, max_age
+
+            except ValueError:
+                print("Age cannot be empty and must be numbers only.")
+
+    def search_users_by_age(self):
+        """
+        Displays the number of users in each age band, any users with a birthday today, and every user aged
+        between two ages. Uses dob_index so only the matching users are looked at.
+        """
+        if not self.users_dict:
+            print("There are no users in the Library system database.")
+            return
+
+        today_date = self.clock.today()
+
+        print("--- Users by Age Band ---")
+        for band, count in self.dob_index.count_by_age_band(AGE_BANDS, today_date).items():
+            print(f"{band}: {count} user(s)")
+
+        birthdays = self.dob_index.find_birthdays(today_date)
+        if birthdays:
+            print(f"\nUsers with a birthday today: {', '.join(sorted(birthdays))}")
+
+        min_age, max_age = self.set_age_range()
+        print(f"\n--- Users aged between {min_age} and {max_age} ---")
+        found = False
+        for username in self.dob_index.find_aged_between(min_age, max_age, today_date):
+            found = True
+            user = self.users_dict[username]
+            print(f"Username: {username}, Full Name: {user.firstname} {user.surname}, "
+                  f"Date of birth: {user.date_of_birth}")
+
+        if not found:
+            print("No users were found in this age range.")
+
     def edit_user_menu(self):
         """
         Provides an additional menu for the User to edit Library user attributes. Contains method calls for the
@@ -502,33 +739,41 @@ class UserList:
             print("2 - Edit Surname")
             print("3 - Edit Email Address")
             print("4 - Edit Date of Birth")
-            print("5 - Exit edit menu")
+            print("5 - Edit Postcode")
+            print("6 - Exit edit menu")
 
             # Gets the users choice and ensures valid input by calling control_user_choice from utils.py
-            user_choice = control_user_choice("Enter here: ", range(1, 6))
+            user_choice = control_user_choice("Enter here: ", range(1, 7))
 
             # Takes the user to the appropriate sub menu or quits the programme
             if user_choice == 1:
                 print(f"Username: {username} has current firstname '{username.firstname}'")
                 new_firstname = self.set_firstname(new_user=False)
-                username.edit_firstname(new_firstname)
+                username.edit_firstname(new_firstname, self)
 
             elif user_choice == 2:
                 print(f"Username: {username} has current surname '{username.surname}'")
                 new_surname = self.set_surname(new_user=False)
-                username.edit_surname(new_surname)
+                username.edit_surname(new_surname, self)
 
             elif user_choice == 3:
                 print(f"Username: {username} has current email address '{username.email_address}'")
                 new_email = self.set_email(new_user=False)
-                username.edit_email_address(new_email)
+                username.edit_email_address(new_email, self)
 
             elif user_choice == 4:
                 print(f"Username: {username} has current date of birth '{username.date_of_birth}'")
                 new_dob = self.set_dob(new_user=False)
-                username.edit_dob(new_dob)
+                username.edit_dob(new_dob, self)
 
             elif user_choice == 5:
+                print(f"Username: {username} has current postcode '{username.postcode}'")
+                new_postcode = self.set_postcode(new_user=False)
+                self.edit_user(username, "postcode", new_postcode)
+                print(f"Postcode was updated to '{new_postcode}'")
+                print("Returning to Edit Menu")
+
+            elif user_choice == 6:
                 print("Returning to User Menu")
                 return
 
@@ -540,6 +785,10 @@ class UserList:
         - Edit user: An editor sub menu is displayed to the user where several user attributes can be updated
         - Total users: Displays to the user the total number of users in the system currently
         - User info: Displays in a neat format all information on record for a specific user
+        - Find by postcode: Displays every user in a postcode area, district or sector in mailing batches
+        - Search by age: Displays users in each age band, birthdays today, and users between two ages
+        - Find duplicates: Displays users that may be the same person signed up more than once
+        - Browse all users: Displays every user a page at a time, sorted by username
 
         - Utilises control_user_choice for clean and safe menu navigation
 
@@ -552,9 +801,13 @@ class UserList:
             print("3 - Edit User Info")
             print("4 - Count Total Users")
             print("5 - Display User info")
-            print("6 - Return to Main Menu")
+            print("6 - Find Users by Postcode")
+            print("7 - Search Users by Age")
+            print("8 - Find Duplicate Users")
+            print("9 - Browse All Users")
+            print("10 - Return to Main Menu")
 
-            user_choice = control_user_choice("Enter here: ", range(1, 7))
+            user_choice = control_user_choice("Enter here: ", range(1, 11))
 
             # Takes the user to the appropriate sub menu or quits the programme
             if user_choice == 1:
@@ -573,5 +826,17 @@ class UserList:
                 self.display_user_info()
 
             elif user_choice == 6:
+                self.find_users_by_postcode()
+
+            elif user_choice == 7:
+                self.search_users_by_age()
+
+            elif user_choice == 8:
+                self.find_duplicate_users()
+
+            elif user_choice == 9:
+                self.browse_all_users()
+
+            elif user_choice == 10:
                 print("Returning to Main Menu..")
                 break
@@ -1,3 +1,6 @@
+import sys
+
+
 def control_user_choice(prompt, menu_range):
     """
     Validates user input to help navigate Menus and user sub menus throughout the programme.
@@ -72,3 +75,37 @@ def validate_text(item,name=" "):
             return item
 
         item = input("Please try again: ")
+
+
+def intern_text(item):
+    """
+    Returns a shared copy of a validated string so values that repeat across many records, such as an
+    author, publisher or street name, are only stored in memory once. Not used for postcodes, which are
+    almost unique to each household. InternBenchmark.py measures the memory saved.
+    Books.py - Author,Publisher.
+    Users.py - Street name.
+    """
+    return sys.intern(item)
+
+
+def browse_pages(find_page, display_entry, page_size=10):
+    """
+    Displays a long list a page at a time, asking the user before showing the next page.
+    find_page takes a cursor and page size, and returns a page of entries and the cursor for the next page,
+    as SortedIndex.find_page does. display_entry prints a single entry.
+    Books.py - Browse all books. Users.py - Browse all users. Loans.py - Browse active loans.
+    """
+    cursor = None
+    page_number = 1
+    while True:
+        entries, cursor = find_page(cursor, page_size)
+        print(f"\n--- Page {page_number} ---")
+        for entry in entries:
+            display_entry(entry)
+
+        if cursor is None:
+            print("End of list.")
+            return
+        if not retry_func("Next page"):
+            return
+        page_number += 1
@@ -0,0 +1,55 @@
+import builtins
+import os
+import sys
+import unittest
+from datetime import date
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from Books import BookList
+from Books import Books
+
+
+class BookListTests(unittest.TestCase):
+
+    def setUp(self):
+        self.book_list = BookList()
+        self.book = Books("Dune", "Frank", 1, "Ace", 5, date(1965, 8, 1))
+        self.book_list.save_book(self.book.title, self.book)
+
+    def assert_stats_correct(self):
+        self.assertEqual(self.book_list.stats.verify_stats(self.book_list.books_dict, {}, {}), {})
+
+    def test_save_book_rejects_a_title_in_use(self):
+        duplicate = Books("Dune", "Other", 2, "Ace", 3, date(2000, 1, 1))
+
+        with self.assertRaisesRegex(ValueError, "already in the collection"):
+            self.book_list.save_book(duplicate.title, duplicate)
+        self.assertIs(self.book_list.books_dict["Dune"], self.book)
+        self.assertEqual(self.book_list.book_titles, {1: "Dune"})
+        self.assert_stats_correct()
+
+    def test_add_new_book_rejects_a_title_in_use(self):
+        answers = iter(["Dune", "Other", "Ace", "3", "2000-01-01"])
+        with mock.patch.object(builtins, "input", lambda prompt="": next(answers)), \
+                mock.patch.object(builtins, "print"):
+            self.book_list.add_new_book()
+
+        self.assertIs(self.book_list.books_dict["Dune"], self.book)
+        self.assertEqual(list(self.book_list.book_titles.values()), ["Dune"])
+        self.assertEqual(len(self.book_list.command_log.undo_log), 0)
+        self.assert_stats_correct()
+
+    def test_update_book_rejects_a_title_in_use(self):
+        other = Books("Emma", "Jane", 2, "Penguin", 2, date(1815, 12, 23))
+        self.book_list.save_book(other.title, other)
+
+        with self.assertRaisesRegex(ValueError, "already in the collection"):
+            self.book_list.update_book(other, "title", "Dune")
+        self.assertEqual(other.title, "Emma")
+        self.assert_stats_correct()
+
+
+if __name__ == "__main__":
+    unittest.main()
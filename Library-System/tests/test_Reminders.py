@@ -0,0 +1,228 @@
+import os
+import socketserver
+import sys
+import threading
+import time
+import unittest
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from Clock import SimulatedClock
+from Indexes import SortedIndex
+from Reminders import ReminderDispatcher
+from Reminders import SMTPPool
+from Users import Users
+
+
+class StubSMTPHandler(socketserver.StreamRequestHandler):
+    """Answers just enough SMTP for smtplib to send a message. Addresses starting with 'bad' are refused."""
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+            if server.connections <= server.drop_first:
+                return
+
+        self.reply("220 stub")
+        in_data = False
+        lines = []
+        for raw_line in self.rfile:
+            line = raw_line.decode("utf-8").rstrip("\r\n")
+            if in_data:
+                if line == ".":
+                    in_data = False
+                    with server.lock:
+                        server.messages.append("\n".join(lines))
+                    lines = []
+                    self.reply("250 queued")
+                else:
+                    lines.append(line)
+                continue
+
+            command = line[:4].upper()
+            if command == "MAIL" and "<bad" in line:
+                self.reply("554 sender blocked")
+            elif command == "RCPT" and "<bad" in line:
+                self.reply("550 no such user")
+            elif command == "DATA":
+                in_data = True
+                self.reply("354 go ahead")
+            elif command == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("250 ok")
+
+    def reply(self, text):
+        self.wfile.write((text + "\r\n").encode("utf-8"))
+
+
+class StubSMTPServer(socketserver.ThreadingTCPServer):
+    """A local SMTP server that counts connections and keeps every message, dropping the first drop_first."""
+
+    daemon_threads = True
+
+    def __init__(self, drop_first=0):
+        super().__init__(("127.0.0.1", 0), StubSMTPHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.drop_first = drop_first
+        self.messages = []
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class ReminderDispatcherTests(unittest.TestCase):
+
+    def make_dispatcher(self, drop_first=0, sender="library@example.com", max_connections=1):
+        self.server = StubSMTPServer(drop_first)
+        self.addCleanup(self.server.stop)
+
+        self.clock = SimulatedClock(datetime(2026, 3, 16, 9, 0))
+        self.due_order = SortedIndex()
+        self.users_dict = {}
+        pool = SMTPPool(*self.server.server_address, max_connections=max_connections)
+        dispatcher = ReminderDispatcher(self.due_order, self.users_dict, self.clock, pool, sender=sender,
+                                        backoff=0.01)
+        self.addCleanup(dispatcher.close)
+        return dispatcher
+
+    @contextmanager
+    def recorded_waits(self):
+        """
+        Records the waits between attempts instead of sleeping. Only the dispatcher's sending threads are
+        affected, as patching time.sleep would otherwise also stop other threads, e.g. a tracer's sampler,
+        from sleeping.
+        """
+        waits = []
+        real_sleep = time.sleep
+
+        def sleep(seconds):
+            if threading.current_thread().name.startswith("ThreadPoolExecutor"):
+                waits.append(seconds)
+            else:
+                real_sleep(seconds)
+
+        with mock.patch("Reminders.time.sleep", sleep):
+            yield waits
+
+    def add_loan(self, username, title, due_in_days, email_address=None):
+        if username not in self.users_dict:
+            email_address = email_address or f"{username.lower()}@example.com"
+            self.users_dict[username] = Users(username, "Ann", "Reader", 1, "Library Road", "SW1A 1AA",
+                                              email_address, date(1990, 1, 1))
+        due_date = self.clock.now() + timedelta(days=due_in_days)
+        self.due_order.add((due_date, title, username))
+        return due_date
+
+    def test_failed_connections_are_retried_with_growing_waits(self):
+        dispatcher = self.make_dispatcher(drop_first=2)
+        self.add_loan("Readera", "Dune", -3)
+
+        with self.recorded_waits() as waits:
+            self.assertEqual(dispatcher.dispatch(), (1, 0))
+
+        self.assertEqual(waits, [0.01, 0.02])
+        self.assertEqual(self.server.connections, 3)
+        self.assertEqual(len(self.server.messages), 1)
+
+    def test_gives_up_after_max_attempts(self):
+        dispatcher = self.make_dispatcher(drop_first=10)
+        self.add_loan("Readera", "Dune", -3)
+
+        with self.recorded_waits():
+            self.assertEqual(dispatcher.dispatch(), (0, 1))
+        self.assertEqual(self.server.connections, dispatcher.max_attempts)
+        self.assertEqual(dispatcher.sent, {})
+
+    def test_refused_recipient_is_not_retried(self):
+        dispatcher = self.make_dispatcher()
+        self.add_loan("Readera", "Dune", -3, email_address="bad.address@example.com")
+
+        with self.recorded_waits() as waits:
+            self.assertEqual(dispatcher.dispatch(), (0, 1))
+        self.assertEqual(waits, [])
+        self.assertEqual(self.server.messages, [])
+
+    def test_permanent_server_error_is_not_retried(self):
+        dispatcher = self.make_dispatcher(sender="bad.sender@example.com")
+        self.add_loan("Readera", "Dune", -3)
+
+        with self.recorded_waits() as waits:
+            self.assertEqual(dispatcher.dispatch(), (0, 1))
+        self.assertEqual(waits, [])
+        self.assertEqual(self.server.connections, 1)
+
+    def test_connection_is_reused_between_emails(self):
+        dispatcher = self.make_dispatcher()
+        for username in ("Readera", "Readerb", "Readerc"):
+            self.add_loan(username, "Dune", -3)
+
+        self.assertEqual(dispatcher.dispatch(), (3, 0))
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(len(self.server.messages), 3)
+
+    def test_one_email_per_user_listing_every_book(self):
+        dispatcher = self.make_dispatcher()
+        self.add_loan("Readera", "Dune", -3)
+        self.add_loan("Readera", "Emma", 1)
+        self.add_loan("Readera", "Ulysses", 30)
+
+        self.assertEqual(dispatcher.dispatch(), (1, 0))
+        message = self.server.messages[0]
+        self.assertIn("'Dune'", message)
+        self.assertIn("'Emma'", message)
+        self.assertNotIn("'Ulysses'", message)
+
+    def test_notices_are_not_sent_twice(self):
+        dispatcher = self.make_dispatcher()
+        self.add_loan("Readera", "Emma", 1)
+
+        self.assertEqual(dispatcher.dispatch(), (1, 0))
+        self.assertEqual(dispatcher.dispatch(), (0, 0))
+        self.assertEqual(len(self.server.messages), 1)
+
+    def test_overdue_notices_are_repeated(self):
+        dispatcher = self.make_dispatcher()
+        self.add_loan("Readera", "Dune", -3)
+
+        self.assertEqual(dispatcher.dispatch(), (1, 0))
+        self.clock.advance_by(timedelta(days=dispatcher.overdue_repeat_days))
+        self.assertEqual(dispatcher.dispatch(), (1, 0))
+
+    def test_concurrent_collections_claim_each_user_once(self):
+        dispatcher = self.make_dispatcher()
+        self.add_loan("Readera", "Dune", -3)
+
+        self.assertEqual(list(dispatcher.collect_notices()), ["Readera"])
+        self.assertEqual(dispatcher.collect_notices(), {})
+        self.assertEqual(dispatcher.sending, {"Readera"})
+
+    def test_unknown_users_are_released(self):
+        dispatcher = self.make_dispatcher()
+        self.add_loan("Readera", "Dune", -3)
+        del self.users_dict["Readera"]
+
+        self.assertEqual(dispatcher.queue_notices(), {})
+        self.assertEqual(dispatcher.sending, set())
+
+    def test_sent_notices_of_returned_loans_are_forgotten(self):
+        dispatcher = self.make_dispatcher()
+        due_date = self.add_loan("Readera", "Dune", -3)
+        self.add_loan("Readera", "Emma", 1)
+        dispatcher.dispatch()
+
+        self.due_order.remove((due_date, "Dune", "Readera"))
+        dispatcher.collect_notices()
+        self.assertEqual([notice[0] for notice in dispatcher.sent["Readera"]], ["Emma"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import os
+import sys
+import unittest
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from Books import Books
+from Sharding import CatalogShard
+from Users import Users
+
+
+class CatalogShardTests(unittest.TestCase):
+
+    def setUp(self):
+        self.shard = CatalogShard()
+        self.shard.do_add_book(Books("Dune", "Frank", 1, "Ace", 5, date(1965, 8, 1)))
+        self.shard.do_add_user(Users("Readera", "Ann", "Reader", 1, "Library Road", "SW1A 1AA", "readera@example.com",
+                                     date(1990, 1, 1)))
+
+    def test_a_second_prepare_for_the_same_loan_is_refused(self):
+        self.assertTrue(self.shard.do_prepare_copy(1, "Dune", "Readera"))
+        self.assertFalse(self.shard.do_prepare_copy(2, "Dune", "Readera"))
+        self.assertFalse(self.shard.do_borrow("Dune", "Readera"))
+        self.assertEqual(self.shard.held_copies, {"Dune": 1})
+
+        self.assertTrue(self.shard.do_commit(1))
+        self.assertEqual(self.shard.book_list.books_dict["Dune"].stock, 4)
+
+    def test_commit_is_refused_when_the_loan_already_exists(self):
+        self.assertTrue(self.shard.do_prepare_copy(1, "Dune", "Readera"))
+        self.shard.prepared[2] = self.shard.prepared[1]
+        self.shard.held_copies["Dune"] += 1
+
+        self.assertTrue(self.shard.do_commit(1))
+        self.assertFalse(self.shard.do_commit(2))
+        self.assertEqual(self.shard.held_copies, {})
+        self.assertEqual(self.shard.book_list.books_dict["Dune"].stock, 4)
+        self.assertEqual(len(self.shard.loans.books_on_loan), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
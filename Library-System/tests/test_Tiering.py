@@ -0,0 +1,54 @@
+import os
+import sys
+import tempfile
+import unittest
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from Books import Books
+from Tiering import TieredBookList
+
+
+class TieredBookListTests(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # Only the most recently used book fits in memory, so every lookup moves another book to disk
+        self.book_list = TieredBookList(os.path.join(directory.name, "books"), max_bytes=1)
+        self.addCleanup(self.book_list.close)
+        for book_id, title in enumerate(["Dune", "Emma", "Ulysses"]):
+            self.book_list.save_book(title, Books(title, "Author", book_id, "Publisher", 3, date(2000, 1, 1)))
+
+    def assert_stats_correct(self):
+        self.assertEqual(self.book_list.stats.verify_stats(self.book_list.books_dict, {}, {}), {})
+
+    def test_changes_to_a_book_moved_to_disk_are_kept(self):
+        held_book = self.book_list.find_book("Dune")
+        self.book_list.find_book("Emma")
+
+        self.book_list.update_book(held_book, "stock", 7)
+        self.book_list.find_book("Emma")
+        self.book_list.change_loan_stock(held_book, -1)
+        self.book_list.find_book("Emma")
+        self.book_list.change_loan_stock(held_book, 1)
+        self.book_list.find_book("Emma")
+
+        self.assertEqual(self.book_list.find_book("Dune").stock, 7)
+        self.assertEqual(held_book.stock, 7)
+        self.assert_stats_correct()
+
+    def test_deleting_a_book_moved_to_disk_removes_its_stored_stock(self):
+        held_book = self.book_list.find_book("Dune")
+        self.book_list.find_book("Emma")
+        self.book_list.update_book(self.book_list.find_book("Dune"), "stock", 5)
+        self.book_list.find_book("Emma")
+
+        self.book_list.delete_book(held_book)
+        self.assertNotIn("Dune", self.book_list.books_dict)
+        self.assert_stats_correct()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from ChangeFeed import ChangeFeed
+from Transactions import TransactionManager
+
+
+class TransactionManagerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.feed = ChangeFeed()
+        self.transactions = TransactionManager(self.feed)
+
+    def test_changes_are_published_after_a_failed_undo_step(self):
+        def failing_undo():
+            raise RuntimeError("undo failed")
+
+        with self.assertRaises(RuntimeError):
+            with self.transactions.transaction():
+                self.transactions.record_undo(failing_undo)
+                raise KeyError("change failed")
+
+        self.assertIsNone(self.feed.held)
+        self.assertIsNone(self.transactions.active)
+        self.assertEqual(self.transactions.rollbacks, 1)
+        self.assertIsNotNone(self.feed.publish("book", "add", {"title": "Dune"}))
+
+
+if __name__ == "__main__":
+    unittest.main()